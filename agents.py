@@ -1,9 +1,9 @@
 # agents.py
 from crewai import Agent
 from api_utils import (
-    list_workspace_documents, list_all_custom_documents, get_headers
+    setup_api, set_usage_log, list_workspace_documents, list_all_custom_documents, chat_with_workspace
 )
-import requests
+from usage_log import UsageLog
 import os
 from dotenv import load_dotenv
 
@@ -19,20 +19,21 @@ if not OPENAI_API_KEY:
 # Configurar o CrewAI para usar OpenAI
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
+STATE_DB = os.getenv("STATE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_state.db"))
+
+def init_agents():
+    """Configura o api_utils e o registro de uso (no mesmo banco do bot) para as ferramentas dos agentes.
+
+    Chame no ponto de entrada antes de executar os agentes; importar o módulo não abre o banco.
+    """
+    if ANYTHINGLLM_API and ANYTHINGLLM_API_KEY:
+        setup_api(ANYTHINGLLM_API, ANYTHINGLLM_API_KEY)
+    set_usage_log(UsageLog(STATE_DB))
+
 # Função para consultar o chat do AnythingLLM
 def fetch_anythingllm_chat(query, workspace_slug, session_id):
-    url = f"{ANYTHINGLLM_API}/v1/workspace/{workspace_slug}/chat"
-    payload = {
-        "message": query,
-        "mode": "chat",
-        "sessionId": session_id,
-        "attachments": []
-    }
-    headers = get_headers()
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=600, verify=False)
-        response.raise_for_status()
-        data = response.json()
+        data = chat_with_workspace(workspace_slug, query, session_id)
         return data.get("textResponse", "")
     except Exception as e:
         return f"Erro ao buscar dados via chat: {str(e)}"
@@ -2,6 +2,14 @@ import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 import logging
 import json
+import os
+import random
+import threading
+import time
+import asyncio
+import contextvars
+import functools
+from contextlib import contextmanager
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
@@ -10,43 +18,267 @@ logger = logging.getLogger(__name__)
 API_BASE = None
 API_KEY = None
 
+# Registro de uso do /chat (usage_log.UsageLog), configurado por set_usage_log
+USAGE_LOG = None
+
+# Política de resiliência para as chamadas ao AnythingLLM
+RETRY_ATTEMPTS = int(os.getenv("ANYTHINGLLM_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("ANYTHINGLLM_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("ANYTHINGLLM_RETRY_MAX_DELAY", "8"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("ANYTHINGLLM_BREAKER_FAILURES", "5"))
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv("ANYTHINGLLM_BREAKER_RECOVERY", "30"))
+
+# Tempo de espera pela resposta do update-embeddings antes de seguir acompanhando por polling
+EMBED_SUBMIT_TIMEOUT = float(os.getenv("EMBED_SUBMIT_TIMEOUT", "15"))
+
+# Cache das listagens de documentos (por workspace e global)
+DOCUMENT_CACHE_TTL = float(os.getenv("DOCUMENT_CACHE_TTL", "30"))
+ALL_DOCUMENTS_CACHE_KEY = "*"
+_document_cache = {}
+_document_cache_generation = 0
+_document_cache_lock = threading.Lock()
+
+# Configurações de workspace (chave, valor) já reportadas como não aplicadas pelo servidor
+_UNAPPLIED_SETTINGS = set()
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """O circuito do grupo de endpoints está aberto; a chamada falha sem ir à rede."""
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """O orçamento de tempo do turno do usuário acabou antes da chamada."""
+
+class CircuitBreaker:
+    """Circuit breaker por grupo de endpoints: fechado -> aberto após falhas seguidas -> meio-aberto após o tempo de recuperação."""
+
+    CLOSED = "fechado"
+    OPEN = "aberto"
+    HALF_OPEN = "meio-aberto"
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_timeout=BREAKER_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # Meio-aberto: deixa passar uma única requisição de teste
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuito '{self.name}' fechado novamente.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Libera a requisição de teste do meio-aberto sem contar sucesso nem falha."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuito '{self.name}' aberto após {self.failures} falhas.")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+BREAKERS = {group: CircuitBreaker(group) for group in ("system", "workspaces", "documents", "chat", "embeddings", "search")}
+
+_DEADLINE = contextvars.ContextVar("anythingllm_deadline", default=None)
+
+@contextmanager
+def deadline(seconds):
+    """Define um orçamento total de tempo para as chamadas ao AnythingLLM feitas dentro do bloco."""
+    new_deadline = time.monotonic() + seconds
+    current = _DEADLINE.get()
+    if current is not None:
+        new_deadline = min(new_deadline, current)
+    token = _DEADLINE.set(new_deadline)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+def _on_event_loop():
+    """True se a chamada está rodando na thread de um event loop (fora do run_blocking)."""
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+def remaining_time():
+    """Segundos restantes no orçamento atual, ou None se não houver prazo."""
+    current = _DEADLINE.get()
+    return None if current is None else current - time.monotonic()
+
+def api_request(method, path, group, timeout, retries=None, headers=None, read_timeout_ok=False, **kwargs):
+    """Faz uma requisição ao AnythingLLM com circuit breaker, prazo do turno e retry com backoff.
+
+    Por padrão apenas GETs (idempotentes) são repetidos. Erros de rede (conexão, timeouts,
+    respostas truncadas) e respostas 5xx contam para o circuito; respostas 4xx são devolvidas
+    como HTTPError. Chamada direto no event loop, não espera o backoff para repetir.
+    Com read_timeout_ok, um ReadTimeout (pedido aceito, servidor ainda processando) é
+    repassado ao chamador sem alterar o circuito.
+    """
+    breaker = BREAKERS[group]
+    attempts = retries if retries is not None else (RETRY_ATTEMPTS if method == "GET" else 1)
+    last_error = None
+    for attempt in range(1, attempts + 1):
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"Circuito '{group}' aberto; AnythingLLM sobrecarregado ou indisponível.")
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Prazo esgotado antes de chamar {path}.")
+        effective_timeout = timeout if remaining is None else min(timeout, remaining)
+        try:
+            response = requests.request(
+                method, f"{API_BASE}{path}", headers=headers or get_headers(),
+                timeout=effective_timeout, verify=False, **kwargs
+            )
+        except requests.exceptions.ReadTimeout as e:
+            if read_timeout_ok:
+                # Não há como distinguir "ainda processando" de "travado": o circuito fica como está
+                breaker.release_probe()
+                raise
+            breaker.record_failure()
+            last_error = e
+        except requests.exceptions.RequestException as e:
+            breaker.record_failure()
+            last_error = e
+        except BaseException:
+            # Erro fora da rede (ex.: argumento inválido): não bloqueia o meio-aberto
+            breaker.release_probe()
+            raise
+        else:
+            if response.status_code < 500:
+                breaker.record_success()
+                response.raise_for_status()
+                return response
+            breaker.record_failure()
+            last_error = requests.exceptions.HTTPError(f"{response.status_code} em {path}", response=response)
+        if attempt < attempts and _on_event_loop():
+            logger.warning(f"api_request chamado no event loop para {path}; sem nova tentativa (use run_blocking).")
+            break
+        if attempt < attempts:
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+            remaining = remaining_time()
+            if remaining is not None:
+                delay = min(delay, max(0, remaining))
+            logger.debug(f"Tentativa {attempt}/{attempts} falhou em {path}; nova tentativa em {delay:.2f}s.")
+            time.sleep(delay)
+    raise last_error
+
 def setup_api(base_url, api_key):
     global API_BASE, API_KEY
     API_BASE = base_url.rstrip('/')
     API_KEY = api_key
     logger.info(f"API configurada com base URL: {API_BASE}")
 
+def set_usage_log(usage_log):
+    global USAGE_LOG
+    USAGE_LOG = usage_log
+
 def get_headers():
     return {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json"
     }
 
+def _cached_listing(key):
+    """Retorna (listagem em cache ou None, geração atual do cache)."""
+    with _document_cache_lock:
+        entry = _document_cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return list(entry[1]), _document_cache_generation
+        return None, _document_cache_generation
+
+def _store_listing(key, value, generation):
+    # Uma invalidação durante a busca torna o resultado potencialmente desatualizado
+    with _document_cache_lock:
+        if generation == _document_cache_generation:
+            _document_cache[key] = (time.monotonic() + DOCUMENT_CACHE_TTL, list(value))
+
+def invalidate_document_cache(workspace_slug=None, all_workspaces=False):
+    """Descarta listagens em cache após uma escrita nossa no AnythingLLM.
+
+    Sem argumentos, descarta a listagem global; workspace_slug descarta a de um workspace;
+    all_workspaces descarta todas (ex.: um documento deletado some de todos os workspaces).
+    """
+    global _document_cache_generation
+    with _document_cache_lock:
+        _document_cache_generation += 1
+        if all_workspaces:
+            _document_cache.clear()
+        elif workspace_slug:
+            _document_cache.pop(workspace_slug, None)
+        else:
+            _document_cache.pop(ALL_DOCUMENTS_CACHE_KEY, None)
+
+async def run_blocking(func, *args, **kwargs):
+    """Executa uma chamada bloqueante em uma thread, preservando o prazo do turno (contextvars)."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(ctx.run, func, *args, **kwargs))
+
+async def gather_calls(**calls):
+    """Executa corrotinas independentes em paralelo e espera todas terminarem.
+
+    Retorna (resultados, erros), ambos indexados pelo nome de cada chamada, para que
+    falhas parciais possam ser reportadas individualmente.
+    """
+    outcomes = await asyncio.gather(*calls.values(), return_exceptions=True)
+    results, errors = {}, {}
+    for name, outcome in zip(calls, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"Falha na chamada paralela '{name}': {str(outcome)}")
+            errors[name] = outcome
+        else:
+            results[name] = outcome
+    return results, errors
+
 def check_api_status():
     try:
-        url = f"{API_BASE}/v1/system"
-        response = requests.get(url, headers=get_headers(), timeout=10, verify=False)
-        response.raise_for_status()
+        api_request("GET", "/v1/system", "system", timeout=10)
         logger.debug("API do AnythingLLM está disponível.")
         return True
     except requests.exceptions.RequestException as e:
         logger.error(f"API do AnythingLLM não disponível: {str(e)}")
         return False
 
-def list_workspaces():
+def list_workspaces(strict=False):
     try:
-        url = f"{API_BASE}/v1/workspaces"
-        response = requests.get(url, headers=get_headers(), timeout=10, verify=False)
-        response.raise_for_status()
+        response = api_request("GET", "/v1/workspaces", "workspaces", timeout=10)
         return response.json().get("workspaces", [])
     except requests.exceptions.RequestException as e:
         logger.error(f"Erro ao listar workspaces: {str(e)}")
+        if strict:
+            raise
         return []
 
-def create_workspace(user_id):
+def create_workspace(user_id, workspace_name=None):
     try:
-        url = f"{API_BASE}/v1/workspace/new"
-        workspace_name = f"telegram-user-{user_id}"
+        workspace_name = workspace_name or f"telegram-user-{user_id}"
         
         # Incluir todas as configurações diretamente no payload de criação
         payload = {
@@ -88,48 +320,89 @@ def create_workspace(user_id):
             "max_tokens": 4096
         }
         
-        response = requests.post(url, json=payload, headers=get_headers(), timeout=10, verify=False)
-        response.raise_for_status()
+        response = api_request("POST", "/v1/workspace/new", "workspaces", timeout=10, json=payload)
         data = response.json()
         workspace_slug = data.get("slug")
         if workspace_slug:
-            logger.info(f"Workspace criado com sucesso para user_id {user_id}: {workspace_slug}")
+            logger.info(f"Workspace {workspace_name} criado com sucesso: {workspace_slug}")
             return workspace_slug
         else:
             logger.error("Slug do workspace não encontrado na resposta.")
             return None
     except requests.exceptions.RequestException as e:
-        logger.error(f"Erro ao criar workspace para user_id {user_id}: {str(e)}")
+        logger.error(f"Erro ao criar workspace {workspace_name}: {str(e)}")
         return None
 
 
 
-def get_or_create_workspace(user_id):
+def check_applied_settings(workspace_slug, settings, workspace):
+    """Compara as configurações enviadas com o workspace devolvido pelo /update e avisa (uma vez por valor) das que não foram aplicadas.
+
+    Versões do AnythingLLM ignoram ou recusam silenciosamente campos e valores que não conhecem.
+    Retorna o dict das configurações divergentes.
+    """
+    mismatched = {key: value for key, value in settings.items() if workspace.get(key) != value}
+    for key, value in mismatched.items():
+        if (key, repr(value)) in _UNAPPLIED_SETTINGS:
+            continue
+        _UNAPPLIED_SETTINGS.add((key, repr(value)))
+        logger.warning(
+            f"O AnythingLLM não aplicou {key}={value!r} no workspace {workspace_slug} "
+            f"(valor devolvido: {workspace.get(key)!r}); verifique se a versão do servidor aceita essa configuração."
+        )
+    return mismatched
+
+def update_workspace_settings(workspace_slug, settings):
+    """Atualiza configurações do workspace (ex.: topN, similarityThreshold). Retorna True em caso de sucesso."""
+    try:
+        response = api_request("POST", f"/v1/workspace/{workspace_slug}/update", "workspaces", timeout=10, json=settings)
+        logger.info(f"Workspace {workspace_slug} atualizado: {json.dumps(settings)}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Erro ao atualizar o workspace {workspace_slug}: {str(e)}")
+        return False
+    try:
+        workspace = response.json().get("workspace") or {}
+    except ValueError:
+        workspace = None
+    if isinstance(workspace, dict):
+        check_applied_settings(workspace_slug, settings, workspace)
+    return True
+
+def get_or_create_workspace(user_id, workspace_name=None):
+    """Retorna o slug do workspace do usuário (ou do workspace workspace_name), criando-o se necessário."""
     workspaces = list_workspaces()
-    workspace_name = f"telegram-user-{user_id}"
+    workspace_name = workspace_name or f"telegram-user-{user_id}"
     for ws in workspaces:
         if ws.get("name") == workspace_name:
             return ws.get("slug")
-    return create_workspace(user_id)
+    return create_workspace(user_id, workspace_name)
 
-def list_workspace_documents(workspace_slug):
+def list_workspace_documents(workspace_slug, strict=False, use_cache=True):
+    """Lista os documentos embedados no workspace. Com strict=True, erros são propagados em vez de retornar []."""
+    cached, generation = _cached_listing(workspace_slug)
+    if use_cache and cached is not None:
+        return cached
     try:
-        url = f"{API_BASE}/v1/workspace/{workspace_slug}/documents"
-        response = requests.get(url, headers=get_headers(), timeout=10, verify=False)
-        response.raise_for_status()
-        return response.json().get("documents", [])
+        response = api_request("GET", f"/v1/workspace/{workspace_slug}/documents", "documents", timeout=10)
+        documents = response.json().get("documents", [])
+        _store_listing(workspace_slug, documents, generation)
+        return documents
     except requests.exceptions.RequestException as e:
         logger.error(f"Erro ao listar documentos do workspace {workspace_slug}: {str(e)}")
+        if strict:
+            raise
         return []
 
 async def upload_file_to_anythingllm(file_path, file_name):
     try:
-        url = f"{API_BASE}/v1/document/upload"
-        files = {'file': (file_name, open(file_path, 'rb'), 'application/octet-stream')}
         headers = get_headers()
         headers.pop("Content-Type")  # Remover para multipart/form-data
-        response = requests.post(url, files=files, headers=headers, timeout=60, verify=False)
-        response.raise_for_status()
+        with open(file_path, 'rb') as f:
+            files = {'file': (file_name, f, 'application/octet-stream')}
+            response = await run_blocking(
+                api_request, "POST", "/v1/document/upload", "documents", timeout=60, headers=headers, files=files
+            )
+        invalidate_document_cache()
         data = response.json()
         location = data.get("documents", [{}])[0].get("location")
         logger.info(f"Arquivo {file_name} enviado ao AnythingLLM com localização: {location}")
@@ -140,31 +413,108 @@ async def upload_file_to_anythingllm(file_path, file_name):
 
 async def update_workspace_embeddings(workspace_slug, adds=None, removes=None):
     try:
-        url = f"{API_BASE}/v1/workspace/{workspace_slug}/update-embeddings"
         payload = {}
         if adds:
             payload["adds"] = adds
         if removes:
             payload["removes"] = removes
-        response = requests.post(url, json=payload, headers=get_headers(), timeout=600, verify=False)
-        response.raise_for_status()
+        await run_blocking(
+            api_request, "POST", f"/v1/workspace/{workspace_slug}/update-embeddings", "embeddings", timeout=600, json=payload
+        )
+        invalidate_document_cache(workspace_slug)
         logger.info(f"Embeddings atualizados no workspace {workspace_slug}: {json.dumps(payload)}")
         return True
     except requests.exceptions.RequestException as e:
         logger.error(f"Erro ao atualizar embeddings no workspace {workspace_slug}: {str(e)}")
         return False
 
-def list_all_custom_documents():
+async def submit_workspace_embeddings(workspace_slug, adds):
+    """Pede o embedding de adds sem esperar o fim do processamento.
+
+    Retorna "done" se o AnythingLLM respondeu dentro de EMBED_SUBMIT_TIMEOUT, "pending" se
+    o pedido foi aceito mas o embedding ainda está em andamento (acompanhe com
+    missing_embeddings) ou None em caso de erro.
+    """
+    payload = {"adds": adds}
+    try:
+        await run_blocking(
+            api_request, "POST", f"/v1/workspace/{workspace_slug}/update-embeddings", "embeddings",
+            timeout=EMBED_SUBMIT_TIMEOUT, read_timeout_ok=True, json=payload
+        )
+        invalidate_document_cache(workspace_slug)
+        logger.info(f"Embeddings atualizados no workspace {workspace_slug}: {json.dumps(payload)}")
+        return "done"
+    except requests.exceptions.ReadTimeout:
+        invalidate_document_cache(workspace_slug)
+        logger.info(f"Embedding em andamento no workspace {workspace_slug}: {json.dumps(payload)}")
+        return "pending"
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Erro ao atualizar embeddings no workspace {workspace_slug}: {str(e)}")
+        return None
+
+def missing_embeddings(workspace_slug, locations):
+    """Retorna as localizações que ainda não aparecem como documentos do workspace (ou None se a consulta falhar)."""
+    try:
+        documents = list_workspace_documents(workspace_slug, strict=True, use_cache=False)
+    except requests.exceptions.RequestException:
+        return None
+    embedded = {doc.get("docpath") for doc in documents if doc.get("docpath")}
+    return [location for location in locations if location not in embedded]
+
+def chat_with_workspace(workspace_slug, message, session_id, timeout=600):
+    """Envia uma mensagem ao chat do workspace e retorna o JSON da resposta. Levanta RequestException em caso de erro."""
+    payload = {
+        "message": message,
+        "mode": "chat",
+        "sessionId": session_id,
+        "attachments": []
+    }
+    started = time.monotonic()
+    data, ok = {}, False
     try:
-        url = f"{API_BASE}/v1/documents"
-        response = requests.get(url, headers=get_headers(), timeout=10, verify=False)
-        response.raise_for_status()
-        documents = response.json().get("documents", {})
-        return list(documents.keys())
+        response = api_request("POST", f"/v1/workspace/{workspace_slug}/chat", "chat", timeout=timeout, json=payload)
+        data, ok = response.json(), True
+        return data
+    finally:
+        if USAGE_LOG is not None:
+            try:
+                USAGE_LOG.record(workspace_slug, session_id, message, data, time.monotonic() - started, ok=ok)
+            except Exception as e:
+                logger.error(f"Erro ao registrar uso do chat: {str(e)}")
+
+def vector_search(workspace_slug, query, top_n=4, score_threshold=None):
+    """Busca vetorial no workspace, sem geração pelo LLM. Retorna a lista de trechos ou [] em caso de erro."""
+    payload = {"query": query, "topN": top_n}
+    if score_threshold is not None:
+        payload["scoreThreshold"] = score_threshold
+    try:
+        response = api_request("POST", f"/v1/workspace/{workspace_slug}/vector-search", "search", timeout=30, json=payload)
+        return response.json().get("results", [])
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Erro na busca vetorial do workspace {workspace_slug}: {str(e)}")
+        return []
+
+def list_all_custom_documents(strict=False, use_cache=True):
+    """Lista as localizações de todos os documentos do AnythingLLM. Com strict=True, erros são propagados."""
+    cached, generation = _cached_listing(ALL_DOCUMENTS_CACHE_KEY)
+    if use_cache and cached is not None:
+        return cached
+    try:
+        response = api_request("GET", "/v1/documents", "documents", timeout=10)
+        documents = list(response.json().get("documents", {}).keys())
+        _store_listing(ALL_DOCUMENTS_CACHE_KEY, documents, generation)
+        return documents
     except requests.exceptions.RequestException as e:
         logger.error(f"Erro ao listar todos os documentos customizados: {str(e)}")
+        if strict:
+            raise
         return []
 
+def find_documents_to_embed(all_documents, workspace_docs):
+    """Retorna, na ordem original, as localizações de all_documents que não estão em workspace_docs."""
+    embedded_locations = {doc.get("docpath") for doc in workspace_docs if doc.get("docpath")}
+    return [loc for loc in all_documents if loc not in embedded_locations]
+
 def get_documents_to_embed(workspace_slug):
     """Retorna uma lista de documentos que estão disponíveis mas não embedados no workspace."""
     try:
@@ -176,10 +526,9 @@ def get_documents_to_embed(workspace_slug):
         
         # Obter documentos já embedados no workspace
         workspace_docs = list_workspace_documents(workspace_slug)
-        embedded_locations = {doc.get("docpath") for doc in workspace_docs if doc.get("docpath")}
         
         # Filtrar documentos que não estão embedados
-        files_to_embed = [loc for loc in all_documents if loc not in embedded_locations]
+        files_to_embed = find_documents_to_embed(all_documents, workspace_docs)
         
         logger.info(f"Encontrados {len(files_to_embed)} documentos para embedding no workspace {workspace_slug}")
         return files_to_embed
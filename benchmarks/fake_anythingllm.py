@@ -0,0 +1,294 @@
+"""Servidor HTTP local que simula a API do AnythingLLM para testes de carga.
+
+Implementa apenas os endpoints usados pelo bot, mantendo o estado em memória.
+Latência e erros podem ser injetados por linha de comando ou pelo construtor.
+
+Uso:
+    python benchmarks/fake_anythingllm.py --port 3001 --latency 0.05 --chat-latency 1.5 --error-rate 0.01
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/api"
+
+
+class FakeAnythingLLMState:
+    def __init__(self, latency=0.0, chat_latency=None, embed_latency=None, error_rate=0.0, jitter=0.0):
+        self.latency = latency
+        self.chat_latency = latency if chat_latency is None else chat_latency
+        self.embed_latency = latency if embed_latency is None else embed_latency
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.workspaces = {}
+        self.documents = {}
+        self.request_count = 0
+
+    def delay(self, base):
+        if base > 0 or self.jitter > 0:
+            time.sleep(max(0.0, base + random.uniform(-self.jitter, self.jitter)))
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class FakeAnythingLLMHandler(BaseHTTPRequestHandler):
+    server_version = "FakeAnythingLLM/1.0"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _read_json(self):
+        body = self._read_body()
+        return json.loads(body) if body else {}
+
+    def _route(self, method):
+        path = self.path.split("?", 1)[0]
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+        with self.state.lock:
+            self.state.request_count += 1
+        if self.state.should_fail():
+            self.state.delay(self.state.latency)
+            self._send_json(500, {"error": "erro injetado"})
+            return
+        for route_method, pattern, handler in ROUTES:
+            if route_method != method:
+                continue
+            match = pattern.fullmatch(path)
+            if match:
+                handler(self, *match.groups())
+                return
+        self._send_json(404, {"error": f"rota não encontrada: {method} {path}"})
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    # Endpoints
+
+    def system(self):
+        self.state.delay(self.state.latency)
+        self._send_json(200, {"settings": {"fake": True}})
+
+    def list_workspaces(self):
+        self.state.delay(self.state.latency)
+        with self.state.lock:
+            workspaces = [{"name": ws["name"], "slug": ws["slug"]} for ws in self.state.workspaces.values()]
+        self._send_json(200, {"workspaces": workspaces})
+
+    def new_workspace(self):
+        payload = self._read_json()
+        self.state.delay(self.state.latency)
+        name = payload.get("name") or f"workspace-{uuid.uuid4().hex[:8]}"
+        slug = re.sub(r"[^a-z0-9-]+", "-", name.lower())
+        with self.state.lock:
+            self.state.workspaces.setdefault(slug, {"name": name, "slug": slug, "documents": set()})
+        self._send_json(200, {"slug": slug, "workspace": {"name": name, "slug": slug}})
+
+    def update_workspace(self, slug):
+        payload = self._read_json()
+        self.state.delay(self.state.latency)
+        with self.state.lock:
+            workspace = self.state.workspaces.get(slug)
+            if workspace is not None:
+                workspace.setdefault("settings", {}).update(payload)
+        if workspace is None:
+            self._send_json(404, {"error": "workspace não encontrado"})
+            return
+        self._send_json(200, {"workspace": {"name": workspace["name"], "slug": slug, **workspace["settings"]}, "message": None})
+
+    def workspace_documents(self, slug):
+        self.state.delay(self.state.latency)
+        with self.state.lock:
+            workspace = self.state.workspaces.get(slug)
+            docpaths = sorted(workspace["documents"]) if workspace else None
+        if docpaths is None:
+            self._send_json(404, {"error": "workspace não encontrado"})
+            return
+        self._send_json(200, {"documents": [{"docpath": docpath} for docpath in docpaths]})
+
+    def chat(self, slug):
+        payload = self._read_json()
+        self.state.delay(self.state.chat_latency)
+        message = payload.get("message", "")
+        with self.state.lock:
+            workspace = self.state.workspaces.get(slug)
+            docpaths = sorted(workspace["documents"])[:3] if workspace else []
+        sources = [{"title": docpath.rsplit("/", 1)[-1], "chunk": f"Trecho de {docpath}"} for docpath in docpaths]
+        body = {
+            "id": uuid.uuid4().hex,
+            "type": "textResponse",
+            "textResponse": f"Resposta simulada para: {message[:200]}",
+            "sources": sources,
+            "close": True,
+            "error": None,
+        }
+        if "gráfico" in message.lower():
+            config = {"type": "bar", "data": {"labels": ["Jan", "Fev"], "datasets": [{"label": "R$", "data": [1, 2]}]}}
+            body["chart"] = {"url": "https://quickchart.io/chart?c=" + json.dumps(config)}
+        self._send_json(200, body)
+
+    def vector_search(self, slug):
+        payload = self._read_json()
+        self.state.delay(self.state.latency)
+        with self.state.lock:
+            workspace = self.state.workspaces.get(slug)
+            docpaths = sorted(workspace["documents"])[:int(payload.get("topN") or 4)] if workspace else None
+        if docpaths is None:
+            self._send_json(404, {"error": "workspace não encontrado"})
+            return
+        results = [
+            {"id": uuid.uuid4().hex, "text": f"Trecho de {docpath} sobre {payload.get('query', '')[:50]}",
+             "metadata": {"title": docpath.rsplit("/", 1)[-1]}, "score": 0.8}
+            for docpath in docpaths
+        ]
+        self._send_json(200, {"results": results})
+
+    def reset_chat(self, slug):
+        self._read_json()
+        self.state.delay(self.state.latency)
+        self._send_json(200, {"success": True})
+
+    def update_embeddings(self, slug):
+        payload = self._read_json()
+        adds = payload.get("adds") or []
+        removes = payload.get("removes") or []
+        self.state.delay(self.state.embed_latency * max(1, len(adds)))
+        with self.state.lock:
+            workspace = self.state.workspaces.get(slug)
+            if workspace is not None:
+                workspace["documents"].update(loc for loc in adds if loc in self.state.documents)
+                workspace["documents"].difference_update(removes)
+        if workspace is None:
+            self._send_json(404, {"error": "workspace não encontrado"})
+            return
+        self._send_json(200, {"workspace": {"slug": slug}})
+
+    def upload_document(self):
+        body = self._read_body()
+        self.state.delay(self.state.latency)
+        match = re.search(rb'filename="([^"]*)"', body)
+        file_name = match.group(1).decode("utf-8", "replace") if match else "arquivo"
+        safe_name = re.sub(r"[^\w.-]+", "-", file_name.rsplit("/", 1)[-1])
+        location = f"custom-documents/{safe_name}-{uuid.uuid4()}.json"
+        with self.state.lock:
+            self.state.documents[location] = {"name": file_name, "size": len(body)}
+        self._send_json(200, {"success": True, "documents": [{"location": location, "title": file_name}]})
+
+    def list_documents(self):
+        self.state.delay(self.state.latency)
+        with self.state.lock:
+            documents = {location: dict(meta) for location, meta in self.state.documents.items()}
+        self._send_json(200, {"documents": documents})
+
+    def delete_document(self):
+        payload = self._read_json()
+        self.state.delay(self.state.latency)
+        location = payload.get("location")
+        with self.state.lock:
+            found = self.state.documents.pop(location, None) is not None
+            for workspace in self.state.workspaces.values():
+                workspace["documents"].discard(location)
+        if not found:
+            self._send_json(404, {"error": "documento não encontrado"})
+            return
+        self._send_json(200, {"success": True})
+
+
+ROUTES = [
+    ("GET", re.compile(r"/v1/system"), FakeAnythingLLMHandler.system),
+    ("GET", re.compile(r"/v1/workspaces"), FakeAnythingLLMHandler.list_workspaces),
+    ("POST", re.compile(r"/v1/workspace/new"), FakeAnythingLLMHandler.new_workspace),
+    ("GET", re.compile(r"/v1/workspace/([^/]+)/documents"), FakeAnythingLLMHandler.workspace_documents),
+    ("POST", re.compile(r"/v1/workspace/([^/]+)/update"), FakeAnythingLLMHandler.update_workspace),
+    ("POST", re.compile(r"/v1/workspace/([^/]+)/chat"), FakeAnythingLLMHandler.chat),
+    ("POST", re.compile(r"/v1/workspace/([^/]+)/chat/reset"), FakeAnythingLLMHandler.reset_chat),
+    ("POST", re.compile(r"/v1/workspace/([^/]+)/vector-search"), FakeAnythingLLMHandler.vector_search),
+    ("POST", re.compile(r"/v1/workspace/([^/]+)/update-embeddings"), FakeAnythingLLMHandler.update_embeddings),
+    ("POST", re.compile(r"/v1/document/upload"), FakeAnythingLLMHandler.upload_document),
+    ("GET", re.compile(r"/v1/documents"), FakeAnythingLLMHandler.list_documents),
+    ("POST", re.compile(r"/v1/document/delete"), FakeAnythingLLMHandler.delete_document),
+]
+
+
+class FakeAnythingLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, **state_options):
+        super().__init__((host, port), FakeAnythingLLMHandler)
+        self.state = FakeAnythingLLMState(**state_options)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador local da API do AnythingLLM")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latência base em segundos")
+    parser.add_argument("--chat-latency", type=float, default=None, help="Latência do /chat em segundos")
+    parser.add_argument("--embed-latency", type=float, default=None, help="Latência por documento no update-embeddings")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variação aleatória da latência em segundos")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de requisições que retornam 500")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    server = FakeAnythingLLMServer(
+        args.host, args.port,
+        latency=args.latency, chat_latency=args.chat_latency, embed_latency=args.embed_latency,
+        jitter=args.jitter, error_rate=args.error_rate
+    )
+    logger.info(f"AnythingLLM simulado em {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Servidor encerrado.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
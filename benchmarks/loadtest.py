@@ -0,0 +1,316 @@
+"""Teste de carga do bot com updates sintéticos do Telegram.
+
+Sobe o AnythingLLM simulado (fake_anythingllm.py), importa o bot.py real e
+chama os handlers diretamente (handle_text, handle_file, despesas via
+process_manual_expense e sync_command) com N usuários concorrentes.
+Ao final reporta mensagens/s e percentis de latência por tipo de operação.
+
+Uso:
+    python benchmarks/loadtest.py --users 20 --messages 10 --chat-latency 0.2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_anythingllm import FakeAnythingLLMServer
+
+OPERATIONS = ("text", "expense", "file", "sync")
+DEFAULT_MIX = "text=6,expense=2,file=1,sync=1"
+
+SAMPLE_QUESTIONS = [
+    "Qual foi o faturamento de março?",
+    "Resuma o relatório inicial.",
+    "Quais pratos do cardápio vendem mais?",
+    "Qual o público alvo da Amarelo?",
+    "Compare os custos de fevereiro e março.",
+]
+SAMPLE_EXPENSES = [
+    "Gastei R$ 20 com almoço hoje",
+    "Gastei R$ 35.50 com combustível ontem",
+    "Gastei R$ 120 com material de escritório 10/04/2025",
+]
+
+_message_ids = itertools.count(1)
+
+
+class SyntheticBot:
+    """Substitui o telegram.Bot registrando as chamadas de saída."""
+
+    def __init__(self):
+        self.calls = []
+
+    def _record(self, method, chat_id, **kwargs):
+        self.calls.append((method, chat_id, kwargs))
+        return SimpleNamespace(message_id=next(_message_ids), chat_id=chat_id, photo=[], document=None)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return self._record("send_message", chat_id, text=text, **kwargs)
+
+    def _record_photo(self, method, chat_id, **kwargs):
+        message = self._record(method, chat_id, **kwargs)
+        message.photo = [SimpleNamespace(file_id=f"photo-{message.message_id}")]
+        return message
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return self._record_photo("send_photo", chat_id, **kwargs)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        return [self._record_photo("send_media_group", chat_id, **kwargs) for _ in media]
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return self._record("send_document", chat_id, **kwargs)
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        self._record("delete_message", chat_id, message_id=message_id)
+        return True
+
+    async def get_file(self, file_id, **kwargs):
+        return SyntheticFile(f"Conteúdo sintético do arquivo {file_id}\n".encode("utf-8") * 64)
+
+    def error_count(self):
+        return sum(
+            1 for method, _, kwargs in self.calls
+            if method == "send_message" and str(kwargs.get("text", "")).startswith("Erro")
+        )
+
+
+class SyntheticFile:
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def download_to_drive(self, custom_path=None):
+        with open(custom_path, "wb") as f:
+            f.write(self.payload)
+        return custom_path
+
+
+class SyntheticDocument:
+    def __init__(self, file_name, payload):
+        self.file_name = file_name
+        self.file_id = f"doc-{next(_message_ids)}"
+        self.payload = payload
+
+    async def get_file(self):
+        return SyntheticFile(self.payload)
+
+
+class SyntheticMessage:
+    def __init__(self, bot, user, text=None, document=None):
+        self._bot = bot
+        self.from_user = user
+        self.chat = SimpleNamespace(id=user.id, type="private")
+        self.message_id = next(_message_ids)
+        self.text = text
+        self.document = document
+        self.photo = []
+
+    async def reply_text(self, text, **kwargs):
+        return await self._bot.send_message(chat_id=self.chat.id, text=text, **kwargs)
+
+
+def make_update(bot, user, text=None, document=None, args=None):
+    """Cria um par (update, context) compatível com os handlers do bot."""
+    message = SyntheticMessage(bot, user, text=text, document=document)
+    update = SimpleNamespace(
+        update_id=next(_message_ids),
+        message=message,
+        effective_message=message,
+        effective_user=user,
+        effective_chat=message.chat,
+    )
+    context = SimpleNamespace(bot=bot, args=args or [], _chat_id=message.chat.id, user_data={}, chat_data={})
+    return update, context
+
+
+def make_user(index):
+    user_id = 900000000 + index
+    return SimpleNamespace(id=user_id, username=f"carga{index}", first_name=f"Carga {index}", is_bot=False)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Operação desconhecida no mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def summarize(latencies, elapsed):
+    summary = {}
+    all_values = []
+    for op, values in sorted(latencies.items()):
+        all_values.extend(values)
+        summary[op] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p90_ms": percentile(values, 90) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values) * 1000 if values else 0.0,
+        }
+    summary["total"] = {
+        "count": len(all_values),
+        "messages_per_second": len(all_values) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(all_values, 50) * 1000,
+        "p90_ms": percentile(all_values, 90) * 1000,
+        "p99_ms": percentile(all_values, 99) * 1000,
+        "max_ms": max(all_values) * 1000 if all_values else 0.0,
+    }
+    return summary
+
+
+def print_report(report):
+    print(f"Usuários: {report['users']}  Mensagens/usuário: {report['messages']}  "
+          f"Tempo total: {report['elapsed_s']:.2f}s  (drenagem em segundo plano: {report['drain_s']:.2f}s)")
+    print(f"Requisições ao AnythingLLM: {report['backend_requests']}  Erros reportados ao usuário: {report['user_errors']}")
+    print(f"{'operação':<10}{'n':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for op, stats in report["latency"].items():
+        print(f"{op:<10}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p90_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print(f"Vazão: {report['latency']['total']['messages_per_second']:.2f} mensagens/s")
+
+
+def load_bot_module(base_url, workdir):
+    """Importa o bot.py real apontando para o servidor simulado e diretórios temporários."""
+    os.environ.setdefault("TELEGRAM_TOKEN", "000000:loadtest")
+    os.environ["ANYTHINGLLM_API"] = base_url
+    os.environ["ANYTHINGLLM_API_KEY"] = "loadtest"
+    import bot
+
+    bot.FILE_MAP_FILE = os.path.join(workdir, "file_map.json")
+    bot.USER_MAP_FILE = os.path.join(workdir, "user_map.json")
+    bot.CHART_URL_LOG = os.path.join(workdir, "chart_urls.txt")
+    bot.STATE_DB = os.path.join(workdir, "bot_state.db")
+    bot.EXPENSES_DIR = os.path.join(workdir, "lançamentos")
+    bot.DOCUMENTS_DIR = os.path.join(workdir, "documentos")
+    bot.GRAPHICS_DIR = os.path.join(workdir, "gráficos")
+    for path in (bot.EXPENSES_DIR, bot.DOCUMENTS_DIR, bot.GRAPHICS_DIR):
+        os.makedirs(path, exist_ok=True)
+    bot.use_user_store(bot.STATE_DB)
+    bot.FILE_MAP = {}
+    return bot
+
+
+async def run_user(bot_module, synthetic_bot, user, messages, weights, latencies, rng):
+    update, context = make_update(synthetic_bot, user, text="/start")
+    started = time.perf_counter()
+    await bot_module.start(update, context)
+    latencies["start"].append(time.perf_counter() - started)
+
+    operations = list(weights)
+    op_weights = [weights[op] for op in operations]
+    for i in range(messages):
+        op = rng.choices(operations, op_weights)[0]
+        if op == "text":
+            update, context = make_update(synthetic_bot, user, text=rng.choice(SAMPLE_QUESTIONS))
+            handler = bot_module.handle_text
+        elif op == "expense":
+            update, context = make_update(synthetic_bot, user, text=rng.choice(SAMPLE_EXPENSES))
+            handler = bot_module.handle_text
+        elif op == "file":
+            document = SyntheticDocument(f"relatorio_{user.id}_{i}.txt", b"Linha de relatorio sintetico.\n" * 256)
+            update, context = make_update(synthetic_bot, user, document=document)
+            handler = bot_module.handle_file
+        else:
+            update, context = make_update(synthetic_bot, user, text="/sync")
+            handler = bot_module.sync_command
+        started = time.perf_counter()
+        await handler(update, context)
+        latencies[op].append(time.perf_counter() - started)
+
+
+async def run_load(bot_module, users, messages, weights, seed):
+    synthetic_bot = SyntheticBot()
+    latencies = {op: [] for op in ("start",) + OPERATIONS if op == "start" or op in weights}
+    rng = random.Random(seed)
+    user_list = [make_user(i) for i in range(users)]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_user(bot_module, synthetic_bot, user, messages, weights, latencies, random.Random(rng.random()))
+        for user in user_list
+    ))
+    handlers_done = time.perf_counter()
+
+    # Aguarda as tarefas de segundo plano criadas pelos handlers (ex.: process_file)
+    current = asyncio.current_task()
+    pending = [task for task in asyncio.all_tasks() if task is not current]
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    finished = time.perf_counter()
+    return latencies, synthetic_bot, handlers_done - started, finished - handlers_done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do bot com AnythingLLM simulado")
+    parser.add_argument("--users", type=int, default=10, help="Usuários concorrentes")
+    parser.add_argument("--messages", type=int, default=10, help="Mensagens por usuário")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Pesos das operações (padrão: {DEFAULT_MIX})")
+    parser.add_argument("--latency", type=float, default=0.01, help="Latência base do AnythingLLM simulado (s)")
+    parser.add_argument("--chat-latency", type=float, default=0.2, help="Latência do /chat simulado (s)")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Latência por documento embedado (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas 500 injetadas")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Salva o relatório em JSON neste caminho")
+    parser.add_argument("--verbose", action="store_true", help="Mantém o log DEBUG do bot")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    server = FakeAnythingLLMServer(
+        latency=args.latency, chat_latency=args.chat_latency,
+        embed_latency=args.embed_latency, error_rate=args.error_rate
+    ).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="loadtest-") as workdir:
+            bot_module = load_bot_module(server.base_url, workdir)
+            if not args.verbose:
+                import logging
+                logging.getLogger().setLevel(logging.WARNING)
+            latencies, synthetic_bot, elapsed, drain = asyncio.run(
+                run_load(bot_module, args.users, args.messages, weights, args.seed)
+            )
+    finally:
+        server.stop()
+
+    report = {
+        "users": args.users,
+        "messages": args.messages,
+        "mix": weights,
+        "backend": {"latency": args.latency, "chat_latency": args.chat_latency,
+                    "embed_latency": args.embed_latency, "error_rate": args.error_rate},
+        "elapsed_s": elapsed,
+        "drain_s": drain,
+        "backend_requests": server.state.request_count,
+        "user_errors": synthetic_bot.error_count(),
+        "latency": summarize(latencies, elapsed),
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Micro-benchmarks dos caminhos quentes de CPU do bot.
+
+Cobre fix_chart_url, o regex de despesas, a leitura/gravação do arquivo de
+despesas, a montagem do texto de fontes e o diff de documentos do /sync.
+Não faz nenhuma chamada de rede. Os resultados são gravados em
+benchmarks/results/<rótulo>.json e comparados com a base versionada
+(benchmarks/results/baseline.json) para que regressões apareçam entre versões.
+
+Uso:
+    python benchmarks/micro.py                    # roda tudo e compara com a base versionada
+    python benchmarks/micro.py --compare latest   # compara com o resultado local mais recente
+    python benchmarks/micro.py --filter chart     # apenas benchmarks cujo nome contém 'chart'
+    python benchmarks/micro.py --label v1.2 --threshold 0.15
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import urllib.parse
+from contextlib import contextmanager, nullcontext
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+BASELINE_PATH = os.path.join(RESULTS_DIR, "baseline.json")
+sys.path.insert(0, ROOT_DIR)
+
+# O bot.py exige estas variáveis na importação; nenhuma requisição é feita.
+os.environ.setdefault("TELEGRAM_TOKEN", "000000:benchmark")
+os.environ.setdefault("ANYTHINGLLM_API", "http://127.0.0.1:9/api")
+os.environ.setdefault("ANYTHINGLLM_API_KEY", "benchmark")
+
+import logging
+logging.disable(logging.CRITICAL)
+
+import api_utils
+import bot
+import chart_utils
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+# Geradores de entradas realistas
+
+def make_chart_config(datasets, points):
+    rng = random.Random(datasets * 1000 + points)
+    labels = [f"Dia {i} - R$ & %" for i in range(points)]
+    return {
+        "type": "line",
+        "data": {
+            "labels": labels,
+            "datasets": [
+                {
+                    "label": f"Faturamento loja {d} (R$)",
+                    "data": [round(rng.uniform(1000, 50000), 2) for _ in range(points)],
+                    "borderColor": "#f5c518",
+                    "fill": False,
+                }
+                for d in range(datasets)
+            ],
+        },
+        "options": {
+            "title": {"display": True, "text": "Faturamento diário em R$ e variação em %"},
+            "scales": {"yAxes": [{"ticks": {"beginAtZero": True}, "scaleLabel": {"labelString": "Valor em R$"}}]},
+            "plugins": {"datalabels": {"display": False}, "legend": {"position": "bottom"}},
+        },
+    }
+
+
+def make_chart_url(config, single_quotes=False):
+    config_str = json.dumps(config, ensure_ascii=False)
+    if single_quotes:
+        config_str = config_str.replace('"', "'")
+    return "https://quickchart.io/chart?c=" + config_str
+
+
+def make_expense_messages(count):
+    rng = random.Random(count)
+    items = ["almoço", "combustível", "material de escritório", "uber", "café com cliente", "hospedagem"]
+    dates = ["hoje", "ontem", "10/04/2025", ""]
+    return [
+        f"Gastei R$ {rng.randint(1, 900)}.{rng.randint(0, 99):02d} com {rng.choice(items)} {rng.choice(dates)}".strip()
+        for _ in range(count)
+    ]
+
+
+def make_expense_ledger(count):
+    rng = random.Random(count)
+    return [
+        {
+            "date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "value": round(rng.uniform(1, 900), 2),
+            "description": rng.choice(["almoço", "combustível", "material de escritório", "uber"]),
+            "timestamp": 1744760283 + i,
+        }
+        for i in range(count)
+    ]
+
+
+def make_sources(count, chunk_size):
+    chunk = ("Faturamento consolidado da unidade centro em março. " * (chunk_size // 52 + 1))[:chunk_size]
+    return [{"title": f"relatorio-{i}.docx", "chunk": chunk} for i in range(count)]
+
+
+def make_document_lists(total, embedded):
+    all_documents = [f"custom-documents/doc-{i}.json-{i:08x}.json" for i in range(total)]
+    workspace_docs = [{"docpath": loc, "name": loc} for loc in all_documents[:embedded]]
+    return all_documents, workspace_docs
+
+
+# Benchmarks
+
+@benchmark("fix_chart_url_small")
+def bench_fix_chart_url_small():
+    url = make_chart_url(make_chart_config(datasets=2, points=12))
+    return lambda: bot.fix_chart_url(url)
+
+
+@benchmark("fix_chart_url_large")
+def bench_fix_chart_url_large():
+    url = make_chart_url(make_chart_config(datasets=12, points=365))
+    return lambda: bot.fix_chart_url(url)
+
+
+@benchmark("fix_chart_url_single_quotes")
+def bench_fix_chart_url_single_quotes():
+    url = make_chart_url(make_chart_config(datasets=4, points=90), single_quotes=True)
+    return lambda: bot.fix_chart_url(url)
+
+
+@benchmark("fix_chart_url_percent_encoded")
+def bench_fix_chart_url_percent_encoded():
+    config_str = json.dumps(make_chart_config(datasets=4, points=90))
+    url = "https://quickchart.io/chart?c=" + urllib.parse.quote(config_str)
+    return lambda: bot.fix_chart_url(url)
+
+
+@benchmark("replace_special_chars_10k_labels")
+def bench_replace_special_chars():
+    labels = [f"Dia {i} - R$ {i},00 & 5% de US$ 3 (€ £)" if i % 3 == 0 else f"Categoria {i}" for i in range(10000)]
+    return lambda: [chart_utils.replace_special_chars(label) for label in labels]
+
+
+@benchmark("parse_expense_1k_messages")
+def bench_parse_expense():
+    messages = make_expense_messages(1000)
+    return lambda: [bot.parse_expense(message) for message in messages]
+
+
+@benchmark("expense_ledger_append_10k")
+@contextmanager
+def bench_expense_ledger_append():
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp_dir:
+        local_path = os.path.join(tmp_dir, "user", "expenses_1.json")
+        bot.save_expenses(local_path, make_expense_ledger(10000))
+        expense = {"date": "2025-04-10", "value": 20.0, "description": "almoço", "timestamp": 1744760283}
+
+        def run():
+            expenses = bot.load_expenses(local_path)
+            expenses.append(expense)
+            bot.save_expenses(local_path, expenses)
+            # Mantém o arquivo com 10k entradas entre as repetições
+            expenses.pop()
+        yield run
+
+
+@benchmark("format_sources_top5")
+def bench_format_sources_top5():
+    sources = make_sources(5, 1000)
+    return lambda: bot.format_sources(sources)
+
+
+@benchmark("format_sources_50")
+def bench_format_sources_50():
+    sources = make_sources(50, 2000)
+    return lambda: bot.format_sources(sources)
+
+
+@benchmark("find_documents_to_embed_50k")
+def bench_find_documents_to_embed():
+    all_documents, workspace_docs = make_document_lists(50000, 45000)
+    return lambda: api_utils.find_documents_to_embed(all_documents, workspace_docs)
+
+
+@benchmark("get_documents_to_embed_50k")
+@contextmanager
+def bench_get_documents_to_embed():
+    all_documents, workspace_docs = make_document_lists(50000, 45000)
+    # Substitui as listagens HTTP por dados em memória para medir apenas a CPU, só durante a medição
+    originals = (api_utils.list_all_custom_documents, api_utils.list_workspace_documents)
+    api_utils.list_all_custom_documents = lambda *args, **kwargs: all_documents
+    api_utils.list_workspace_documents = lambda *args, **kwargs: workspace_docs
+    try:
+        yield lambda: api_utils.get_documents_to_embed("benchmark")
+    finally:
+        api_utils.list_all_custom_documents, api_utils.list_workspace_documents = originals
+
+
+# Execução, armazenamento e comparação
+
+def prepare(setup):
+    """O setup retorna a função medida ou um context manager que a fornece e depois limpa o que criou."""
+    prepared = setup()
+    return prepared if hasattr(prepared, "__enter__") else nullcontext(prepared)
+
+
+def measure(func, repeat, min_time):
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "number": number,
+        "min_s": min(samples),
+        "median_s": statistics.median(samples),
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecida"
+
+
+def latest_result(exclude=None):
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    candidates = [
+        os.path.join(RESULTS_DIR, name) for name in os.listdir(RESULTS_DIR)
+        if name.endswith(".json") and os.path.join(RESULTS_DIR, name) not in (exclude, BASELINE_PATH)
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=os.path.getmtime)
+
+
+def compare(current, baseline, threshold):
+    regressions = []
+    print(f"\nComparação com {baseline['label']} ({baseline['revision']}):")
+    for name, stats in current["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+        if not previous:
+            print(f"  {name:<34} novo")
+            continue
+        # O mínimo é a amostra menos afetada por ruído da máquina; a mediana oscila demais entre execuções
+        ratio = stats["min_s"] / previous["min_s"] if previous["min_s"] else 1.0
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- REGRESSÃO"
+            regressions.append(name)
+        print(f"  {name:<34} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks dos caminhos quentes do bot")
+    parser.add_argument("--filter", default="", help="Executa apenas benchmarks cujo nome contém este texto")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Tempo mínimo por amostra (s)")
+    parser.add_argument("--label", help="Rótulo do resultado (padrão: revisão git + data)")
+    parser.add_argument(
+        "--compare", default=BASELINE_PATH,
+        help="Arquivo de resultado usado como base, ou 'latest' para o mais recente (padrão: baseline.json)"
+    )
+    parser.add_argument("--threshold", type=float, default=0.20, help="Piora relativa considerada regressão")
+    parser.add_argument("--no-save", action="store_true", help="Não grava o resultado em benchmarks/results")
+    args = parser.parse_args()
+
+    revision = git_revision()
+    label = args.label or f"{time.strftime('%Y%m%d-%H%M%S')}-{revision}"
+    result = {"label": label, "revision": revision, "python": sys.version.split()[0], "benchmarks": {}}
+
+    print(f"{'benchmark':<34}{'mediana':>14}{'mínimo':>14}{'n':>8}")
+    for name, setup in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        with prepare(setup) as func:
+            stats = measure(func, args.repeat, args.min_time)
+        result["benchmarks"][name] = stats
+        print(f"{name:<34}{stats['median_s'] * 1e6:>11.1f} µs{stats['min_s'] * 1e6:>11.1f} µs{stats['number']:>8}")
+
+    baseline_path = latest_result() if args.compare == "latest" else args.compare
+    regressions = []
+    if baseline_path and os.path.exists(baseline_path):
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.threshold)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output_path = os.path.join(RESULTS_DIR, f"{label}.json")
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResultado salvo em {output_path}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
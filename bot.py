@@ -1,8 +1,14 @@
 import os
+import re
+import fnmatch
+import hashlib
 import logging
+import shutil
 import signal
 import sys
+import tempfile
 import time
+import weakref
 import asyncio
 from queue import Queue
 from threading import Thread
@@ -11,12 +17,33 @@ from telegram.ext import Application, CommandHandler, MessageHandler, filters, C
 import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 import json
-import urllib.parse
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from api_utils import (
-    setup_api, get_headers, check_api_status, list_workspaces, create_workspace, get_or_create_workspace,
-    list_workspace_documents, upload_file_to_anythingllm, update_workspace_embeddings, list_all_custom_documents
+    setup_api, check_api_status, list_workspaces, create_workspace, get_or_create_workspace,
+    list_workspace_documents, upload_file_to_anythingllm, update_workspace_embeddings, list_all_custom_documents,
+    find_documents_to_embed, api_request, chat_with_workspace, deadline, run_blocking, gather_calls,
+    invalidate_document_cache, vector_search, update_workspace_settings, set_usage_log, submit_workspace_embeddings,
+    missing_embeddings
+)
+from chart_utils import normalize_chart_config, build_chart_url, dashboard_available, compose_dashboard
+from state_store import SharedMap
+from user_store import UserStore
+from journal import JobJournal, MAX_ATTEMPTS
+from delivery import deliver_reply, compose_text, send_text
+from preprocess import preprocess_upload, extract_upload_text, run_in_pool, shutdown_pool
+from expense_import import STATEMENT_EXTENSIONS, parse_statement, merge_expenses
+from expense_render import render_ledger, document_extension
+from search_index import DocumentIndex
+from thread_registry import new_session_id, add_thread, select_thread, thread_page
+from retrieval_profiles import PROFILES, AUTO_PROFILE, resolve_profile
+from context_budget import COMPACTION_PROMPT, session_context, build_message, record_turn, apply_summary
+from housekeeping import collect_garbage, format_report
+from usage_log import UsageLog, SLOW_QUERY_SECONDS
+from profiling import SamplingProfiler, LoopLagMonitor
+from reports import (
+    REPORTS, REPORTS_GENERATE_AT, DEFAULT_DELIVERY_TIME, ReportStore, parse_time, is_report_day, schedule_label,
+    due_deliveries
 )
 
 # Desativar avisos de SSL inseguro
@@ -35,6 +62,74 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 ANYTHINGLLM_API = os.getenv("ANYTHINGLLM_API")
 ANYTHINGLLM_API_KEY = os.getenv("ANYTHINGLLM_API_KEY")
 
+# Modo webhook (opcional): vários processos atrás de um receptor HTTP local
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 1)))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "8"))
+
+# Limite de exclusões simultâneas nos comandos em lote
+BULK_DELETE_CONCURRENCY = int(os.getenv("BULK_DELETE_CONCURRENCY", "4"))
+
+# Gráficos: downloads simultâneos no QuickChart e painel único (requer Pillow)
+CHART_RENDER_CONCURRENCY = int(os.getenv("CHART_RENDER_CONCURRENCY", "4"))
+CHART_DASHBOARD = os.getenv("CHART_DASHBOARD", "0") == "1"
+DASHBOARD_KEYWORDS = ("painel", "dashboard")
+CHART_RENDER_SEMAPHORE = None
+
+# Workspace compartilhado com os documentos da empresa (opcional). Com ele, os
+# workspaces dos usuários guardam só arquivos pessoais e despesas.
+CORPUS_WORKSPACE = os.getenv("CORPUS_WORKSPACE")
+CORPUS_CHUNK_CHARS = 600
+CORPUS_SLUG = None
+
+CHART_INSTRUCTIONS = (
+    "Quando solicitado um gráfico, use a ferramenta `create-chart` e retorne a URL do QuickChart no campo `chart.url` do response body da API, "
+    "sem incluir a URL no texto da resposta. Não use placeholders como '[Gráfico]' ou Markdown como '![Gráfico](URL)'. "
+    "Exemplo de resposta esperada: {'textResponse': 'Aqui está o gráfico solicitado', 'chart': {'url': 'https://quickchart.io/chart?c=...'}}."
+)
+CHART_INSTRUCTIONS_REMINDER = "Para o gráfico, siga as instruções anteriores: `create-chart` e URL em `chart.url`."
+
+# Coleta de lixo periódica (diretórios locais e documentos órfãos no AnythingLLM)
+GC_INTERVAL_HOURS = float(os.getenv("GC_INTERVAL_HOURS", "6"))
+# A execução agendada só simula; a exclusão é habilitada com GC_DRY_RUN=0 ou pelo /gc executar
+GC_DRY_RUN = os.getenv("GC_DRY_RUN", "1") == "1"
+DOCUMENTS_RETENTION_DAYS = float(os.getenv("DOCUMENTS_RETENTION_DAYS", "30"))
+DOCUMENTS_MAX_MB = float(os.getenv("DOCUMENTS_MAX_MB", "500"))
+GRAPHICS_RETENTION_DAYS = float(os.getenv("GRAPHICS_RETENTION_DAYS", "7"))
+GRAPHICS_MAX_MB = float(os.getenv("GRAPHICS_MAX_MB", "100"))
+GC_ORPHAN_GRACE_HOURS = float(os.getenv("GC_ORPHAN_GRACE_HOURS", "24"))
+GC_DELETE_RATE = float(os.getenv("GC_DELETE_RATE", "2"))
+GC_MAX_DELETES = int(os.getenv("GC_MAX_DELETES", "100"))
+
+# Usuários com acesso aos comandos administrativos (IDs separados por vírgula)
+ADMIN_USER_IDS = {uid.strip() for uid in os.getenv("ADMIN_USER_IDS", "").split(",") if uid.strip()}
+
+# Uso do LLM: período padrão do /uso e arquivo opcional do log de consultas lentas
+USAGE_REPORT_DAYS = int(os.getenv("USAGE_REPORT_DAYS", "7"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG")
+if SLOW_QUERY_LOG:
+    slow_handler = logging.FileHandler(SLOW_QUERY_LOG, encoding="utf-8")
+    slow_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    logging.getLogger("anythingllm.slow").addHandler(slow_handler)
+
+# Perfilamento sob demanda (/profile): duração padrão e máxima em segundos
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+
+# Intervalo (segundos) da reexecução dos jobs do journal que falharam; 0 desativa
+JOB_RETRY_INTERVAL = float(os.getenv("JOB_RETRY_INTERVAL", "300"))
+
+# Acompanhamento dos embeddings em andamento: primeiro intervalo, intervalo máximo e desistência (segundos)
+EMBED_POLL_INITIAL = float(os.getenv("EMBED_POLL_INITIAL", "2"))
+EMBED_POLL_MAX = float(os.getenv("EMBED_POLL_MAX", "60"))
+EMBED_POLL_TIMEOUT = float(os.getenv("EMBED_POLL_TIMEOUT", "1800"))
+
+# Orçamento total de tempo de um turno do usuário nas chamadas ao AnythingLLM
+TURN_TIMEOUT = float(os.getenv("ANYTHINGLLM_TURN_TIMEOUT", "600"))
+
 if not all([TELEGRAM_TOKEN, ANYTHINGLLM_API, ANYTHINGLLM_API_KEY]):
     logger.error("Uma ou mais variáveis de ambiente estão ausentes. Verifique o arquivo .env.")
     exit(1)
@@ -46,6 +141,7 @@ setup_api(ANYTHINGLLM_API, ANYTHINGLLM_API_KEY)
 FILE_MAP_FILE = "file_map.json"
 USER_MAP_FILE = "user_map.json"
 CHART_URL_LOG = "chart_urls.txt"
+STATE_DB = os.getenv("STATE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_state.db"))
 EXPENSES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lançamentos")
 DOCUMENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "documentos")
 GRAPHICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gráficos")
@@ -53,6 +149,14 @@ os.makedirs(EXPENSES_DIR, exist_ok=True)
 os.makedirs(DOCUMENTS_DIR, exist_ok=True)
 os.makedirs(GRAPHICS_DIR, exist_ok=True)
 
+# Expressões regulares compiladas uma única vez
+EXPENSE_PATTERN = re.compile(
+    r"(?:Gastei\s+)?(?:R\$|Real)?\s*(\d+(?:\.\d{2})?)\s*(?:com)?\s*([\w\s]+?)(?:\s+(hoje|ontem|\d{2}/\d{2}/\d{4}))?$",
+    re.IGNORECASE
+)
+CHART_URL_PATTERN = re.compile(r'(https://quickchart\.io/chart\?c=[^\s\)]+)')
+CHART_MARKDOWN_PATTERN = re.compile(r'!\[.*?\]\(https://quickchart\.io/chart\?c=[^\s\)]+\)')
+
 def load_file_map():
     if os.path.exists(FILE_MAP_FILE):
         with open(FILE_MAP_FILE, "r") as f:
@@ -60,19 +164,88 @@ def load_file_map():
     return {}
 
 def save_file_map(file_map):
+    if isinstance(file_map, SharedMap):
+        return  # Cada alteração já é gravada no banco compartilhado
     with open(FILE_MAP_FILE, "w") as f:
         json.dump(file_map, f, indent=2)
 
-def load_user_map():
-    if os.path.exists(USER_MAP_FILE):
-        with open(USER_MAP_FILE, "r") as f:
-            return json.load(f)
-    return {}
-
-def save_user_map(user_map):
+def save_user_map(user_map, user_id=None):
+    """Persiste o registro alterado; user_id marca o registro mesmo que tenha sido lido antes de um await."""
+    if isinstance(user_map, UserStore) and user_id is not None:
+        user_map.mark_dirty(user_id)
+    if isinstance(user_map, (SharedMap, UserStore)):
+        user_map.flush()
+        return
     with open(USER_MAP_FILE, "w") as f:
         json.dump(user_map, f, indent=2)
 
+def get_journal():
+    """Retorna o journal de jobs, abrindo o banco na primeira utilização."""
+    global JOURNAL
+    if JOURNAL is None:
+        JOURNAL = JobJournal(STATE_DB)
+    return JOURNAL
+
+def get_search_index():
+    global SEARCH_INDEX
+    if SEARCH_INDEX is None:
+        SEARCH_INDEX = DocumentIndex(STATE_DB)
+    return SEARCH_INDEX
+
+def get_report_store():
+    global REPORT_STORE
+    if REPORT_STORE is None:
+        REPORT_STORE = ReportStore(STATE_DB)
+    return REPORT_STORE
+
+def get_orphan_candidates():
+    """Marcações de documentos órfãos (docpath -> primeira vez visto), persistidas para manter a carência entre reinícios."""
+    global ORPHAN_CANDIDATES
+    if ORPHAN_CANDIDATES is None:
+        ORPHAN_CANDIDATES = SharedMap(STATE_DB, "orphan_candidates")
+    return ORPHAN_CANDIDATES
+
+def get_usage_log():
+    global USAGE_LOG
+    if USAGE_LOG is None:
+        USAGE_LOG = UsageLog(STATE_DB)
+    return USAGE_LOG
+
+async def index_text(user_id, file_name, text):
+    """Atualiza o índice do /buscar. Falhas só são registradas no log."""
+    try:
+        await run_blocking(get_search_index().index_document, user_id, file_name, text)
+    except Exception as e:
+        logger.error(f"Erro ao indexar {file_name}: {str(e)}")
+
+async def index_file(user_id, file_name, local_path):
+    text = await extract_upload_text(local_path)
+    if text:
+        await index_text(user_id, file_name, text)
+
+async def unindex_files(file_names):
+    try:
+        await run_blocking(get_search_index().remove_documents, file_names)
+    except Exception as e:
+        logger.error(f"Erro ao remover {len(file_names)} arquivos do índice: {str(e)}")
+
+def use_user_store(db_path):
+    """Usuários lidos sob demanda do SQLite, com cache LRU limitado (importa o user_map.json na primeira vez)."""
+    global USER_WORKSPACE_MAP
+    USER_WORKSPACE_MAP = UserStore(db_path, "users", seed_file=USER_MAP_FILE)
+
+def users_with(field):
+    """IDs dos usuários com o campo preenchido, sem carregar todos os registros quando estão no SQLite."""
+    if isinstance(USER_WORKSPACE_MAP, UserStore):
+        return USER_WORKSPACE_MAP.keys_with(field)
+    return [user_id for user_id, record in USER_WORKSPACE_MAP.items() if record.get(field)]
+
+def use_shared_state(db_path):
+    """Troca os mapas em memória pelo armazenamento SQLite compartilhado entre processos."""
+    global FILE_MAP
+    use_user_store(db_path)
+    FILE_MAP = SharedMap(db_path, "files", seed_file=FILE_MAP_FILE)
+
 def save_chart_urls(original_url, fixed_url):
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
     log_entry = f"[{timestamp}]\nOriginal (falha): {original_url}\nCorrigida: {fixed_url}\n\n"
@@ -81,50 +254,21 @@ def save_chart_urls(original_url, fixed_url):
     logger.debug(f"URLs salvas em {CHART_URL_LOG}")
 
 def fix_chart_url(chart_url):
-    try:
-        if "quickchart.io/chart?c=" not in chart_url:
-            logger.warning(f"URL do gráfico não contém 'quickchart.io/chart?c=': {chart_url}")
-            return chart_url
-        
-        chart_config_str = chart_url.split("quickchart.io/chart?c=")[1]
-        try:
-            chart_config = json.loads(chart_config_str)
-        except json.JSONDecodeError:
-            chart_config_str = chart_config_str.replace("'", '"')
-            chart_config = json.loads(chart_config_str)
-        
-        def replace_special_chars(obj):
-            if isinstance(obj, str):
-                replacements = {
-                    "R$": "Real",
-                    "%20": " ",
-                    "$": "USD",
-                    "€": "EUR",
-                    "£": "GBP",
-                    "%": "pct",
-                    "&": "and"
-                }
-                result = obj
-                for old, new in replacements.items():
-                    result = result.replace(old, new)
-                return result
-            elif isinstance(obj, dict):
-                return {k: replace_special_chars(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [replace_special_chars(item) for item in obj]
-            return obj
-        
-        fixed_config = replace_special_chars(chart_config)
-        fixed_config_str = json.dumps(fixed_config)
-        encoded_config = urllib.parse.quote(fixed_config_str)
-        
-        fixed_url = f"https://quickchart.io/chart?c={encoded_config}&format=png"
-        logger.debug(f"URL do gráfico corrigido: {fixed_url}")
-        return fixed_url
-    except Exception as e:
-        logger.error(f"Erro ao corrigir o chart_url: {str(e)}")
+    """Normaliza a configuração do gráfico e monta a URL final. Retorna None se a configuração for inválida."""
+    if "quickchart.io/chart?c=" not in chart_url:
+        logger.warning(f"URL do gráfico não contém 'quickchart.io/chart?c=': {chart_url}")
         return chart_url
 
+    try:
+        chart_config = normalize_chart_config(chart_url.split("quickchart.io/chart?c=", 1)[1])
+    except ValueError as e:
+        logger.error(f"Configuração de gráfico inválida: {str(e)}")
+        return None
+
+    fixed_url = build_chart_url(chart_config)
+    logger.debug(f"URL do gráfico corrigido: {fixed_url}")
+    return fixed_url
+
 def download_chart_image(chart_url):
     try:
         if not chart_url or "quickchart.io/chart" not in chart_url:
@@ -142,8 +286,9 @@ def download_chart_image(chart_url):
             logger.error(f"Resposta não é uma imagem PNG: {content_type}")
             return None
         
+        # O hash da URL evita colisão entre gráficos baixados no mesmo segundo
         timestamp = int(time.time())
-        final_filename = f"gráfico_{timestamp}.png"
+        final_filename = f"gráfico_{timestamp}_{hashlib.sha1(chart_url.encode('utf-8')).hexdigest()[:10]}.png"
         final_path = os.path.join(GRAPHICS_DIR, final_filename)
         
         with open(final_path, "wb") as f:
@@ -158,14 +303,89 @@ def download_chart_image(chart_url):
         logger.error(f"Erro ao processar a imagem: {str(e)}")
         return None
 
+async def apply_retrieval_profile(user_id, workspace_slug, profile_name):
+    """Atualiza o workspace do usuário com o perfil, apenas se for diferente do último aplicado."""
+    record = USER_WORKSPACE_MAP[user_id]
+    if record.get("applied_profile") == profile_name:
+        return True
+    if await run_blocking(update_workspace_settings, workspace_slug, PROFILES[profile_name]):
+        record["applied_profile"] = profile_name
+        save_user_map(USER_WORKSPACE_MAP, user_id)
+        return True
+    return False
+
+async def get_corpus_slug():
+    """Slug do workspace compartilhado, criado na primeira chamada. None se CORPUS_WORKSPACE não estiver definido."""
+    global CORPUS_SLUG
+    if CORPUS_WORKSPACE and CORPUS_SLUG is None:
+        CORPUS_SLUG = await run_blocking(get_or_create_workspace, None, CORPUS_WORKSPACE)
+    return CORPUS_SLUG
+
+def format_corpus_context(hits):
+    """Monta o bloco de trechos da base da empresa que acompanha a pergunta."""
+    lines = ["Trechos relevantes da base de documentos da empresa:"]
+    for index, hit in enumerate(hits, 1):
+        title = (hit.get("metadata") or {}).get("title", "documento")
+        lines.append(f"[{index}] {title}: {hit.get('text', '')[:CORPUS_CHUNK_CHARS]}")
+    return "\n".join(lines)
+
+def merge_sources(sources, hits):
+    """Junta as fontes do workspace do usuário com os trechos do workspace compartilhado, sem repetir títulos."""
+    merged = list(sources)
+    titles = {source.get("title") for source in merged}
+    for hit in hits:
+        title = (hit.get("metadata") or {}).get("title", "documento")
+        if title not in titles:
+            titles.add(title)
+            merged.append({"title": title, "chunk": hit.get("text", "")[:CORPUS_CHUNK_CHARS]})
+    return merged
+
+def extract_chart_urls(data, text_response):
+    """Retorna as URLs de gráfico da resposta (campo chart/charts e links no texto), sem repetições, e o texto sem os links."""
+    chart_urls = []
+    charts = data.get("charts") or []
+    if data.get("chart"):
+        charts = [data["chart"]] + list(charts)
+    for chart in charts:
+        url = chart.get("url") if isinstance(chart, dict) else chart
+        if url:
+            chart_urls.append(url)
+
+    if "https://quickchart.io/chart?c=" in text_response:
+        chart_urls.extend(CHART_URL_PATTERN.findall(text_response))
+        text_response = CHART_MARKDOWN_PATTERN.sub('', text_response)
+        text_response = CHART_URL_PATTERN.sub('', text_response).strip()
+    return list(dict.fromkeys(chart_urls)), text_response
+
+def get_chart_semaphore():
+    # Criado sob demanda para ficar no loop de eventos em execução
+    global CHART_RENDER_SEMAPHORE
+    if CHART_RENDER_SEMAPHORE is None:
+        CHART_RENDER_SEMAPHORE = asyncio.Semaphore(CHART_RENDER_CONCURRENCY)
+    return CHART_RENDER_SEMAPHORE
+
+async def render_chart(chart_url):
+    async with get_chart_semaphore():
+        return await run_blocking(download_chart_image, chart_url)
+
+async def render_dashboard(chart_urls):
+    """Baixa os gráficos em paralelo e os junta em um único PNG."""
+    paths = [path for path in await asyncio.gather(*(render_chart(url) for url in chart_urls)) if path]
+    if not paths:
+        return None
+    output_path = os.path.join(GRAPHICS_DIR, f"painel_{int(time.time())}_{os.path.basename(paths[0])}")
+    try:
+        return await run_blocking(compose_dashboard, paths, output_path)
+    except Exception as e:
+        logger.error(f"Erro ao montar o painel de gráficos: {str(e)}")
+        return None
+
 async def delete_document_from_anythingllm(docpath):
     """Deleta completamente um documento do AnythingLLM pelo docpath."""
-    url = f"{ANYTHINGLLM_API}/v1/document/delete"
     payload = {"location": docpath}
-    headers = get_headers()
     try:
-        response = requests.post(url, json=payload, headers=headers, verify=False)
-        response.raise_for_status()
+        await run_blocking(api_request, "POST", "/v1/document/delete", "documents", timeout=60, json=payload)
+        invalidate_document_cache(all_workspaces=True)
         logger.info(f"Documento {docpath} deletado completamente do AnythingLLM.")
         return True
     except Exception as e:
@@ -174,12 +394,12 @@ async def delete_document_from_anythingllm(docpath):
 
 async def remove_document_from_workspace(workspace_slug, docpath):
     """Remove um documento do contexto do workspace."""
-    url = f"{ANYTHINGLLM_API}/v1/workspace/{workspace_slug}/update-embeddings"
     payload = {"removes": [docpath]}
-    headers = get_headers()
     try:
-        response = requests.post(url, json=payload, headers=headers, verify=False)
-        response.raise_for_status()
+        await run_blocking(
+            api_request, "POST", f"/v1/workspace/{workspace_slug}/update-embeddings", "embeddings", timeout=600, json=payload
+        )
+        invalidate_document_cache(workspace_slug)
         logger.info(f"Documento {docpath} removido do contexto do workspace {workspace_slug}.")
         return True
     except Exception as e:
@@ -188,102 +408,509 @@ async def remove_document_from_workspace(workspace_slug, docpath):
 
 async def reset_chat(workspace_slug, session_id):
     """Reseta o histórico do chat atual no AnythingLLM."""
-    url = f"{ANYTHINGLLM_API}/v1/workspace/{workspace_slug}/chat/reset"
     payload = {"sessionId": session_id}
-    headers = get_headers()
     try:
-        response = requests.post(url, json=payload, headers=headers, verify=False)
-        response.raise_for_status()
+        await run_blocking(api_request, "POST", f"/v1/workspace/{workspace_slug}/chat/reset", "chat", timeout=30, json=payload)
         logger.info(f"Chat {session_id} resetado no workspace {workspace_slug}.")
         return True
     except Exception as e:
         logger.error(f"Erro ao resetar chat {session_id}: {str(e)}")
         return False
 
+def parse_expense(message):
+    """Extrai data, valor e descrição de uma mensagem 'Gastei ...'. Retorna None se o formato for inválido.
+
+    Levanta ValueError se a data não existir no calendário.
+    """
+    match = EXPENSE_PATTERN.match(message)
+    if not match:
+        return None
+
+    value, description, date_str = match.groups()
+
+    # Determinar a data
+    if not date_str or date_str.lower() == "hoje":
+        date = datetime.now().strftime("%Y-%m-%d")
+    elif date_str.lower() == "ontem":
+        date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    else:
+        date = datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%d")
+
+    return {
+        "date": date,
+        "value": float(value),
+        "description": description.strip()
+    }
+
+def load_expenses(local_path):
+    """Carrega o arquivo de despesas do usuário ou retorna uma lista vazia."""
+    if os.path.exists(local_path):
+        with open(local_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return []
+
+def save_expenses(local_path, expenses):
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    with open(local_path, "w", encoding="utf-8") as f:
+        json.dump(expenses, f, ensure_ascii=False, indent=2)
+
+def format_sources(sources):
+    """Monta o texto de fontes utilizadas a partir da lista de sources do AnythingLLM."""
+    return "\n\nFontes utilizadas:\n" + "\n".join([f"- {s['title']}: {s.get('chunk', 'N/A')}" for s in sources])
+
 async def process_manual_expense(message, user_id, username, workspace_slug, context):
-    """Processa despesas manuais, atualiza o arquivo JSON, deleta o antigo e reinsere no AnythingLLM."""
+    """Registra a despesa no journal e executa o job que atualiza o arquivo JSON e o AnythingLLM."""
     try:
-        import re
-        pattern = r"(?:Gastei\s+)?(?:R\$|Real)?\s*(\d+(?:\.\d{2})?)\s*(?:com)?\s*([\w\s]+?)(?:\s+(hoje|ontem|\d{2}/\d{2}/\d{4}))?$"
-        match = re.match(pattern, message, re.IGNORECASE)
-        if not match:
-            await context.bot.send_message(chat_id=context._chat_id, text="Formato inválido. Use: 'Gastei R$ 20 com produto x hoje'.")
-            return
+        expense = parse_expense(message)
+    except ValueError as e:
+        # Data bem formada mas inexistente (ex.: 31/02/2025)
+        await context.bot.send_message(chat_id=context._chat_id, text=f"Erro: {str(e)}")
+        return
+    if not expense:
+        await context.bot.send_message(chat_id=context._chat_id, text="Formato inválido. Use: 'Gastei R$ 20 com produto x hoje'.")
+        return
 
-        value, description, date_str = match.groups()
-        value = float(value)
+    expense["timestamp"] = int(time.time())
+    job = get_journal().enqueue("expense", user_id, {
+        "chat_id": context._chat_id,
+        "user_id": user_id,
+        "username": username,
+        "workspace_slug": workspace_slug,
+        "expense": expense
+    })
+    await run_job(context.bot, job)
 
-        # Determinar a data
-        if not date_str or date_str.lower() == "hoje":
-            date = datetime.now().strftime("%Y-%m-%d")
-        elif date_str.lower() == "ontem":
-            date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-        else:
-            date = datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%d")
-
-        # Criar entrada de despesa
-        expense = {
-            "date": date,
-            "value": value,
-            "description": description.strip(),
-            "timestamp": int(time.time())
-        }
-
-        # Nome do arquivo único por usuário na pasta lançamentos
-        file_name = f"{username}/expenses_{user_id}.json"
-        local_path = os.path.join(EXPENSES_DIR, file_name)
-
-        # Carregar despesas existentes ou criar nova lista
-        if os.path.exists(local_path):
-            with open(local_path, "r", encoding="utf-8") as f:
-                expenses = json.load(f)
-        else:
-            expenses = []
-
-        # Adicionar nova despesa
-        expenses.append(expense)
-
-        # Salvar o arquivo atualizado localmente
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        with open(local_path, "w", encoding="utf-8") as f:
-            json.dump(expenses, f, ensure_ascii=False, indent=2)
-
-        # Verificar se o arquivo já está embedado e deletá-lo completamente
-        old_docpath = FILE_MAP.get(file_name)
-        if old_docpath:
-            await remove_document_from_workspace(workspace_slug, old_docpath)
-            if await delete_document_from_anythingllm(old_docpath):
-                del FILE_MAP[file_name]
-                save_file_map(FILE_MAP)
-            else:
-                await context.bot.send_message(chat_id=context._chat_id, text="Erro ao deletar o arquivo antigo do AnythingLLM.")
-                return
+def expense_ledger_path(username, user_id):
+    """Nome do arquivo JSON de despesas do usuário e caminho local na pasta lançamentos."""
+    file_name = f"{username}/expenses_{user_id}.json"
+    return file_name, os.path.join(EXPENSES_DIR, file_name)
 
-        # Enviar o arquivo atualizado ao AnythingLLM
-        upload_success, location = await upload_file_to_anythingllm(local_path, file_name)
-        if not upload_success or not location:
-            await context.bot.send_message(chat_id=context._chat_id, text="Erro ao enviar despesa ao AnythingLLM.")
-            return
+def expense_document_path(username, user_id, period):
+    """Nome e caminho local do documento mensal de despesas enviado ao AnythingLLM."""
+    file_name = f"{username}/expenses_{user_id}_{period}{document_extension()}"
+    return file_name, os.path.join(EXPENSES_DIR, file_name)
+
+def read_bytes(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+async def replace_expense_document(workspace_slug, file_name, upload_path):
+    """Deleta a versão anterior do documento (se houver) e envia a nova. Retorna a localização ou None."""
+    old_docpath = FILE_MAP.get(file_name)
+    if old_docpath:
+        results, _ = await gather_calls(
+            removed=remove_document_from_workspace(workspace_slug, old_docpath),
+            deleted=delete_document_from_anythingllm(old_docpath)
+        )
+        if not results.get("deleted"):
+            return None
+        del FILE_MAP[file_name]
+        save_file_map(FILE_MAP)
+    upload_success, location = await upload_file_to_anythingllm(upload_path, file_name)
+    return location if upload_success else None
+
+def get_ledger_lock(user_id):
+    """Lock do arquivo de despesas do usuário; some sozinho quando nenhum job o está usando."""
+    key = str(user_id)
+    lock = LEDGER_LOCKS.get(key)
+    if lock is None:
+        lock = LEDGER_LOCKS[key] = asyncio.Lock()
+    return lock
+
+async def publish_expense_ledger(bot, job):
+    """Renderiza as despesas por mês e reenvia ao AnythingLLM só os meses que mudaram.
+
+    As publicações de um mesmo usuário (ex.: um "Gastei" durante a importação de um extrato)
+    são serializadas, e o arquivo de despesas é lido já com o lock, então cada publicação vê
+    os meses confirmados pela anterior em vez de reenviá-los.
+    Retorna True em caso de sucesso; erros já são reportados ao usuário.
+    """
+    _, local_path = expense_ledger_path(job["payload"]["username"], job["user_id"])
+    async with get_ledger_lock(job["user_id"]):
+        return await _publish_expense_ledger(bot, job, load_expenses(local_path))
+
+async def _publish_expense_ledger(bot, job, expenses):
+    """Cada documento novo é gravado em um .tmp e só substitui o local depois do embedding,
+    então uma reexecução volta a enviar tudo o que não chegou a ser confirmado.
+    """
+    payload = job["payload"]
+    chat_id = payload["chat_id"]
+    workspace_slug = payload["workspace_slug"]
+    user_id, username = job["user_id"], payload["username"]
+    locations = payload.setdefault("locations", {})
+
+    changed = {}
+    for period, content in render_ledger(expenses).items():
+        file_name, local_path = expense_document_path(username, user_id, period)
+        data = content.encode("utf-8")
+        if file_name not in locations and FILE_MAP.get(file_name) and read_bytes(local_path) == data:
+            continue
+        changed[file_name] = (local_path, content)
+        if file_name not in locations:
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path + ".tmp", "wb") as f:
+                f.write(data)
+    if not changed:
+        return True
 
-        # Adicionar o novo arquivo ao contexto
-        embedding_success = await update_workspace_embeddings(workspace_slug, adds=[location])
-        if embedding_success:
-            FILE_MAP[file_name] = location
+    # Arquivo JSON único enviado pelas versões anteriores
+    ledger_name, _ = expense_ledger_path(username, user_id)
+    if FILE_MAP.get(ledger_name):
+        old_docpath = FILE_MAP[ledger_name]
+        results, _ = await gather_calls(
+            removed=remove_document_from_workspace(workspace_slug, old_docpath),
+            deleted=delete_document_from_anythingllm(old_docpath)
+        )
+        if results.get("deleted"):
+            del FILE_MAP[ledger_name]
             save_file_map(FILE_MAP)
-            await context.bot.send_message(
-                chat_id=context._chat_id,
-                text=f"Despesa registrada: R$ {value:.2f} em '{description}' em {date}. Contexto atualizado!"
-            )
-        else:
-            await context.bot.send_message(chat_id=context._chat_id, text="Erro ao atualizar o contexto.")
+            await unindex_files([ledger_name])
+
+    pending = [file_name for file_name in changed if file_name not in locations]
+    uploaded = await asyncio.gather(*(
+        replace_expense_document(workspace_slug, file_name, changed[file_name][0] + ".tmp") for file_name in pending
+    ))
+    locations.update((file_name, location) for file_name, location in zip(pending, uploaded) if location)
+    get_journal().update(job["id"], payload)
+    if not all(uploaded):
+        await bot.send_message(chat_id=chat_id, text="Erro ao enviar despesa ao AnythingLLM.")
+        return False
+
+    # Um único re-embed com todos os meses alterados
+    if not await update_workspace_embeddings(workspace_slug, adds=[locations[name] for name in changed]):
+        await bot.send_message(chat_id=chat_id, text="Erro ao atualizar o contexto.")
+        return False
+    for file_name, (local_path, content) in changed.items():
+        FILE_MAP[file_name] = locations.pop(file_name)
+        if os.path.exists(local_path + ".tmp"):
+            os.replace(local_path + ".tmp", local_path)
+        await index_text(user_id, file_name, content)
+    save_file_map(FILE_MAP)
+    get_journal().update(job["id"], payload)
+    return True
+
+async def run_expense_job(bot, job):
+    """Atualiza o arquivo JSON de despesas, deleta o antigo e reinsere no AnythingLLM. Seguro para reexecução."""
+    payload = job["payload"]
+    chat_id = payload["chat_id"]
+    expense = payload["expense"]
+    value, description, date = expense["value"], expense["description"], expense["date"]
+    try:
+        _, local_path = expense_ledger_path(payload["username"], payload["user_id"])
+
+        # Carregar despesas existentes, adicionar a nova (se ainda não gravada) e salvar localmente
+        expenses = load_expenses(local_path)
+        if expense not in expenses:
+            expenses.append(expense)
+            save_expenses(local_path, expenses)
+
+        if not await publish_expense_ledger(bot, job):
+            return False
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"Despesa registrada: R$ {value:.2f} em '{description}' em {date}. Contexto atualizado!"
+        )
+        return True
 
     except Exception as e:
         logger.error(f"Erro ao processar despesa: {str(e)}")
-        await context.bot.send_message(chat_id=context._chat_id, text=f"Erro: {str(e)}")
+        await bot.send_message(chat_id=chat_id, text=f"Erro: {str(e)}")
+        return False
+
+async def run_import_job(bot, job):
+    """Importa um extrato (CSV/XLSX/OFX) para o arquivo de despesas com uma única gravação e um único re-embed.
+
+    Se o arquivo não for um extrato reconhecido, segue o fluxo normal de documentos. Seguro para reexecução.
+    """
+    payload = job["payload"]
+    chat_id = payload["chat_id"]
+    try:
+        if "imported" not in payload:
+            local_file_path = payload["local_file_path"]
+            if not os.path.exists(local_file_path):
+                file_obj = await bot.get_file(payload["file_id"])
+                os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+                await file_obj.download_to_drive(local_file_path)
+
+            # A leitura e a conversão das linhas rodam no pool de processos
+            imported = await run_in_pool(parse_statement, local_file_path)
+            if imported is None:
+                logger.info(f"{payload['file_name']} não é um extrato reconhecido; enviando como documento.")
+                return await run_file_job(bot, job)
+
+            _, local_path = expense_ledger_path(payload["username"], job["user_id"])
+            expenses = load_expenses(local_path)
+            new_expenses = merge_expenses(expenses, imported)
+            if new_expenses:
+                now = int(time.time())
+                expenses.extend(dict(expense, timestamp=now) for expense in new_expenses)
+                save_expenses(local_path, expenses)
+            payload["imported"] = len(new_expenses)
+            payload["duplicates"] = len(imported) - len(new_expenses)
+            get_journal().update(job["id"], payload)
+
+        # Publica mesmo sem despesas novas: se o processo caiu entre gravar o arquivo e o journal,
+        # a reexecução vê tudo como já registrado, mas os meses ainda não chegaram ao AnythingLLM.
+        # Meses sem alteração são ignorados por publish_expense_ledger.
+        if not await publish_expense_ledger(bot, job):
+            return False
+        summary = f"{payload['imported']} despesas importadas ({payload['duplicates']} já registradas foram ignoradas)."
+        await bot.send_message(chat_id=chat_id, text=f"{summary} Contexto atualizado!" if payload["imported"] else summary)
+        return True
+
+    except Exception as e:
+        logger.error(f"Erro ao importar extrato: {str(e)}")
+        await bot.send_message(chat_id=chat_id, text="Erro ao importar o extrato.")
+        return False
+
+async def run_file_job(bot, job):
+    """Baixa (se necessário), envia o arquivo ao AnythingLLM e o adiciona ao workspace. Seguro para reexecução."""
+    payload = job["payload"]
+    chat_id = payload["chat_id"]
+    file_name = payload["file_name"]
+    local_file_path = payload["local_file_path"]
+    try:
+        if not os.path.exists(local_file_path):
+            file_obj = await bot.get_file(payload["file_id"])
+            os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+            await file_obj.download_to_drive(local_file_path)
+
+        location = payload.get("location")
+        if not location:
+            # Conversão opcional (imagem reduzida / texto extraído) em um pool de processos
+            upload_path, upload_name = await preprocess_upload(local_file_path, file_name)
+            upload_success, location = await upload_file_to_anythingllm(upload_path, upload_name)
+            if not upload_success or not location:
+                await bot.send_message(chat_id=chat_id, text="Erro ao enviar o arquivo.")
+                return False
+            payload["location"] = location
+            get_journal().update(job["id"], payload)
+
+        FILE_MAP[file_name] = location
+        save_file_map(FILE_MAP)
+        # Numa reexecução com o embedding já pedido, o job "embedding" do journal segue acompanhando
+        if payload.get("embedding") != "pending":
+            status = await submit_embedding(
+                bot, chat_id, job["user_id"], payload["workspace_slug"], [location], file_name
+            )
+            if status == "done":
+                await bot.send_message(chat_id=chat_id, text=f"Arquivo pronto para consultas: {file_name}")
+            elif status == "pending":
+                payload["embedding"] = status
+                get_journal().update(job["id"], payload)
+                await bot.send_message(
+                    chat_id=chat_id,
+                    text="Arquivo enviado! O embedding está em andamento; aviso quando estiver pronto para consultas (/status)."
+                )
+            else:
+                await bot.send_message(chat_id=chat_id, text="Erro ao adicionar ao workspace.")
+                return False
+        await index_file(job["user_id"], file_name, local_file_path)
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao processar arquivo: {str(e)}")
+        await bot.send_message(chat_id=chat_id, text="Erro ao processar o arquivo.")
+        return False
+
+async def submit_embedding(bot, chat_id, user_id, workspace_slug, locations, label):
+    """Pede o embedding sem esperar o fim; se ainda estiver em andamento, registra um job "embedding"
+    que acompanha o workspace em segundo plano. Retorna "done", "pending" ou None (erro)."""
+    status = await submit_workspace_embeddings(workspace_slug, locations)
+    if status == "pending":
+        job = get_journal().enqueue("embedding", user_id, {
+            "chat_id": chat_id,
+            "workspace_slug": workspace_slug,
+            "locations": locations,
+            "label": label,
+            "submitted_at": time.time()
+        })
+        start_job(bot, job)
+    return status
+
+def embedding_ready_text(payload):
+    if len(payload["locations"]) == 1:
+        return f"Arquivo pronto para consultas: {payload['label']}"
+    return f"{len(payload['locations'])} documentos prontos para consultas ({payload['label']})."
+
+async def run_embedding_job(bot, job):
+    """Consulta os documentos do workspace com backoff exponencial até os arquivos aparecerem
+    (embedding concluído e pesquisável) ou até EMBED_POLL_TIMEOUT; avisa o usuário no fim."""
+    payload = job["payload"]
+    give_up_at = payload["submitted_at"] + EMBED_POLL_TIMEOUT
+    delay = EMBED_POLL_INITIAL
+    while True:
+        missing = await run_blocking(missing_embeddings, payload["workspace_slug"], payload["locations"])
+        if missing == []:
+            logger.info(f"Embedding concluído no workspace {payload['workspace_slug']}: {payload['label']}")
+            await bot.send_message(chat_id=payload["chat_id"], text=embedding_ready_text(payload))
+            return True
+        remaining = give_up_at - time.time()
+        if remaining <= 0:
+            logger.error(f"Embedding não concluído em {EMBED_POLL_TIMEOUT:.0f}s: {missing or payload['locations']}")
+            await bot.send_message(
+                chat_id=payload["chat_id"],
+                text=f"O embedding de {payload['label']} não terminou a tempo. Tente /sync mais tarde."
+            )
+            return True
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, EMBED_POLL_MAX)
+
+JOB_RUNNERS = {
+    "expense": run_expense_job,
+    "file": run_file_job,
+    "import": run_import_job,
+    "embedding": run_embedding_job
+}
+
+# Jobs que só aguardam o AnythingLLM; na reexecução rodam em segundo plano para não atrasar os demais
+BACKGROUND_JOB_KINDS = {"embedding"}
+
+async def run_job(bot, job):
+    """Executa um job do journal e confirma sua conclusão.
+
+    O runner retorna True quando conclui. Um job que falhou (ou foi interrompido) fica
+    pendente para a próxima reexecução, a partir da etapa gravada no payload; só é
+    confirmado como falho na última tentativa (MAX_ATTEMPTS).
+    """
+    runner = JOB_RUNNERS.get(job["kind"])
+    if runner is None:
+        logger.error(f"Tipo de job desconhecido no journal: {job['kind']}")
+        get_journal().ack(job["id"])
+        return
+
+    RUNNING_JOBS.add(job["id"])
+    try:
+        done = await runner(bot, job)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Erro no job {job['id']} ({job['kind']}): {str(e)}")
+        done = False
+    finally:
+        RUNNING_JOBS.discard(job["id"])
+
+    if done:
+        get_journal().ack(job["id"])
+    elif job["attempts"] >= MAX_ATTEMPTS:
+        logger.error(f"Job {job['id']} ({job['kind']}) descartado após {job['attempts']} tentativas: {job['payload']}")
+        get_journal().ack(job["id"])
+    else:
+        logger.warning(f"Job {job['id']} ({job['kind']}) falhou na tentativa {job['attempts']}; será reexecutado.")
+
+def start_job(bot, job):
+    """Executa o job em segundo plano, já marcado como em andamento para a reexecução periódica não duplicá-lo."""
+    RUNNING_JOBS.add(job["id"])
+    return asyncio.create_task(run_job(bot, job))
+
+async def replay_pending_jobs(bot, user_filter=None):
+    """Reexecuta, em ordem, os jobs pendentes (de uma execução anterior ou que falharam), exceto os em andamento."""
+    jobs = get_journal().pending(user_filter, skip_ids=set(RUNNING_JOBS))
+    if jobs:
+        logger.info(f"Reexecutando {len(jobs)} jobs pendentes do journal.")
+    for job in jobs:
+        if job["kind"] in BACKGROUND_JOB_KINDS:
+            start_job(bot, job)
+        else:
+            await run_job(bot, job)
+
+async def generate_reply(message, user_id, workspace_slug, session_id, session_state):
+    """Executa a busca e a geração do LLM para a mensagem, sem enviar nada ao usuário.
+
+    Retorna (resposta, precisa_compactar). A resposta é um dict com text, sources_text,
+    charts (chaves dos gráficos) e dashboard (URLs juntadas no painel), ou None se vier vazia.
+    """
+    # As instruções completas de gráfico vão uma vez por sessão; depois, só o lembrete
+    wants_chart = "@agent" in message and "gráfico" in message.lower()
+    record = USER_WORKSPACE_MAP[user_id]
+    outgoing_message = build_message(
+        session_state, message,
+        instructions=CHART_INSTRUCTIONS if wants_chart else None,
+        reminder=CHART_INSTRUCTIONS_REMINDER
+    )
+
+    # O perfil de recuperação é aplicado ao workspace do usuário (só quando muda) e, como
+    # parâmetros da busca vetorial, ao workspace compartilhado da empresa
+    profile_name = resolve_profile(record, message)
+    profile = PROFILES[profile_name]
+    corpus_slug = await get_corpus_slug()
+    calls = {"profile": apply_retrieval_profile(user_id, workspace_slug, profile_name)}
+    if corpus_slug:
+        calls["corpus"] = run_blocking(
+            vector_search, corpus_slug, message, profile["topN"], profile["similarityThreshold"]
+        )
+    results, _ = await gather_calls(**calls)
+    corpus_hits = results.get("corpus") or []
+    chat_message = outgoing_message
+    if corpus_hits:
+        chat_message = f"{outgoing_message}\n\n{format_corpus_context(corpus_hits)}"
+
+    data = await run_blocking(chat_with_workspace, workspace_slug, chat_message, session_id)
+    # Os trechos da empresa mudam a cada pergunta e não entram no orçamento do histórico
+    needs_compaction = record_turn(session_state, outgoing_message, data, instructions_sent=wants_chart)
+    save_user_map(USER_WORKSPACE_MAP, user_id)
+
+    text_response = data.get("textResponse", "")
+    sources = merge_sources(data.get("sources", []), corpus_hits)
+    chart_urls, text_response = extract_chart_urls(data, text_response)
+
+    if not text_response and not chart_urls:
+        return None, needs_compaction
+
+    charts = []
+    invalid_charts = 0
+    for chart_url in chart_urls:
+        fixed_chart_url = fix_chart_url(chart_url)
+        if fixed_chart_url:
+            save_chart_urls(chart_url, fixed_chart_url)
+            charts.append(fixed_chart_url)
+        else:
+            invalid_charts += 1
+    if invalid_charts:
+        notice = "Configuração de gráfico inválida." if invalid_charts == 1 else f"{invalid_charts} configurações de gráfico inválidas."
+        text_response = compose_text(text_response, notice)
+
+    dashboard = None
+    wants_dashboard = CHART_DASHBOARD or any(keyword in message.lower() for keyword in DASHBOARD_KEYWORDS)
+    if len(charts) > 1 and wants_dashboard and dashboard_available():
+        # Um único item em cache para o painel inteiro
+        dashboard = charts
+        charts = ["painel:" + "\n".join(dashboard)]
+
+    reply = {
+        "text": text_response,
+        "sources_text": format_sources(sources) if sources else "",
+        "charts": charts,
+        "dashboard": dashboard
+    }
+    return reply, needs_compaction
+
+def reply_renderer(reply):
+    """Corrotina chave -> PNG dos gráficos da resposta, reaproveitando os arquivos já baixados."""
+    paths = reply.get("paths") or {}
+
+    async def render(key):
+        path = paths.get(key)
+        if path and os.path.exists(path):
+            return path
+        if reply.get("dashboard") and key.startswith("painel:"):
+            return await render_dashboard(reply["dashboard"])
+        return await render_chart(key)
+    return render
+
+async def send_reply(bot, chat_id, reply, header=""):
+    await deliver_reply(
+        bot, chat_id,
+        text=compose_text(header, reply["text"]),
+        sources_text=reply["sources_text"],
+        charts=reply["charts"],
+        render=reply_renderer(reply)
+    )
 
 async def chat_with_anythingllm(message, workspace_slug, session_id, update, context):
     logger.info(f"Enviando mensagem para AnythingLLM no workspace {workspace_slug} com sessionId {session_id}: '{message}'")
-    url = f"{ANYTHINGLLM_API}/v1/workspace/{workspace_slug}/chat"
     
     user_id = str(update.message.from_user.id)
     username = update.message.from_user.username or f"User{user_id}"
@@ -293,64 +920,37 @@ async def chat_with_anythingllm(message, workspace_slug, session_id, update, con
         await process_manual_expense(message, user_id, username, workspace_slug, context)
         return
 
-    enhanced_message = (
-        f"{message}. Quando solicitado um gráfico, use a ferramenta `create-chart` e retorne a URL do QuickChart no campo `chart.url` do response body da API, "
-        "sem incluir a URL no texto da resposta. Não use placeholders como '[Gráfico]' ou Markdown como '![Gráfico](URL)'. "
-        "Exemplo de resposta esperada: {{'textResponse': 'Aqui está o gráfico solicitado', 'chart': {{'url': 'https://quickchart.io/chart?c=...'}}}}."
-    ) if "@agent" in message and "gráfico" in message.lower() else message
-    
-    payload = {
-        "message": enhanced_message,
-        "mode": "chat",
-        "sessionId": session_id,
-        "attachments": []
-    }
-    
-    headers = get_headers()
+    session_state = session_context(USER_WORKSPACE_MAP[user_id], session_id)
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=600, verify=False)
-        response.raise_for_status()
-        data = response.json()
-        
-        text_response = data.get("textResponse", "")
-        sources = data.get("sources", [])
-        chart = data.get("chart", {})
-        chart_url = chart.get("url") if chart else None
-        
-        if not chart_url and "https://quickchart.io/chart?c=" in text_response:
-            import re
-            url_match = re.search(r'(https://quickchart\.io/chart\?c=[^\s\)]+)', text_response)
-            if url_match:
-                chart_url = url_match.group(0)
-                text_response = re.sub(r'!\[.*?\]\(https://quickchart\.io/chart\?c=[^\s\)]+\)', '', text_response).strip()
-        
-        if not text_response and not chart_url:
+        reply, needs_compaction = await generate_reply(message, user_id, workspace_slug, session_id, session_state)
+        if reply is None:
             await context.bot.send_message(chat_id=update.effective_chat.id, text="Desculpe, não recebi nenhuma resposta ou gráfico.")
             return
+
+        await send_reply(context.bot, update.effective_chat.id, reply)
         
-        if text_response:
-            await context.bot.send_message(chat_id=update.effective_chat.id, text=text_response)
-        
-        if sources:
-            sources_text = "\n\nFontes utilizadas:\n" + "\n".join([f"- {s['title']}: {s.get('chunk', 'N/A')}" for s in sources])
-            await context.bot.send_message(chat_id=update.effective_chat.id, text=sources_text)
-        
-        if chart_url:
-            processing_message = await context.bot.send_message(chat_id=update.effective_chat.id, text="Baixando gráfico...")
-            fixed_chart_url = fix_chart_url(chart_url)
-            save_chart_urls(chart_url, fixed_chart_url)
-            chart_path = download_chart_image(fixed_chart_url)
-            if chart_path:
-                with open(chart_path, "rb") as photo:
-                    await context.bot.send_photo(chat_id=update.effective_chat.id, photo=photo)
-                await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=processing_message.message_id)
-            else:
-                await context.bot.send_message(chat_id=update.effective_chat.id, text="Erro ao baixar o gráfico.")
+        # A compactação roda depois da resposta entregue
+        if needs_compaction:
+            await compact_session(user_id, workspace_slug, session_id, session_state)
         
     except Exception as e:
         logger.error(f"Erro ao comunicar com AnythingLLM: {str(e)}")
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Erro: {str(e)}")
 
+async def compact_session(user_id, workspace_slug, session_id, session_state):
+    """Resume a sessão com o LLM, reseta o histórico no AnythingLLM e guarda o resumo na thread."""
+    try:
+        data = await run_blocking(chat_with_workspace, workspace_slug, COMPACTION_PROMPT, session_id)
+        summary = data.get("textResponse", "").strip()
+        if not summary:
+            return
+        if await reset_chat(workspace_slug, session_id):
+            apply_summary(session_state, summary)
+            save_user_map(USER_WORKSPACE_MAP, user_id)
+            logger.info(f"Sessão {session_id} compactada ({len(summary)} caracteres de resumo).")
+    except Exception as e:
+        logger.error(f"Erro ao compactar a sessão {session_id}: {str(e)}")
+
 async def sync_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global USER_WORKSPACE_MAP
     user_id = str(update.message.from_user.id)
@@ -360,51 +960,140 @@ async def sync_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     workspace_slug = USER_WORKSPACE_MAP[user_id]["workspace"]
-    all_documents = list_all_custom_documents()
+    if CORPUS_WORKSPACE:
+        await sync_with_corpus(update, user_id, workspace_slug)
+        return
+    
+    # As duas listagens são independentes e rodam em paralelo
+    results, errors = await gather_calls(
+        all_documents=run_blocking(list_all_custom_documents, strict=True),
+        workspace_docs=run_blocking(list_workspace_documents, workspace_slug, strict=True)
+    )
+    if errors:
+        failed = []
+        if "all_documents" in errors:
+            failed.append("documentos do AnythingLLM")
+        if "workspace_docs" in errors:
+            failed.append("documentos do seu workspace")
+        await update.message.reply_text(f"Erro ao sincronizar: não foi possível listar {' e '.join(failed)}.")
+        return
+    
+    all_documents = results["all_documents"]
     if not all_documents:
         await update.message.reply_text("Nenhum documento encontrado para sincronizar.")
         return
     
-    workspace_docs = list_workspace_documents(workspace_slug)
-    embedded_locations = {doc.get("docpath") for doc in workspace_docs if doc.get("docpath")}
-    files_to_embed = [loc for loc in all_documents if loc not in embedded_locations]
+    workspace_docs = results["workspace_docs"]
+    files_to_embed = find_documents_to_embed(all_documents, workspace_docs)
     
     if not files_to_embed:
         await update.message.reply_text("Todos os documentos já estão sincronizados.")
         return
     
-    success = await update_workspace_embeddings(workspace_slug, adds=files_to_embed)
-    if success:
+    status = await submit_embedding(
+        context.bot, update.effective_chat.id, user_id, workspace_slug, files_to_embed, "sincronização"
+    )
+    if status == "done":
         await update.message.reply_text(f"{len(files_to_embed)} documentos sincronizados com sucesso!")
+    elif status == "pending":
+        await update.message.reply_text(
+            f"Sincronizando {len(files_to_embed)} documentos; aviso quando estiverem prontos para consultas (/status)."
+        )
+    else:
+        await update.message.reply_text("Erro ao sincronizar documentos.")
+
+async def sync_with_corpus(update, user_id, workspace_slug):
+    """Sincronização em camadas: documentos da empresa no workspace compartilhado (embedados uma única vez)
+    e apenas os arquivos pessoais do usuário no workspace dele."""
+    corpus_slug = await get_corpus_slug()
+    if not corpus_slug:
+        await update.message.reply_text("Erro ao configurar o workspace compartilhado.")
+        return
+
+    results, errors = await gather_calls(
+        all_documents=run_blocking(list_all_custom_documents, strict=True),
+        workspace_docs=run_blocking(list_workspace_documents, workspace_slug, strict=True),
+        corpus_docs=run_blocking(list_workspace_documents, corpus_slug, strict=True)
+    )
+    if errors:
+        await update.message.reply_text("Erro ao sincronizar: não foi possível listar os documentos.")
+        return
+
+    # Arquivos enviados pelo Telegram (FILE_MAP) são pessoais; o resto é da empresa
+    personal_docs = set(FILE_MAP.values())
+    user_prefix = f"{USER_WORKSPACE_MAP[user_id]['username']}/"
+    own_docs = [docpath for name, docpath in FILE_MAP.items() if name.startswith(user_prefix)]
+    company_docs = [docpath for docpath in results["all_documents"] if docpath not in personal_docs]
+
+    corpus_adds = find_documents_to_embed(company_docs, results["corpus_docs"])
+    personal_adds = find_documents_to_embed(own_docs, results["workspace_docs"])
+    # Documentos da empresa embedados antes no workspace do usuário saem dele
+    company_set = set(company_docs)
+    personal_removes = [
+        doc.get("docpath") for doc in results["workspace_docs"] if doc.get("docpath") in company_set
+    ]
+
+    if not corpus_adds and not personal_adds and not personal_removes:
+        await update.message.reply_text("Todos os documentos já estão sincronizados.")
+        return
+
+    calls = {}
+    if corpus_adds:
+        calls["corpus"] = update_workspace_embeddings(corpus_slug, adds=corpus_adds)
+    if personal_adds or personal_removes:
+        calls["personal"] = update_workspace_embeddings(workspace_slug, adds=personal_adds, removes=personal_removes)
+    results, _ = await gather_calls(**calls)
+
+    if all(results.get(name) for name in calls):
+        await update.message.reply_text(
+            f"Sincronização concluída: {len(corpus_adds)} documentos da empresa na base compartilhada, "
+            f"{len(personal_adds)} arquivos pessoais adicionados e {len(personal_removes)} documentos da empresa "
+            "retirados do seu workspace."
+        )
     else:
         await update.message.reply_text("Erro ao sincronizar documentos.")
 
+def register_user(user, workspace_slug):
+    """Cria o registro do usuário com a thread inicial e persiste o mapa de usuários."""
+    user_id = str(user.id)
+    session_id = new_session_id(user_id)
+    USER_WORKSPACE_MAP[user_id] = {
+        "user_id": user.id,
+        "username": user.username if user.username else f"User{user_id}",
+        "first_name": user.first_name,
+        "workspace": workspace_slug,
+        "active_thread": session_id,
+        "threads": {session_id: "Chat Inicial"},
+        "thread_order": [session_id]
+    }
+    save_user_map(USER_WORKSPACE_MAP, user_id)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global USER_WORKSPACE_MAP
     user = update.message.from_user
     user_id = str(user.id)
-    username = user.username if user.username else f"User{user_id}"
     
-    if not check_api_status():
+    if user_id in USER_WORKSPACE_MAP:
+        api_available = await run_blocking(check_api_status)
+    else:
+        # Status da API e workspace são independentes; a criação do workspace depende
+        # apenas da listagem, feita dentro de get_or_create_workspace
+        results, _ = await gather_calls(
+            api_available=run_blocking(check_api_status),
+            workspace_slug=run_blocking(get_or_create_workspace, user_id)
+        )
+        api_available = results.get("api_available")
+        if api_available:
+            workspace_slug = results.get("workspace_slug")
+            if not workspace_slug:
+                await update.message.reply_text("Erro ao configurar seu workspace.")
+                return
+            register_user(user, workspace_slug)
+    
+    if not api_available:
         await update.message.reply_text("Erro: A API do AnythingLLM não está disponível.")
         return
     
-    if user_id not in USER_WORKSPACE_MAP:
-        workspace_slug = get_or_create_workspace(user_id)
-        if not workspace_slug:
-            await update.message.reply_text("Erro ao configurar seu workspace.")
-            return
-        
-        USER_WORKSPACE_MAP[user_id] = {
-            "user_id": user.id,
-            "username": username,
-            "first_name": user.first_name,
-            "workspace": workspace_slug,
-            "active_thread": f"telegram-{user_id}-thread-{int(time.time())}",
-            "threads": {f"telegram-{user_id}-thread-{int(time.time())}": "Chat Inicial"}
-        }
-        save_user_map(USER_WORKSPACE_MAP)
-    
     await update.message.reply_text(f"Olá, {user.first_name}! Seu workspace está pronto. Use /help para mais informações.")
 
 async def novo_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -417,13 +1106,16 @@ async def novo_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     args = context.args
     thread_name = " ".join(args) if args else f"Thread {int(time.time())}"
-    new_session_id = f"telegram-{user_id}-thread-{int(time.time())}"
+    session_id = new_session_id(user_id)
     
-    USER_WORKSPACE_MAP[user_id]["threads"][new_session_id] = thread_name
-    USER_WORKSPACE_MAP[user_id]["active_thread"] = new_session_id
-    save_user_map(USER_WORKSPACE_MAP)
+    archived = add_thread(USER_WORKSPACE_MAP[user_id], thread_name, session_id)
+    save_user_map(USER_WORKSPACE_MAP, user_id)
     
-    await update.message.reply_text(f"Nova thread criada: '{thread_name}' ({new_session_id}).")
+    await update.message.reply_text(f"Nova thread criada: '{thread_name}' ({session_id}).")
+    if archived:
+        # Threads arquivadas também têm o histórico apagado no AnythingLLM
+        workspace_slug = USER_WORKSPACE_MAP[user_id]["workspace"]
+        await asyncio.gather(*(reset_chat(workspace_slug, old_session_id) for old_session_id in archived))
 
 async def historico_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global USER_WORKSPACE_MAP
@@ -433,30 +1125,40 @@ async def historico_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Use /start para configurar seu workspace primeiro.")
         return
     
-    threads = USER_WORKSPACE_MAP[user_id]["threads"]
-    active_thread = USER_WORKSPACE_MAP[user_id]["active_thread"]
-    
-    message = "Suas threads de chat:\n"
-    for idx, (session_id, name) in enumerate(threads.items(), 1):
-        status = " (ativa)" if session_id == active_thread else ""
-        message += f"{idx}. {name} ({session_id}){status}\n"
-    message += "\nPara alternar, use /historico_chat <número>"
-    
+    record = USER_WORKSPACE_MAP[user_id]
     args = context.args
-    if args:
+    
+    # /historico_chat <número> alterna; /historico_chat pag <n> mostra outra página
+    if args and args[0].lower() not in ("pag", "página", "pagina"):
         try:
-            idx = int(args[0]) - 1
-            if 0 <= idx < len(threads):
-                new_active_thread = list(threads.keys())[idx]
-                USER_WORKSPACE_MAP[user_id]["active_thread"] = new_active_thread
-                save_user_map(USER_WORKSPACE_MAP)
-                await update.message.reply_text(f"Thread alterada para: '{threads[new_active_thread]}'")
-            else:
-                await update.message.reply_text("Número inválido.")
+            session_id = select_thread(record, int(args[0]))
         except ValueError:
             await update.message.reply_text("Use um número válido.")
-    else:
-        await update.message.reply_text(message)
+            return
+        if session_id:
+            save_user_map(USER_WORKSPACE_MAP, user_id)
+            await update.message.reply_text(f"Thread alterada para: '{record['threads'][session_id]}'")
+        else:
+            await update.message.reply_text("Número inválido.")
+        return
+    
+    try:
+        page = int(args[1]) if len(args) > 1 else 1
+    except ValueError:
+        await update.message.reply_text("Use um número de página válido.")
+        return
+    
+    entries, page, total_pages = thread_page(record, page)
+    active_thread = record["active_thread"]
+    lines = [f"Suas threads de chat (página {page}/{total_pages}):"]
+    lines.extend(
+        f"{number}. {name} ({session_id}){' (ativa)' if session_id == active_thread else ''}"
+        for number, session_id, name in entries
+    )
+    lines.append("\nPara alternar, use /historico_chat <número>")
+    if total_pages > 1:
+        lines.append("Para outras páginas, use /historico_chat pag <número>")
+    await update.message.reply_text("\n".join(lines))
 
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global USER_WORKSPACE_MAP
@@ -469,6 +1171,9 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     session_id = USER_WORKSPACE_MAP[user_id]["active_thread"]
 
     if await reset_chat(workspace_slug, session_id):
+        # O histórico no servidor foi apagado; o resumo e a contagem de tokens também
+        USER_WORKSPACE_MAP[user_id].get("thread_context", {}).pop(session_id, None)
+        save_user_map(USER_WORKSPACE_MAP, user_id)
         await update.message.reply_text(f"Chat {session_id} resetado com sucesso!")
     else:
         await update.message.reply_text("Erro ao resetar o chat.")
@@ -481,7 +1186,7 @@ async def documentos_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     workspace_slug = USER_WORKSPACE_MAP[user_id]["workspace"]
-    embedded_docs = list_workspace_documents(workspace_slug)
+    embedded_docs = await run_blocking(list_workspace_documents, workspace_slug)
 
     if not embedded_docs:
         await update.message.reply_text("Nenhum documento embedado no seu contexto atual.")
@@ -490,6 +1195,43 @@ async def documentos_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     doc_list = "\n".join([f"- {doc.get('docpath', 'Sem nome')}" for doc in embedded_docs])
     await update.message.reply_text(f"Documentos embedados no seu contexto:\n{doc_list}")
 
+def resolve_file_names(pattern, scope=None):
+    """Resolve o argumento de /remove e /delete no FILE_MAP: nome exato, padrão glob (ex.: Ochozn/*.docx) ou prefixo terminado em '/'.
+
+    Com scope (ex.: 'Ochozn/'), só considera os arquivos com esse prefixo.
+    """
+    names = [name for name in FILE_MAP if scope is None or name.startswith(scope)]
+    if pattern in names:
+        return [pattern]
+    if any(char in pattern for char in "*?["):
+        return sorted(name for name in names if fnmatch.fnmatchcase(name, pattern))
+    if pattern.endswith("/"):
+        return sorted(name for name in names if name.startswith(pattern))
+    return []
+
+def file_scope(user_id):
+    """Prefixo dos arquivos que o usuário pode remover ou deletar; administradores não têm restrição."""
+    if is_admin(user_id):
+        return None
+    return f"{USER_WORKSPACE_MAP[user_id]['username']}/"
+
+def format_file_list(file_names, limit=20):
+    lines = [f"- {name}" for name in file_names[:limit]]
+    if len(file_names) > limit:
+        lines.append(f"... e mais {len(file_names) - limit}")
+    return "\n".join(lines)
+
+async def delete_documents_from_anythingllm(docpaths):
+    """Deleta vários documentos em paralelo, limitado por BULK_DELETE_CONCURRENCY. Retorna os docpaths deletados."""
+    semaphore = asyncio.Semaphore(BULK_DELETE_CONCURRENCY)
+
+    async def delete_one(docpath):
+        async with semaphore:
+            return await delete_document_from_anythingllm(docpath)
+
+    results = await asyncio.gather(*(delete_one(docpath) for docpath in docpaths))
+    return {docpath for docpath, deleted in zip(docpaths, results) if deleted}
+
 async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global USER_WORKSPACE_MAP, FILE_MAP
     user_id = str(update.message.from_user.id)
@@ -498,23 +1240,32 @@ async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if not context.args:
-        await update.message.reply_text("Use: /remove [nome_do_arquivo] (ex.: /remove user123/expenses_123456789.json)")
+        await update.message.reply_text("Use: /remove [nome_do_arquivo ou padrão] (ex.: /remove user123/expenses_123456789_2025-04.txt ou /remove user123/*.docx)")
         return
 
-    file_name = " ".join(context.args)
+    pattern = " ".join(context.args)
     workspace_slug = USER_WORKSPACE_MAP[user_id]["workspace"]
-    docpath = FILE_MAP.get(file_name)
+    file_names = resolve_file_names(pattern, file_scope(user_id))
 
-    if not docpath:
-        await update.message.reply_text(f"Arquivo '{file_name}' não encontrado no contexto.")
+    if not file_names:
+        await update.message.reply_text(f"Arquivo '{pattern}' não encontrado no contexto.")
         return
 
-    if await remove_document_from_workspace(workspace_slug, docpath):
-        del FILE_MAP[file_name]
+    # Uma única chamada de update-embeddings para todos os arquivos
+    docpaths = [FILE_MAP[name] for name in file_names]
+    if await update_workspace_embeddings(workspace_slug, removes=docpaths):
+        for name in file_names:
+            del FILE_MAP[name]
         save_file_map(FILE_MAP)
-        await update.message.reply_text(f"Arquivo '{file_name}' removido do contexto com sucesso!")
+        await unindex_files(file_names)
+        if len(file_names) == 1:
+            await update.message.reply_text(f"Arquivo '{file_names[0]}' removido do contexto com sucesso!")
+        else:
+            await update.message.reply_text(
+                f"{len(file_names)} arquivos removidos do contexto com sucesso:\n{format_file_list(file_names)}"
+            )
     else:
-        await update.message.reply_text(f"Erro ao remover '{file_name}' do contexto.")
+        await update.message.reply_text(f"Erro ao remover '{pattern}' do contexto.")
 
 async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global USER_WORKSPACE_MAP, FILE_MAP
@@ -524,35 +1275,458 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if not context.args:
-        await update.message.reply_text("Use: /delete [nome_do_arquivo] (ex.: /delete user123/expenses_123456789.json)")
+        await update.message.reply_text("Use: /delete [nome_do_arquivo ou padrão] (ex.: /delete user123/expenses_123456789_2025-04.txt ou /delete user123/*.docx)")
         return
 
-    file_name = " ".join(context.args)
+    pattern = " ".join(context.args)
     workspace_slug = USER_WORKSPACE_MAP[user_id]["workspace"]
-    docpath = FILE_MAP.get(file_name)
+    file_names = resolve_file_names(pattern, file_scope(user_id))
 
-    if not docpath:
-        await update.message.reply_text(f"Arquivo '{file_name}' não encontrado no contexto.")
+    if not file_names:
+        await update.message.reply_text(f"Arquivo '{pattern}' não encontrado no contexto.")
         return
 
-    if await remove_document_from_workspace(workspace_slug, docpath) and await delete_document_from_anythingllm(docpath):
-        del FILE_MAP[file_name]
+    docpaths = {name: FILE_MAP[name] for name in file_names}
+    # A remoção do contexto (uma chamada para todos) e as exclusões globais são independentes
+    results, _ = await gather_calls(
+        removed=update_workspace_embeddings(workspace_slug, removes=list(docpaths.values())),
+        deleted=delete_documents_from_anythingllm(list(docpaths.values()))
+    )
+    removed = results.get("removed")
+    deleted_docpaths = results.get("deleted") or set()
+    deleted_names = [name for name in file_names if docpaths[name] in deleted_docpaths]
+    failed_names = [name for name in file_names if docpaths[name] not in deleted_docpaths]
+
+    # O FILE_MAP é persistido uma única vez no final
+    for name in deleted_names:
+        del FILE_MAP[name]
+    if deleted_names:
         save_file_map(FILE_MAP)
-        await update.message.reply_text(f"Arquivo '{file_name}' deletado completamente do AnythingLLM!")
+        await unindex_files(deleted_names)
+
+    if len(file_names) == 1:
+        file_name = file_names[0]
+        if removed and deleted_names:
+            await update.message.reply_text(f"Arquivo '{file_name}' deletado completamente do AnythingLLM!")
+        elif deleted_names:
+            await update.message.reply_text(f"Arquivo '{file_name}' deletado do AnythingLLM, mas houve erro ao removê-lo do contexto do workspace.")
+        elif removed:
+            await update.message.reply_text(f"Arquivo '{file_name}' removido do contexto, mas houve erro ao deletá-lo do AnythingLLM. Tente /delete novamente.")
+        else:
+            await update.message.reply_text(f"Erro ao deletar '{file_name}'.")
+        return
+
+    message = f"{len(deleted_names)} de {len(file_names)} arquivos deletados do AnythingLLM."
+    if not removed:
+        message += "\nAtenção: houve erro ao removê-los do contexto do workspace."
+    if failed_names:
+        message += f"\nFalharam (tente /delete novamente):\n{format_file_list(failed_names)}"
+    await update.message.reply_text(message)
+
+async def perfil_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.message.from_user.id)
+    if user_id not in USER_WORKSPACE_MAP:
+        await update.message.reply_text("Use /start para configurar seu workspace primeiro.")
+        return
+
+    record = USER_WORKSPACE_MAP[user_id]
+    options = ", ".join(list(PROFILES) + [AUTO_PROFILE])
+    if not context.args:
+        current = record.get("retrieval_profile", AUTO_PROFILE)
+        await update.message.reply_text(f"Perfil de busca atual: {current}. Opções: {options}.")
+        return
+
+    choice = context.args[0].lower().replace("á", "a")
+    if choice not in PROFILES and choice != AUTO_PROFILE:
+        await update.message.reply_text(f"Perfil inválido. Opções: {options}.")
+        return
+
+    record["retrieval_profile"] = choice
+    save_user_map(USER_WORKSPACE_MAP, user_id)
+    if choice == AUTO_PROFILE:
+        await update.message.reply_text("Perfil de busca automático: escolhido a cada mensagem.")
     else:
-        await update.message.reply_text(f"Erro ao deletar '{file_name}'.")
+        await update.message.reply_text(f"Perfil de busca fixado em '{choice}'.")
+
+async def buscar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Busca direta no índice local dos documentos do usuário, sem passar pelo LLM."""
+    user_id = str(update.message.from_user.id)
+    if not context.args:
+        await update.message.reply_text("Use: /buscar [termos] (ex.: /buscar faturamento março)")
+        return
+
+    query = " ".join(context.args)
+    try:
+        results = await run_blocking(get_search_index().search, user_id, query)
+    except Exception as e:
+        # Ex.: banco corrompido ou SQLite compilado sem FTS5
+        logger.error(f"Erro na busca local por '{query}': {str(e)}")
+        await update.message.reply_text("Erro ao buscar nos seus documentos. Tente novamente mais tarde.")
+        return
+    if not results:
+        await update.message.reply_text(f"Nada encontrado para '{query}' nos seus documentos.")
+        return
+
+    lines = [f"Resultados para '{query}':"]
+    for file_name, snippet in results:
+        lines.append(f"\n- {file_name}:\n{snippet}")
+    await update.message.reply_text("\n".join(lines))
+
+def is_admin(user_id):
+    return str(user_id) in ADMIN_USER_IDS
+
+async def run_garbage_collection(dry_run):
+    """Aplica a retenção em documentos/ e gráficos/ e remove documentos órfãos do AnythingLLM."""
+    # Arquivos ainda usados por jobs pendentes no journal não são removidos
+    protected = [payload["local_file_path"] for payload in get_journal().peek() if payload.get("local_file_path")]
+    return await collect_garbage(
+        [
+            (DOCUMENTS_DIR, DOCUMENTS_RETENTION_DAYS, DOCUMENTS_MAX_MB * 1048576),
+            (GRAPHICS_DIR, GRAPHICS_RETENTION_DAYS, GRAPHICS_MAX_MB * 1048576),
+        ],
+        list(FILE_MAP.values()),
+        delete_document_from_anythingllm,
+        get_orphan_candidates(),
+        dry_run=dry_run,
+        protected=protected,
+        orphan_grace=GC_ORPHAN_GRACE_HOURS * 3600,
+        delete_rate=GC_DELETE_RATE,
+        max_deletes=GC_MAX_DELETES
+    )
+
+async def gc_job(context: ContextTypes.DEFAULT_TYPE):
+    report = await run_garbage_collection(GC_DRY_RUN)
+    logger.info(format_report(report))
+
+async def gc_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        await update.message.reply_text("Comando restrito a administradores.")
+        return
+
+    dry_run = not (context.args and context.args[0].lower() == "executar")
+    await update.message.reply_text("Executando coleta..." if not dry_run else "Gerando relatório de coleta (simulação)...")
+    report = await run_garbage_collection(dry_run)
+    await update.message.reply_text(format_report(report))
+
+async def generate_report(user_id, name):
+    """Gera o relatório pelo caminho normal de chat em uma sessão própria, baixa os gráficos e o armazena."""
+    workspace_slug = USER_WORKSPACE_MAP[user_id]["workspace"]
+    session_id = f"telegram-{user_id}-report-{name}"
+    with deadline(TURN_TIMEOUT):
+        # Cada geração parte de um histórico limpo
+        await reset_chat(workspace_slug, session_id)
+        reply, _ = await generate_reply(REPORTS[name]["prompt"], user_id, workspace_slug, session_id, {"tokens": 0})
+    if reply is None:
+        logger.warning(f"Relatório '{name}' do usuário {user_id} veio vazio.")
+        return None
+    render = reply_renderer(reply)
+    paths = await asyncio.gather(*(render(key) for key in reply["charts"]))
+    reply["paths"] = {key: path for key, path in zip(reply["charts"], paths) if path}
+    generated_at = await run_blocking(get_report_store().save, user_id, name, reply)
+    return reply, generated_at
+
+async def send_report(bot, chat_id, user_id, name, announce=True):
+    """Envia a última versão do relatório, gerando na hora se ainda não existir.
+
+    Com announce=False (entrega agendada), nada é enviado ao usuário antes de o relatório existir.
+    """
+    stored = await run_blocking(get_report_store().latest, user_id, name)
+    if stored is None:
+        if announce:
+            await bot.send_message(chat_id=chat_id, text=f"Gerando o relatório '{name}' pela primeira vez, aguarde...")
+        stored = await generate_report(user_id, name)
+        if stored is None:
+            if announce:
+                await bot.send_message(chat_id=chat_id, text="Erro ao gerar o relatório.")
+            return False
+    reply, generated_at = stored
+    header = f"{REPORTS[name]['title']} (gerado em {datetime.fromtimestamp(generated_at).strftime('%d/%m/%Y %H:%M')})"
+    await send_reply(bot, chat_id, reply, header=header)
+    return True
+
+def own_users_with(field, user_filter):
+    """users_with restrito aos usuários deste processo (no modo webhook, só o dono altera o registro)."""
+    return [user_id for user_id in users_with(field) if user_filter is None or user_filter(user_id)]
+
+async def report_generation_job(context: ContextTypes.DEFAULT_TYPE):
+    """Gera fora do horário comercial, um por vez, os relatórios assinados que vencem hoje."""
+    now = datetime.now()
+    generated = 0
+    for user_id in own_users_with("report_subscriptions", context.job.data):
+        for name in USER_WORKSPACE_MAP[user_id].get("report_subscriptions", {}):
+            if name not in REPORTS or not is_report_day(name, now):
+                continue
+            try:
+                if await generate_report(user_id, name):
+                    generated += 1
+            except Exception as e:
+                logger.error(f"Erro ao gerar o relatório '{name}' do usuário {user_id}: {str(e)}")
+    logger.info(f"{generated} relatórios pré-gerados.")
+
+async def report_delivery_job(context: ContextTypes.DEFAULT_TYPE):
+    """Entrega as assinaturas cujo horário já passou hoje, usando a versão armazenada.
+
+    Cada assinatura é tentada uma vez por dia: se a geração sob demanda falhar, o usuário
+    recebe um único aviso em vez de uma nova tentativa a cada minuto.
+    """
+    now = datetime.now()
+    today = now.strftime("%Y-%m-%d")
+    for user_id in own_users_with("report_subscriptions", context.job.data):
+        record = USER_WORKSPACE_MAP[user_id]
+        for name, chat_id in due_deliveries(record, now):
+            try:
+                delivered = await send_report(context.bot, chat_id, user_id, name, announce=False)
+            except Exception as e:
+                logger.error(f"Erro ao entregar o relatório '{name}' ao usuário {user_id}: {str(e)}")
+                delivered = False
+            record.setdefault("report_delivered", {})[name] = today
+            save_user_map(USER_WORKSPACE_MAP, user_id)
+            if not delivered:
+                await context.bot.send_message(
+                    chat_id=chat_id,
+                    text=f"Não foi possível gerar o relatório '{name}' hoje. Tente /relatorio {name} mais tarde."
+                )
+
+async def relatorio_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.message.from_user.id)
+    if user_id not in USER_WORKSPACE_MAP:
+        await update.message.reply_text("Use /start para configurar seu workspace primeiro.")
+        return
+
+    record = USER_WORKSPACE_MAP[user_id]
+    subscriptions = record.setdefault("report_subscriptions", {})
+    args = [arg.lower().replace("á", "a") for arg in context.args]
+    if not args:
+        lines = ["Relatórios disponíveis:"]
+        for name, report in REPORTS.items():
+            subscription = subscriptions.get(name)
+            status = f"assinado, entrega às {subscription['time']}" if subscription else "não assinado"
+            lines.append(f"- {name}: {report['title']}, {schedule_label(name)} ({status})")
+        lines.append(
+            "\nUse /relatorio [nome] para receber a última versão, /relatorio assinar [nome] [HH:MM] "
+            "ou /relatorio cancelar [nome]."
+        )
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    if args[0] in ("assinar", "cancelar"):
+        name = args[1] if len(args) > 1 else None
+        if name not in REPORTS:
+            await update.message.reply_text(f"Relatório inválido. Opções: {', '.join(REPORTS)}.")
+            return
+        if args[0] == "cancelar":
+            subscriptions.pop(name, None)
+            save_user_map(USER_WORKSPACE_MAP, user_id)
+            await update.message.reply_text(f"Assinatura do relatório '{name}' cancelada.")
+            return
+        delivery_time = parse_time(args[2]) if len(args) > 2 else DEFAULT_DELIVERY_TIME
+        if not delivery_time:
+            await update.message.reply_text("Horário inválido. Use HH:MM (ex.: 08:30).")
+            return
+        subscriptions[name] = {"time": delivery_time, "chat_id": update.effective_chat.id}
+        # Não entrega hoje se o horário escolhido já passou
+        if delivery_time <= datetime.now().strftime("%H:%M"):
+            record.setdefault("report_delivered", {})[name] = datetime.now().strftime("%Y-%m-%d")
+        save_user_map(USER_WORKSPACE_MAP, user_id)
+        await update.message.reply_text(
+            f"Relatório '{name}' assinado: entrega {schedule_label(name)} às {delivery_time}, "
+            f"pré-gerado às {REPORTS_GENERATE_AT}."
+        )
+        return
+
+    if args[0] not in REPORTS:
+        await update.message.reply_text(f"Relatório inválido. Opções: {', '.join(REPORTS)}.")
+        return
+    try:
+        await send_report(context.bot, update.effective_chat.id, user_id, args[0])
+    except Exception as e:
+        logger.error(f"Erro ao enviar o relatório '{args[0]}': {str(e)}")
+        await update.message.reply_text(f"Erro: {str(e)}")
+
+def format_seconds(ms):
+    return f"{ms / 1000:.1f}s"
+
+def format_usage(summary, days):
+    period = "nas últimas 24h" if days == 1 else f"nos últimos {days} dias"
+    if not summary["calls"]:
+        return f"Nenhuma chamada ao LLM {period}."
+    return (
+        f"Uso do LLM {period}:\n"
+        f"- Chamadas: {summary['calls']} ({summary['errors']} com erro, {summary['charts']} com gráfico)\n"
+        f"- Tempo total: {format_seconds(summary['total_ms'])}\n"
+        f"- Tempo por chamada: média {format_seconds(summary['avg_ms'])}, p90 {format_seconds(summary['p90_ms'])}, "
+        f"máximo {format_seconds(summary['max_ms'])}\n"
+        f"- Tamanho médio: {summary['avg_message_chars']} caracteres enviados, "
+        f"{summary['avg_response_chars']} recebidos, {summary['avg_sources']} fontes"
+    )
+
+async def uso_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Uso do LLM do próprio usuário ou, para administradores, as consultas mais lentas e os workspaces mais pesados."""
+    user_id = str(update.message.from_user.id)
+    args = [arg.lower() for arg in context.args]
+    numbers = [int(arg) for arg in args if arg.isdigit()]
+
+    if args and args[0] == "top":
+        if not is_admin(user_id):
+            await update.message.reply_text("Comando restrito a administradores.")
+            return
+        limit = numbers[0] if numbers else 10
+        days = numbers[1] if len(numbers) > 1 else USAGE_REPORT_DAYS
+        since = time.time() - days * 86400
+        usage = get_usage_log()
+        results, _ = await gather_calls(
+            overall=run_blocking(usage.summary, since),
+            workspaces=run_blocking(usage.top_workspaces, since, limit),
+            slowest=run_blocking(usage.slowest, since, limit)
+        )
+        lines = [format_usage(results["overall"], days), "", f"Workspaces com mais tempo de LLM (top {limit}):"]
+        for workspace, calls, total_ms, max_ms in results["workspaces"]:
+            lines.append(f"- {workspace}: {format_seconds(total_ms)} em {calls} chamadas (máx. {format_seconds(max_ms)})")
+        lines += ["", f"Consultas mais lentas (limite do log: {SLOW_QUERY_SECONDS:g}s):"]
+        for ts, workspace, wall_ms, message_chars, response_chars, sources, preview in results["slowest"]:
+            when = datetime.fromtimestamp(ts).strftime("%d/%m %H:%M")
+            lines.append(
+                f"- {format_seconds(wall_ms)} | {when} | {workspace} | {message_chars}/{response_chars} caracteres, "
+                f"{sources} fontes | {preview}"
+            )
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    if user_id not in USER_WORKSPACE_MAP:
+        await update.message.reply_text("Use /start para configurar seu workspace primeiro.")
+        return
+    days = numbers[0] if numbers else USAGE_REPORT_DAYS
+    summary = await run_blocking(
+        get_usage_log().summary, time.time() - days * 86400, USER_WORKSPACE_MAP[user_id]["workspace"]
+    )
+    await update.message.reply_text(format_usage(summary, days))
+
+def write_profile(profiler, directory):
+    """Grava as pilhas (folded) e o resumo em directory. Retorna (caminho_folded, resumo)."""
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    folded_path = os.path.join(directory, f"perfil_{stamp}.folded")
+    summary = profiler.summary()
+    with open(folded_path, "w", encoding="utf-8") as f:
+        f.write(profiler.folded())
+    with open(os.path.join(directory, f"perfil_{stamp}.txt"), "w", encoding="utf-8") as f:
+        f.write(summary)
+    return folded_path, summary
+
+async def run_profile(bot, chat_id, seconds):
+    global PROFILER
+    profiler = PROFILER
+    directory = None
+    try:
+        profiler.start()
+        await asyncio.sleep(seconds)
+        profiler.stop()
+        directory = tempfile.mkdtemp(prefix="perfil_")
+        folded_path, summary = await run_blocking(write_profile, profiler, directory)
+        logger.info(f"Perfil de {seconds}s concluído ({profiler.samples} amostras).")
+        with open(folded_path, "rb") as f:
+            await bot.send_document(
+                chat_id=chat_id, document=f, filename=os.path.basename(folded_path),
+                caption="Pilhas no formato folded (flamegraph.pl, speedscope)."
+            )
+        await send_text(bot, chat_id, summary)
+    except Exception as e:
+        logger.error(f"Erro no perfilamento: {str(e)}")
+        await bot.send_message(chat_id=chat_id, text=f"Erro no perfilamento: {str(e)}")
+    finally:
+        # Também em cancelamento: a thread de amostragem não pode continuar rodando
+        if profiler.running:
+            profiler.stop()
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+        PROFILER = None
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """(admin) Amostra as pilhas de todas as threads por N segundos e envia o resultado."""
+    global PROFILER
+    if not is_admin(update.message.from_user.id):
+        await update.message.reply_text("Comando restrito a administradores.")
+        return
+    if PROFILER is not None:
+        await update.message.reply_text("Já existe um perfilamento em andamento.")
+        return
+
+    seconds = PROFILE_DEFAULT_SECONDS
+    if context.args and context.args[0].isdigit():
+        seconds = min(max(int(context.args[0]), 1), PROFILE_MAX_SECONDS)
+    PROFILER = SamplingProfiler()
+    await update.message.reply_text(f"Perfilando por {seconds}s (event loop e threads de trabalho)...")
+    # Roda em segundo plano para não segurar os outros updates
+    asyncio.create_task(run_profile(context.bot, update.effective_chat.id, seconds))
+
+async def lag_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """(admin) Atraso do event loop: quanto tempo os handlers o mantiveram bloqueado."""
+    if not is_admin(update.message.from_user.id):
+        await update.message.reply_text("Comando restrito a administradores.")
+        return
+    if LAG_MONITOR is None or not LAG_MONITOR.lags:
+        await update.message.reply_text("Ainda não há medições do event loop.")
+        return
+
+    lines = [f"Atraso do event loop (medido a cada {LAG_MONITOR.interval}s):"]
+    for label, window in (("Último minuto", int(60 / LAG_MONITOR.interval)), ("Última hora", None)):
+        stats = LAG_MONITOR.stats(window)
+        lines.append(
+            f"- {label} ({stats['samples']} medições): média {stats['avg'] * 1000:.1f} ms, "
+            f"p50 {stats['p50'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms, máximo {stats['max'] * 1000:.1f} ms, "
+            f"{stats['stalls']} travamentos acima de {LAG_MONITOR.stall_seconds * 1000:.0f} ms"
+        )
+    worst, when = LAG_MONITOR.worst
+    if when:
+        lines.append(f"Pior atraso: {worst * 1000:.0f} ms em {datetime.fromtimestamp(when).strftime('%d/%m %H:%M:%S')}")
+    await update.message.reply_text("\n".join(lines))
+
+def format_elapsed(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Lista os arquivos do usuário ainda em processamento ou aguardando o embedding."""
+    user_id = str(update.message.from_user.id)
+    now = time.time()
+    lines = []
+    for job in get_journal().list(user_id=user_id):
+        payload = job["payload"]
+        if job["kind"] == "embedding":
+            count = len(payload["locations"])
+            detail = f" ({count} documentos)" if count > 1 else ""
+            lines.append(f"- {payload['label']}{detail}: embedding há {format_elapsed(now - payload['submitted_at'])}")
+        elif job["kind"] in ("file", "import") and payload.get("embedding") != "pending":
+            lines.append(f"- {payload['file_name']}: processando há {format_elapsed(now - job['created_at'])}")
+        elif job["kind"] == "expense":
+            lines.append(f"- Despesa: processando há {format_elapsed(now - job['created_at'])}")
+    if not lines:
+        await update.message.reply_text("Nenhum arquivo pendente. Todos os documentos estão prontos para consultas.")
+        return
+    await update.message.reply_text("Em andamento:\n" + "\n".join(lines))
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_message = (
         "Comandos disponíveis:\n\n"
         "/start - Configura seu workspace.\n"
         "/novo_chat [nome] - Cria uma nova thread.\n"
-        "/historico_chat - Lista suas threads.\n"
+        "/historico_chat [número | pag n] - Lista ou alterna suas threads.\n"
         "/reset - Reseta o chat atual.\n"
         "/sync - Sincroniza documentos.\n"
         "/documentos - Lista documentos embedados.\n"
-        "/remove [arquivo] - Remove um documento do contexto.\n"
-        "/delete [arquivo] - Deleta um documento do AnythingLLM.\n"
+        "/status - Mostra os arquivos ainda em processamento ou embedding.\n"
+        "/remove [arquivo ou padrão] - Remove documentos do contexto (ex.: /remove Ochozn/*.docx).\n"
+        "/delete [arquivo ou padrão] - Deleta documentos do AnythingLLM (ex.: /delete Ochozn/*.docx).\n"
+        "/perfil [rapido | equilibrado | profundo | auto] - Define o perfil de busca nos documentos.\n"
+        "/buscar [termos] - Busca trechos nos seus documentos, sem usar o LLM.\n"
+        "/relatorio [nome | assinar nome HH:MM | cancelar nome] - Relatórios pré-gerados.\n"
+        "/uso [dias] - Mostra seu uso do LLM.\n"
+        "/uso top [n] [dias] - (admin) Consultas mais lentas e workspaces com mais uso.\n"
+        "/gc [executar] - (admin) Relatório ou execução da coleta de lixo.\n"
+        "/profile [segundos] - (admin) Perfilamento do bot por amostragem.\n"
+        "/lag - (admin) Atraso do event loop.\n"
         "/help - Mostra esta mensagem.\n\n"
         "Envie 'Gastei R$ 20 com produto x hoje' para registrar despesas.\n"
         "Use '@agent Crie um gráfico...' para gráficos."
@@ -564,18 +1738,22 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
     user_id = str(user.id)
     
-    if not check_api_status():
-        await update.message.reply_text("Erro: A API está indisponível.")
-        return
-    
-    if user_id not in USER_WORKSPACE_MAP:
-        await start(update, context)
-    
-    workspace_slug = USER_WORKSPACE_MAP[user_id]["workspace"]
-    session_id = USER_WORKSPACE_MAP[user_id]["active_thread"]
-    message = update.message.text
-    
-    await chat_with_anythingllm(message, workspace_slug, session_id, update, context)
+    # Um único orçamento de tempo para todas as chamadas ao AnythingLLM deste turno
+    with deadline(TURN_TIMEOUT):
+        if not await run_blocking(check_api_status):
+            await update.message.reply_text("Erro: A API está indisponível.")
+            return
+        
+        if user_id not in USER_WORKSPACE_MAP:
+            await start(update, context)
+            if user_id not in USER_WORKSPACE_MAP:
+                return
+        
+        workspace_slug = USER_WORKSPACE_MAP[user_id]["workspace"]
+        session_id = USER_WORKSPACE_MAP[user_id]["active_thread"]
+        message = update.message.text
+        
+        await chat_with_anythingllm(message, workspace_slug, session_id, update, context)
 
 async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global USER_WORKSPACE_MAP, FILE_MAP
@@ -593,91 +1771,146 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Nenhum arquivo detectado.")
         return
 
-    file_obj = await file.get_file()
-    user_dir = os.path.join(DOCUMENTS_DIR, username)
-    os.makedirs(user_dir, exist_ok=True)
-    local_file_path = os.path.join(user_dir, file_name_orig)
-    await file_obj.download_to_drive(local_file_path)
-    
-    file_name = f"{username}/{file_name_orig}"
-    
     if user_id not in USER_WORKSPACE_MAP:
-        if not check_api_status():
+        results, _ = await gather_calls(
+            api_available=run_blocking(check_api_status),
+            workspace_slug=run_blocking(get_or_create_workspace, user_id)
+        )
+        if not results.get("api_available"):
             await update.message.reply_text("API indisponível.")
-            if os.path.exists(local_file_path):
-                os.remove(local_file_path)
             return
-        workspace_slug = get_or_create_workspace(user_id)
-        if not workspace_slug:
+        if not results.get("workspace_slug"):
             await update.message.reply_text("Erro ao configurar seu workspace.")
-            if os.path.exists(local_file_path):
-                os.remove(local_file_path)
             return
-        USER_WORKSPACE_MAP[user_id] = {
-            "user_id": user.id,
-            "username": username,
-            "first_name": user.first_name,
-            "workspace": workspace_slug,
-            "active_thread": f"telegram-{user_id}-thread-{int(time.time())}",
-            "threads": {f"telegram-{user_id}-thread-{int(time.time())}": "Chat Inicial"}
-        }
-        save_user_map(USER_WORKSPACE_MAP)
+        register_user(user, results["workspace_slug"])
     
-    workspace_slug = USER_WORKSPACE_MAP[user_id]["workspace"]
-    
-    async def process_file():
-        try:
-            upload_success, location = await upload_file_to_anythingllm(local_file_path, file_name)
-            if not upload_success or not location:
-                await context.bot.send_message(chat_id=update.effective_chat.id, text="Erro ao enviar o arquivo.")
-                return
-
-            FILE_MAP[file_name] = location
-            save_file_map(FILE_MAP)
-            if await update_workspace_embeddings(workspace_slug, adds=[location]):
-                await context.bot.send_message(chat_id=update.effective_chat.id, text="Arquivo adicionado ao workspace!")
-            else:
-                await context.bot.send_message(chat_id=update.effective_chat.id, text="Erro ao adicionar ao workspace.")
-        except Exception as e:
-            logger.error(f"Erro ao processar arquivo: {str(e)}")
-            await context.bot.send_message(chat_id=update.effective_chat.id, text="Erro ao processar o arquivo.")
-
-    asyncio.create_task(process_file())
+    # O download, o envio e o embedding ficam no journal para sobreviver a reinícios.
+    # Extratos (CSV/XLSX/OFX) são importados para o arquivo de despesas.
+    is_statement = os.path.splitext(file_name_orig)[1].lower() in STATEMENT_EXTENSIONS
+    job = get_journal().enqueue("import" if is_statement else "file", user_id, {
+        "chat_id": update.effective_chat.id,
+        "file_id": file.file_id,
+        "file_name": f"{username}/{file_name_orig}",
+        "local_file_path": os.path.join(DOCUMENTS_DIR, username, file_name_orig),
+        "workspace_slug": USER_WORKSPACE_MAP[user_id]["workspace"],
+        "username": username
+    })
+    start_job(context.bot, job)
     await update.message.reply_text("Arquivo sendo processado em segundo plano.")
 
+def close_shared_state():
+    """Grava os registros pendentes e fecha as conexões do armazenamento SQLite."""
+    for store in (USER_WORKSPACE_MAP, FILE_MAP):
+        if isinstance(store, (UserStore, SharedMap)):
+            store.close()
+
 def signal_handler(sig, frame):
     logger.info("Encerrando o bot...")
     TASK_QUEUE.put(None)
+    shutdown_pool()
+    close_shared_state()
     sys.exit(0)
 
 USER_WORKSPACE_MAP = {}
 FILE_MAP = {}
+JOURNAL = None
+SEARCH_INDEX = None
+REPORT_STORE = None
+ORPHAN_CANDIDATES = None
+USAGE_LOG = None
+PROFILER = None
+LAG_MONITOR = None
 TASK_QUEUE = Queue()
+RUNNING_JOBS = set()
+LEDGER_LOCKS = weakref.WeakValueDictionary()
 
-def main():
-    signal.signal(signal.SIGINT, signal_handler)
-    if not check_api_status():
-        logger.error("API do AnythingLLM não está disponível.")
-        sys.exit(1)
-    
-    global USER_WORKSPACE_MAP, FILE_MAP
-    USER_WORKSPACE_MAP = load_user_map()
-    FILE_MAP = load_file_map()
-    
-    logger.info("Bot iniciado.")
-    
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+async def retry_jobs_job(context: ContextTypes.DEFAULT_TYPE):
+    await replay_pending_jobs(context.bot, context.job.data)
+
+async def on_startup(app, shard=None):
+    """Inicialização assíncrona do bot; shard=(índice, total) no modo webhook."""
+    user_filter = None
+    if shard:
+        index, workers = shard
+        user_filter = lambda user_id: int(user_id) % workers == index
+    global LAG_MONITOR
+    set_usage_log(get_usage_log())
+    LAG_MONITOR = LoopLagMonitor()
+    LAG_MONITOR.start()
+    asyncio.create_task(replay_pending_jobs(app.bot, user_filter))
+
+    if app.job_queue is None:
+        logger.warning(
+            "JobQueue indisponível (instale python-telegram-bot[job-queue]); "
+            "reexecução periódica de jobs, coleta de lixo e relatórios desativados."
+        )
+        return
+
+    # Cada processo reexecuta os jobs dos seus usuários
+    if JOB_RETRY_INTERVAL > 0:
+        app.job_queue.run_repeating(
+            retry_jobs_job, interval=JOB_RETRY_INTERVAL, first=JOB_RETRY_INTERVAL, data=user_filter, name="jobs_reexecucao"
+        )
+
+    # A coleta de lixo roda em um único processo
+    if (shard is None or shard[0] == 0) and GC_INTERVAL_HOURS > 0:
+        app.job_queue.run_repeating(gc_job, interval=GC_INTERVAL_HOURS * 3600, first=600, name="coleta_de_lixo")
+
+    # Os relatórios alteram os registros dos usuários, então cada processo cuida só dos seus
+    generate_at = datetime.strptime(parse_time(REPORTS_GENERATE_AT) or "05:00", "%H:%M").time()
+    app.job_queue.run_daily(
+        report_generation_job, generate_at.replace(tzinfo=datetime.now().astimezone().tzinfo),
+        data=user_filter, name="relatorios_geracao"
+    )
+    app.job_queue.run_repeating(report_delivery_job, interval=60, first=30, data=user_filter, name="relatorios_entrega")
+
+def build_application():
+    app = Application.builder().token(TELEGRAM_TOKEN).post_init(on_startup).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("novo_chat", novo_chat))
     app.add_handler(CommandHandler("historico_chat", historico_chat))
     app.add_handler(CommandHandler("sync", sync_command))
     app.add_handler(CommandHandler("reset", reset_command))
     app.add_handler(CommandHandler("documentos", documentos_command))
+    app.add_handler(CommandHandler("status", status_command))
     app.add_handler(CommandHandler("remove", remove_command))
     app.add_handler(CommandHandler("delete", delete_command))
+    app.add_handler(CommandHandler("buscar", buscar_command))
+    app.add_handler(CommandHandler("perfil", perfil_command))
+    app.add_handler(CommandHandler("relatorio", relatorio_command))
+    app.add_handler(CommandHandler("uso", uso_command))
+    app.add_handler(CommandHandler("gc", gc_command))
+    app.add_handler(CommandHandler("profile", profile_command))
+    app.add_handler(CommandHandler("lag", lag_command))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     app.add_handler(MessageHandler(filters.Document.ALL | filters.PHOTO, handle_file))
+    return app
+
+def main():
+    signal.signal(signal.SIGINT, signal_handler)
+    if not check_api_status():
+        logger.error("API do AnythingLLM não está disponível.")
+        sys.exit(1)
+    
+    if WEBHOOK_URL:
+        from webhook import run_webhook_cluster
+        # Importa os JSON legados para o banco antes de subir os workers
+        use_shared_state(STATE_DB)
+        logger.info("Bot iniciado em modo webhook.")
+        run_webhook_cluster(
+            TELEGRAM_TOKEN, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, BOT_WORKERS, STATE_DB,
+            secret_token=WEBHOOK_SECRET, concurrency=WORKER_CONCURRENCY
+        )
+        return
+    
+    global FILE_MAP
+    use_user_store(STATE_DB)
+    FILE_MAP = load_file_map()
+    
+    logger.info("Bot iniciado.")
+    
+    app = build_application()
     
     worker_loop = asyncio.new_event_loop()
     worker_thread = Thread(target=lambda: worker_loop.run_until_complete(background_worker()), daemon=True)
@@ -691,6 +1924,7 @@ def main():
         app.stop()
         worker_loop.stop()
         worker_loop.close()
+        close_shared_state()
 
 async def background_worker():
     while True:
@@ -0,0 +1,179 @@
+import json
+import math
+import re
+import urllib.parse
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow é opcional: sem ele os gráficos são enviados como álbum em vez de painel
+    Image = None
+
+QUICKCHART_URL = "https://quickchart.io/chart"
+
+# Tabela de substituições aplicada em uma única passada por um regex de
+# alternância. "R$" e "%20" vêm antes dos caracteres isolados "$" e "%" para
+# terem prioridade na mesma posição.
+CHART_REPLACEMENTS = {
+    "R$": "Real",
+    "%20": " ",
+    "$": "USD",
+    "€": "EUR",
+    "£": "GBP",
+    "%": "pct",
+    "&": "and"
+}
+_REPLACEMENT_PATTERN = re.compile(
+    "|".join(re.escape(old) for old in sorted(CHART_REPLACEMENTS, key=len, reverse=True))
+)
+
+CHART_TYPES = {
+    "bar", "horizontalBar", "line", "pie", "doughnut", "radar", "polarArea", "scatter", "bubble",
+    "outlabeledPie", "sparkline", "progressBar", "radialGauge", "gauge", "violin", "boxplot", "sankey"
+}
+
+# Tokens de JSON no estilo JavaScript que precisam ser reescritos
+_LENIENT_TOKEN_PATTERN = re.compile(
+    r'(?P<double>"(?:[^"\\]|\\.)*")'
+    r"|(?P<single>'(?:[^'\\]|\\.)*')"
+    r"|(?P<comma>,(?=\s*[}\]]))"
+    r"|(?P<key>(?<![\w$])[A-Za-z_$][\w$]*(?=\s*:))"
+)
+
+
+def replace_special_chars(text):
+    """Aplica a tabela de substituições ao texto em uma única passada."""
+    return _REPLACEMENT_PATTERN.sub(lambda match: CHART_REPLACEMENTS[match.group(0)], text)
+
+
+def sanitize_chart_config(config):
+    """Substitui caracteres especiais em todos os textos da configuração, de forma iterativa e no próprio objeto."""
+    stack = [config]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            entries = node.items()
+        elif isinstance(node, list):
+            entries = enumerate(node)
+        else:
+            continue
+        for key, value in entries:
+            if isinstance(value, str):
+                node[key] = replace_special_chars(value)
+            elif isinstance(value, (dict, list)):
+                stack.append(value)
+    return config
+
+
+def _rewrite_lenient_token(match):
+    kind = match.lastgroup
+    token = match.group(0)
+    if kind == "double":
+        return token
+    if kind == "comma":
+        return ""
+    if kind == "key":
+        return '"' + token + '"'
+    # Texto entre aspas simples: \' vira ' e aspas duplas internas são escapadas
+    inner = re.sub(r'\\\'|(?<!\\)"', lambda m: "'" if m.group(0) == "\\'" else '\\"', token[1:-1])
+    return '"' + inner + '"'
+
+
+def _to_strict_json(text):
+    """Converte JSON no estilo JavaScript (aspas simples, chaves sem aspas, vírgulas finais) em JSON estrito."""
+    return _LENIENT_TOKEN_PATTERN.sub(_rewrite_lenient_token, text)
+
+
+def parse_chart_config(config_str):
+    """Interpreta a configuração do gráfico tolerando URL-encoding e JSON no estilo JavaScript."""
+    config_str = config_str.strip()
+    if not config_str.startswith("{"):
+        config_str = urllib.parse.unquote(config_str).strip()
+    # Descarta parâmetros extras da URL após a configuração (ex.: "&format=png")
+    end = config_str.rfind("}")
+    if end != -1 and config_str[end + 1:].lstrip().startswith("&"):
+        config_str = config_str[:end + 1]
+    try:
+        return json.loads(config_str)
+    except json.JSONDecodeError:
+        pass
+    # Sem aspas duplas nem \' no texto, trocar ' por " é uma conversão exata
+    if '"' not in config_str and "\\'" not in config_str:
+        try:
+            return json.loads(config_str.replace("'", '"'))
+        except json.JSONDecodeError:
+            pass
+    try:
+        return json.loads(_to_strict_json(config_str))
+    except (json.JSONDecodeError, ValueError) as e:
+        raise ValueError(f"JSON do gráfico inválido: {str(e)}")
+
+
+def validate_chart_config(config):
+    """Valida a estrutura mínima de uma configuração do QuickChart/Chart.js. Levanta ValueError se inválida."""
+    if not isinstance(config, dict):
+        raise ValueError("a configuração do gráfico deve ser um objeto")
+    chart_type = config.get("type")
+    if chart_type not in CHART_TYPES:
+        raise ValueError(f"tipo de gráfico não suportado: {chart_type!r}")
+    data = config.get("data")
+    if not isinstance(data, dict):
+        raise ValueError("campo 'data' ausente ou inválido")
+    labels = data.get("labels")
+    if labels is not None and not isinstance(labels, list):
+        raise ValueError("campo 'data.labels' deve ser uma lista")
+    datasets = data.get("datasets")
+    if not isinstance(datasets, list) or not datasets:
+        raise ValueError("campo 'data.datasets' deve ser uma lista não vazia")
+    for idx, dataset in enumerate(datasets):
+        if not isinstance(dataset, dict) or not isinstance(dataset.get("data"), list):
+            raise ValueError(f"dataset {idx} sem lista 'data'")
+    options = config.get("options")
+    if options is not None and not isinstance(options, dict):
+        raise ValueError("campo 'options' deve ser um objeto")
+    return config
+
+
+def normalize_chart_config(config_str):
+    """Interpreta, valida e sanitiza a configuração de um gráfico. Levanta ValueError se inválida."""
+    config = parse_chart_config(config_str)
+    validate_chart_config(config)
+    return sanitize_chart_config(config)
+
+
+def build_chart_url(config):
+    encoded_config = urllib.parse.quote(json.dumps(config, separators=(",", ":")))
+    return f"{QUICKCHART_URL}?c={encoded_config}&format=png"
+
+
+def dashboard_available():
+    return Image is not None
+
+
+def compose_dashboard(image_paths, output_path, columns=2, padding=16):
+    """Junta vários PNGs em uma grade (painel) e salva em output_path. Retorna o caminho ou None sem Pillow."""
+    if Image is None or not image_paths:
+        return None
+
+    images = []
+    for path in image_paths:
+        # convert() cria uma cópia em memória; o arquivo de origem é fechado logo em seguida
+        with Image.open(path) as source:
+            images.append(source.convert("RGBA"))
+    columns = min(columns, len(images))
+    rows = math.ceil(len(images) / columns)
+    cell_width = max(image.width for image in images)
+    cell_height = max(image.height for image in images)
+
+    dashboard = Image.new(
+        "RGBA",
+        (columns * cell_width + (columns + 1) * padding, rows * cell_height + (rows + 1) * padding),
+        "white"
+    )
+    for index, image in enumerate(images):
+        row, column = divmod(index, columns)
+        x = padding + column * (cell_width + padding) + (cell_width - image.width) // 2
+        y = padding + row * (cell_height + padding) + (cell_height - image.height) // 2
+        dashboard.paste(image, (x, y), image)
+    dashboard.convert("RGB").save(output_path, "PNG")
+    return output_path
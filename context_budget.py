@@ -0,0 +1,67 @@
+"""Controle do tamanho do contexto de cada sessão de chat.
+
+O estado fica no registro do usuário, em "thread_context" (session_id -> dict):
+tokens aproximados do histórico, resumo da conversa e se as instruções de
+gráfico já foram enviadas. Quando o histórico passa de CONTEXT_TOKEN_BUDGET,
+a sessão é compactada: o LLM resume a conversa, o histórico é resetado no
+AnythingLLM e o resumo segue junto da próxima mensagem.
+"""
+import os
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+SUMMARY_MAX_CHARS = 2000
+
+COMPACTION_PROMPT = (
+    "Resuma nossa conversa até aqui em no máximo 10 tópicos curtos, mantendo números, datas, "
+    "nomes de documentos e decisões. Responda apenas com o resumo."
+)
+
+
+def estimate_tokens(text):
+    # Aproximação de ~4 caracteres por token
+    return len(text or "") // 4 + 1
+
+
+def session_context(record, session_id):
+    contexts = record.setdefault("thread_context", {})
+    return contexts.setdefault(session_id, {"tokens": 0})
+
+
+def build_message(context, message, instructions=None, reminder=None):
+    """Monta a mensagem da vez: resumo pendente, mensagem e instruções completas (só na primeira vez) ou o lembrete."""
+    parts = []
+    if context.get("summary") and not context.get("summary_sent"):
+        parts.append(f"Resumo da conversa anterior:\n{context['summary']}")
+    parts.append(message)
+    if instructions:
+        parts.append(reminder if context.get("instructions_sent") and reminder else instructions)
+    return "\n\n".join(parts)
+
+
+def record_turn(context, sent_message, data, instructions_sent=False):
+    """Contabiliza a troca e retorna True se a sessão passou do orçamento e deve ser compactada.
+
+    Só o histórico conta: a mensagem montada por build_message e a resposta. O prompt_tokens
+    do AnythingLLM inclui o prompt de sistema e os trechos recuperados, que não se acumulam.
+    """
+    if context.get("summary"):
+        context["summary_sent"] = True
+    if instructions_sent:
+        context["instructions_sent"] = True
+
+    metrics = data.get("metrics") or {}
+    reply_tokens = metrics.get("completion_tokens") or estimate_tokens(data.get("textResponse"))
+    context["tokens"] = context.get("tokens", 0) + estimate_tokens(sent_message) + reply_tokens
+    return context["tokens"] > CONTEXT_TOKEN_BUDGET
+
+
+def apply_summary(context, summary):
+    """Registra o resumo após o reset do histórico no servidor."""
+    summary = summary[:SUMMARY_MAX_CHARS]
+    context.update(
+        summary=summary,
+        summary_sent=False,
+        instructions_sent=False,
+        tokens=estimate_tokens(summary),
+        compactions=context.get("compactions", 0) + 1
+    )
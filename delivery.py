@@ -0,0 +1,150 @@
+"""Entrega das respostas ao Telegram com o mínimo de chamadas de saída.
+
+- Texto e fontes vão em uma única mensagem, ou como legenda do gráfico quando cabem.
+- Vários gráficos vão em um único send_media_group.
+- Os file_ids devolvidos pelo Telegram ficam em cache pela URL do gráfico, então
+  um gráfico repetido não é baixado nem reenviado.
+- A mensagem "Baixando gráfico..." só aparece se a renderização demorar.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from contextlib import ExitStack
+
+from telegram import InputMediaPhoto
+
+logger = logging.getLogger(__name__)
+
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+MEDIA_GROUP_LIMIT = 10
+
+# Tempo de renderização a partir do qual o placeholder é exibido (segundos)
+PLACEHOLDER_DELAY = float(os.getenv("CHART_PLACEHOLDER_DELAY", "1.0"))
+
+
+class FileIdCache:
+    """Cache LRU chave -> file_id do Telegram."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def get(self, key):
+        file_id = self._items.get(key)
+        if file_id is not None:
+            self._items.move_to_end(key)
+        return file_id
+
+    def put(self, key, file_id):
+        self._items[key] = file_id
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+FILE_ID_CACHE = FileIdCache(int(os.getenv("FILE_ID_CACHE_SIZE", "1000")))
+
+
+def compose_text(*parts):
+    return "\n\n".join(part.strip() for part in parts if part and part.strip())
+
+
+def split_text(text, limit=MESSAGE_LIMIT):
+    """Quebra um texto longo em pedaços de até limit caracteres, de preferência em quebras de linha."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+async def send_text(bot, chat_id, text):
+    for chunk in split_text(text):
+        await bot.send_message(chat_id=chat_id, text=chunk)
+
+
+def _remember(key, message):
+    photo = getattr(message, "photo", None)
+    if photo:
+        FILE_ID_CACHE.put(key, photo[-1].file_id)
+
+
+async def send_photos(bot, chat_id, photos, caption=None):
+    """Envia [(chave, file_id, caminho)] como foto única ou álbuns de até 10 e guarda os file_ids.
+
+    Usa o file_id quando houver; senão envia o arquivo local.
+    """
+    with ExitStack() as stack:
+        def media_for(file_id, path):
+            return file_id if file_id else stack.enter_context(open(path, "rb"))
+
+        if len(photos) == 1:
+            key, file_id, path = photos[0]
+            message = await bot.send_photo(chat_id=chat_id, photo=media_for(file_id, path), caption=caption)
+            _remember(key, message)
+            return
+
+        for start in range(0, len(photos), MEDIA_GROUP_LIMIT):
+            batch = photos[start:start + MEDIA_GROUP_LIMIT]
+            media = [
+                InputMediaPhoto(media=media_for(file_id, path), caption=caption if start == 0 and i == 0 else None)
+                for i, (_, file_id, path) in enumerate(batch)
+            ]
+            messages = await bot.send_media_group(chat_id=chat_id, media=media)
+            for (key, _, _), message in zip(batch, messages):
+                _remember(key, message)
+
+
+async def deliver_reply(bot, chat_id, text="", sources_text="", charts=(), render=None,
+                        placeholder_delay=PLACEHOLDER_DELAY):
+    """Envia texto, fontes e gráficos de uma resposta.
+
+    charts: chaves dos gráficos (URLs corrigidas do QuickChart).
+    render: corrotina chave -> caminho do PNG (ou None em caso de erro),
+    chamada só para os gráficos que ainda não têm file_id em cache.
+    """
+    body = compose_text(text, sources_text)
+    if not charts:
+        if body:
+            await send_text(bot, chat_id, body)
+        return
+
+    caption = body if len(body) <= CAPTION_LIMIT else None
+    if body and caption is None:
+        await send_text(bot, chat_id, body)
+
+    file_ids = {key: FILE_ID_CACHE.get(key) for key in charts}
+    missing = [key for key, file_id in file_ids.items() if file_id is None]
+    paths = []
+    placeholder = None
+    try:
+        if missing:
+            rendering = asyncio.ensure_future(asyncio.gather(*(render(key) for key in missing)))
+            try:
+                paths = await asyncio.wait_for(asyncio.shield(rendering), placeholder_delay)
+            except asyncio.TimeoutError:
+                placeholder = await bot.send_message(chat_id=chat_id, text="Baixando gráfico...")
+                paths = await rendering
+        paths = dict(zip(missing, paths))
+
+        photos = [(key, file_ids[key], paths.get(key)) for key in file_ids if file_ids[key] or paths.get(key)]
+        failed = len(file_ids) - len(photos)
+        if photos:
+            await send_photos(bot, chat_id, photos, caption=caption)
+        if failed:
+            error_text = "Erro ao baixar o gráfico." if failed == 1 else f"Erro ao baixar {failed} gráficos."
+            await bot.send_message(chat_id=chat_id, text=compose_text(caption, error_text) if not photos else error_text)
+    finally:
+        # O placeholder não pode ficar para trás, nem se a renderização ou o envio falharem
+        if placeholder is not None:
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=placeholder.message_id)
+            except Exception as e:
+                logger.error(f"Erro ao remover a mensagem de espera: {str(e)}")
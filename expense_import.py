@@ -0,0 +1,182 @@
+"""Importação de despesas a partir de extratos bancários (CSV, XLSX e OFX).
+
+As linhas são lidas de uma vez, as colunas de data, valor e descrição são
+identificadas pelo cabeçalho e convertidas coluna a coluna. parse_statement
+retorna None quando o arquivo não parece um extrato, para que ele siga o fluxo
+normal de documentos.
+"""
+import csv
+import io
+import re
+import unicodedata
+from collections import Counter
+from datetime import date, datetime
+
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    load_workbook = None
+
+STATEMENT_EXTENSIONS = {".csv", ".xlsx", ".ofx"}
+
+DATE_HEADERS = {"data", "date", "dt", "data lancamento", "data de lancamento", "data da compra", "data movimento"}
+VALUE_HEADERS = {"valor", "amount", "value", "valor (r$)", "valor r$", "quantia", "montante", "valor em r$"}
+DESCRIPTION_HEADERS = {
+    "descricao", "description", "historico", "memo", "lancamento", "estabelecimento", "detalhes", "titulo"
+}
+
+_AMOUNT_CLEANUP = re.compile(r"[^\d,.\-]")
+_DATE_FORMATS = ("%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y", "%Y%m%d")
+_OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.IGNORECASE | re.DOTALL)
+_OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+
+def normalize_header(text):
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode("ascii")
+    return " ".join(text.lower().split())
+
+
+def parse_amount(raw):
+    """Converte '1.234,56', '-45,90', 'R$ 45.90' ou um número em float. Retorna None se inválido."""
+    if isinstance(raw, (int, float)):
+        return float(raw)
+    text = str(raw or "").strip()
+    negative = text.startswith("(") and text.endswith(")")
+    text = _AMOUNT_CLEANUP.sub("", text)
+    if not text or text in ("-", ".", ","):
+        return None
+    # O separador que aparece por último é o decimal
+    if "," in text and "." in text:
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text:
+        text = text.replace(",", ".")
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return -abs(value) if negative else value
+
+
+def parse_date(raw):
+    """Converte a data para AAAA-MM-DD. Retorna None se inválida."""
+    if isinstance(raw, (datetime, date)):
+        return raw.strftime("%Y-%m-%d")
+    text = str(raw or "").strip()[:10]
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def find_columns(header):
+    """Retorna os índices (data, valor, descrição) do cabeçalho ou None se não for um extrato."""
+    names = [normalize_header(cell) for cell in header]
+    columns = []
+    for candidates in (DATE_HEADERS, VALUE_HEADERS, DESCRIPTION_HEADERS):
+        index = next((i for i, name in enumerate(names) if name in candidates), None)
+        if index is None:
+            return None
+        columns.append(index)
+    return columns
+
+
+def rows_to_expenses(rows):
+    """Localiza o cabeçalho nas primeiras linhas e converte as colunas em despesas."""
+    for header_index, header in enumerate(rows[:20]):
+        columns = find_columns(header)
+        if columns:
+            break
+    else:
+        return None
+
+    date_col, value_col, description_col = columns
+    width = max(columns) + 1
+    body = [row for row in rows[header_index + 1:] if len(row) >= width]
+    dates = [parse_date(row[date_col]) for row in body]
+    values = [parse_amount(row[value_col]) for row in body]
+    descriptions = [" ".join(str(row[description_col] or "").split()) for row in body]
+    return select_debits(dates, values, descriptions)
+
+
+def select_debits(dates, values, descriptions):
+    """Monta as despesas das linhas válidas. Se o extrato tiver créditos e débitos, só os débitos (negativos) entram."""
+    valid = [(d, v, desc) for d, v, desc in zip(dates, values, descriptions) if d and v]
+    if any(v < 0 for _, v, _ in valid) and any(v > 0 for _, v, _ in valid):
+        valid = [(d, v, desc) for d, v, desc in valid if v < 0]
+    return [
+        {"date": d, "value": round(abs(v), 2), "description": desc or "sem descrição"}
+        for d, v, desc in valid
+    ]
+
+
+def read_csv_rows(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = raw.decode("latin-1")
+    sample = text[:4096]
+    try:
+        delimiter = csv.Sniffer().sniff(sample, delimiters=";,\t|").delimiter
+    except csv.Error:
+        delimiter = ";" if sample.count(";") > sample.count(",") else ","
+    return list(csv.reader(io.StringIO(text), delimiter=delimiter))
+
+
+def read_xlsx_rows(path):
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return [list(row) for row in workbook.worksheets[0].iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+
+
+def parse_ofx(path):
+    with open(path, "rb") as f:
+        text = f.read().decode("latin-1")
+    transactions = [dict(_OFX_FIELD.findall(block)) for block in _OFX_TRANSACTION.findall(text)]
+    if not transactions:
+        return None
+    dates = [parse_date(t.get("DTPOSTED", "")[:8]) for t in transactions]
+    values = [parse_amount(t.get("TRNAMT", "").replace(",", ".")) for t in transactions]
+    descriptions = [" ".join((t.get("MEMO") or t.get("NAME") or "").split()) for t in transactions]
+    return select_debits(dates, values, descriptions)
+
+
+def parse_statement(path):
+    """Lê o extrato e retorna a lista de despesas, ou None se o arquivo não for um extrato reconhecido."""
+    extension = path.rsplit(".", 1)[-1].lower()
+    if extension == "ofx":
+        return parse_ofx(path)
+    if extension == "csv":
+        return rows_to_expenses(read_csv_rows(path))
+    if extension == "xlsx" and load_workbook is not None:
+        return rows_to_expenses(read_xlsx_rows(path))
+    return None
+
+
+def expense_key(expense):
+    return (expense["date"], round(float(expense["value"]), 2), expense["description"].strip().lower())
+
+
+def merge_expenses(existing, imported):
+    """Retorna as despesas importadas que ainda não estão no livro.
+
+    A comparação conta ocorrências: dois lançamentos iguais no mesmo dia no extrato
+    continuam sendo dois, mas reimportar o mesmo extrato não duplica nada.
+    """
+    already = Counter(expense_key(expense) for expense in existing)
+    new_expenses = []
+    for expense in imported:
+        key = expense_key(expense)
+        if already[key]:
+            already[key] -= 1
+        else:
+            new_expenses.append(expense)
+    return new_expenses
@@ -0,0 +1,130 @@
+"""Renderização do arquivo de despesas em documentos compactos por mês.
+
+O JSON local continua sendo a fonte da verdade; ao AnythingLLM vai um documento
+por mês (texto ou CSV) com o total do mês e os subtotais por categoria já
+calculados, seguidos dos lançamentos. A saída é determinística: lançamentos e
+categorias são ordenados e o timestamp não entra, então um mês sem mudanças
+gera exatamente os mesmos bytes e não precisa ser re-embedado.
+"""
+import csv
+import io
+import os
+import unicodedata
+from collections import defaultdict
+
+EXPENSE_DOC_FORMAT = os.getenv("EXPENSE_DOC_FORMAT", "text").strip().lower()
+
+MONTHS = [
+    "janeiro", "fevereiro", "março", "abril", "maio", "junho",
+    "julho", "agosto", "setembro", "outubro", "novembro", "dezembro"
+]
+
+DEFAULT_CATEGORY = "Outros"
+CATEGORY_KEYWORDS = {
+    "Alimentação": (
+        "almoco", "jantar", "cafe", "lanche", "restaurante", "padaria", "mercado", "supermercado",
+        "ifood", "refeicao", "pizza", "acougue", "hortifruti"
+    ),
+    "Transporte": (
+        "uber", "99", "taxi", "onibus", "metro", "combustivel", "gasolina", "etanol", "posto",
+        "estacionamento", "pedagio", "passagem"
+    ),
+    "Moradia": ("aluguel", "condominio", "luz", "energia", "agua", "gas", "iptu", "internet", "telefone"),
+    "Saúde": ("farmacia", "drogaria", "medico", "consulta", "exame", "hospital", "dentista", "plano de saude"),
+    "Escritório": ("material", "escritorio", "papelaria", "impressora", "toner", "software", "assinatura"),
+    "Viagem": ("hotel", "hospedagem", "airbnb", "aereo", "viagem"),
+}
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii")
+    return f" {' '.join(text.lower().split())} "
+
+
+def expense_category(expense):
+    """Categoria informada no lançamento ou deduzida por palavras-chave da descrição."""
+    if expense.get("category"):
+        return expense["category"]
+    description = _normalize(expense.get("description"))
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(f" {keyword} " in description for keyword in keywords):
+            return category
+    return DEFAULT_CATEGORY
+
+
+def group_by_period(expenses):
+    """Agrupa as despesas por mês (AAAA-MM), com os lançamentos em ordem estável."""
+    periods = defaultdict(list)
+    for expense in expenses:
+        periods[expense["date"][:7]].append(expense)
+    return {
+        period: sorted(items, key=lambda e: (e["date"], e["description"], float(e["value"])))
+        for period, items in sorted(periods.items())
+    }
+
+
+def summarize_period(items):
+    """Retorna (total, [(categoria, subtotal, quantidade)]) com as categorias da maior para a menor."""
+    subtotals = defaultdict(lambda: [0.0, 0])
+    for expense in items:
+        entry = subtotals[expense_category(expense)]
+        entry[0] += float(expense["value"])
+        entry[1] += 1
+    categories = sorted(
+        ((category, round(total, 2), count) for category, (total, count) in subtotals.items()),
+        key=lambda c: (-c[1], c[0])
+    )
+    return round(sum(float(e["value"]) for e in items), 2), categories
+
+
+def count_label(count):
+    return f"{count} lançamento" if count == 1 else f"{count} lançamentos"
+
+
+def period_label(period):
+    year, month = period.split("-")
+    return f"{MONTHS[int(month) - 1]}/{year}"
+
+
+def render_period_text(period, items):
+    total, categories = summarize_period(items)
+    lines = [
+        f"Despesas de {period_label(period)} ({period})",
+        f"Total do mês: R$ {total:.2f} em {count_label(len(items))}",
+        "Subtotais por categoria:",
+    ]
+    lines += [f"- {category}: R$ {subtotal:.2f} ({count})" for category, subtotal, count in categories]
+    lines.append("Lançamentos (data | valor | descrição | categoria):")
+    lines += [
+        f"{e['date']} | R$ {float(e['value']):.2f} | {e['description']} | {expense_category(e)}" for e in items
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def render_period_csv(period, items):
+    total, categories = summarize_period(items)
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=";", lineterminator="\n")
+    writer.writerow(["periodo", "tipo", "data", "valor", "descricao", "categoria"])
+    writer.writerow([period, "total", "", f"{total:.2f}", count_label(len(items)), ""])
+    for category, subtotal, count in categories:
+        writer.writerow([period, "subtotal", "", f"{subtotal:.2f}", count_label(count), category])
+    for e in items:
+        writer.writerow([period, "lancamento", e["date"], f"{float(e['value']):.2f}", e["description"], expense_category(e)])
+    return output.getvalue()
+
+
+RENDERERS = {
+    "text": (render_period_text, ".txt"),
+    "csv": (render_period_csv, ".csv"),
+}
+
+
+def document_extension(doc_format=EXPENSE_DOC_FORMAT):
+    return RENDERERS.get(doc_format, RENDERERS["text"])[1]
+
+
+def render_ledger(expenses, doc_format=EXPENSE_DOC_FORMAT):
+    """Retorna {período: conteúdo} com um documento por mês."""
+    render = RENDERERS.get(doc_format, RENDERERS["text"])[0]
+    return {period: render(period, items) for period, items in group_by_period(expenses).items()}
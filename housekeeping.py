@@ -0,0 +1,144 @@
+"""Coleta de lixo dos diretórios locais e de documentos órfãos no AnythingLLM.
+
+Os diretórios locais seguem uma política de retenção por idade e tamanho
+total. Documentos do AnythingLLM que não estão no FILE_MAP nem em nenhum
+workspace são marcados como órfãos e só são deletados se continuarem órfãos
+depois de um período de carência (marcação e varredura em duas etapas), com
+uma taxa máxima de exclusões por segundo. As marcações ficam em um mapeamento
+persistente fornecido pelo chamador, para que a carência sobreviva a reinícios.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from api_utils import list_all_custom_documents, list_workspaces, list_workspace_documents, run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+def scan_local_dir(path, max_age_days, max_bytes, protected=()):
+    """Retorna os arquivos de path que violam a retenção: mais antigos que max_age_days ou,
+    do mais antigo para o mais novo, os que excedem max_bytes no total."""
+    protected = {os.path.abspath(p) for p in protected}
+    entries = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            file_path = os.path.abspath(os.path.join(root, name))
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+    entries.sort()
+
+    now = time.time()
+    total_bytes = sum(size for _, size, _ in entries)
+    expired = []
+    for mtime, size, file_path in entries:
+        if file_path in protected:
+            continue
+        too_old = max_age_days is not None and now - mtime > max_age_days * 86400
+        too_big = max_bytes is not None and total_bytes > max_bytes
+        if not (too_old or too_big):
+            continue
+        expired.append((file_path, size))
+        total_bytes -= size
+    return expired
+
+
+def remove_local_files(files):
+    removed_bytes = 0
+    for file_path, size in files:
+        try:
+            os.remove(file_path)
+            removed_bytes += size
+        except OSError as e:
+            logger.error(f"Erro ao remover {file_path}: {str(e)}")
+    return removed_bytes
+
+
+def find_orphan_documents(file_map_docpaths):
+    """Lista documentos do AnythingLLM que não estão no FILE_MAP nem embedados em nenhum workspace.
+
+    Qualquer falha de listagem propaga a exceção: uma listagem incompleta faria
+    documentos em uso parecerem órfãos.
+    """
+    all_documents = list_all_custom_documents(strict=True, use_cache=False)
+    referenced = set(file_map_docpaths)
+    for workspace in list_workspaces(strict=True):
+        docs = list_workspace_documents(workspace.get("slug"), strict=True, use_cache=False)
+        referenced.update(doc.get("docpath") for doc in docs if doc.get("docpath"))
+    return [docpath for docpath in all_documents if docpath not in referenced]
+
+
+async def collect_garbage(local_policies, file_map_docpaths, delete_document, candidates, dry_run=True,
+                          protected=(), orphan_grace=86400, delete_rate=2.0, max_deletes=100):
+    """Executa a coleta e retorna um relatório.
+
+    local_policies: lista de (diretório, idade máxima em dias, tamanho máximo em bytes).
+    delete_document: corrotina que deleta um docpath do AnythingLLM e retorna bool.
+    candidates: mapeamento docpath -> momento em que foi visto órfão pela primeira vez.
+    Em dry_run nada é removido, mas os órfãos continuam sendo marcados.
+    """
+    report = {"dry_run": dry_run, "local": {}, "orphans": [], "pending_orphans": [], "deleted": [], "errors": []}
+
+    for path, max_age_days, max_bytes in local_policies:
+        files = await run_blocking(scan_local_dir, path, max_age_days, max_bytes, protected)
+        freed = sum(size for _, size in files)
+        if files and not dry_run:
+            freed = await run_blocking(remove_local_files, files)
+        report["local"][path] = {"files": len(files), "bytes": freed}
+
+    try:
+        orphans = await run_blocking(find_orphan_documents, file_map_docpaths)
+    except Exception as e:
+        logger.error(f"Varredura de órfãos abortada: {str(e)}")
+        report["errors"].append(f"varredura de órfãos: {str(e)}")
+        return report
+
+    now = time.time()
+    orphan_set = set(orphans)
+    for docpath in list(candidates):
+        if docpath not in orphan_set:
+            del candidates[docpath]
+    ready = []
+    for docpath in orphans:
+        first_seen = candidates.setdefault(docpath, now)
+        if now - first_seen >= orphan_grace:
+            ready.append(docpath)
+        else:
+            report["pending_orphans"].append(docpath)
+    report["orphans"] = ready
+
+    if dry_run:
+        return report
+
+    interval = 1.0 / delete_rate if delete_rate > 0 else 0
+    for docpath in ready[:max_deletes]:
+        if await delete_document(docpath):
+            report["deleted"].append(docpath)
+            candidates.pop(docpath, None)
+        else:
+            report["errors"].append(f"falha ao deletar {docpath}")
+        if interval:
+            await asyncio.sleep(interval)
+    return report
+
+
+def format_report(report, limit=15):
+    title = "Relatório de coleta (simulação)" if report["dry_run"] else "Relatório de coleta"
+    lines = [f"{title}:"]
+    for path, stats in report["local"].items():
+        action = "a remover" if report["dry_run"] else "removidos"
+        lines.append(f"- {os.path.basename(path)}: {stats['files']} arquivos {action} ({stats['bytes'] / 1048576:.1f} MB)")
+    lines.append(f"- Documentos órfãos prontos para exclusão: {len(report['orphans'])}")
+    lines.extend(f"  • {docpath}" for docpath in report["orphans"][:limit])
+    if len(report["orphans"]) > limit:
+        lines.append(f"  ... e mais {len(report['orphans']) - limit}")
+    lines.append(f"- Órfãos em período de carência: {len(report['pending_orphans'])}")
+    if not report["dry_run"]:
+        lines.append(f"- Documentos deletados: {len(report['deleted'])}")
+    for error in report["errors"]:
+        lines.append(f"- Erro: {error}")
+    return "\n".join(lines)
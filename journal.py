@@ -0,0 +1,104 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+
+class JobJournal:
+    """Fila durável de jobs em SQLite.
+
+    Cada job é gravado antes de começar e só é removido com ack() depois de
+    concluído. Jobs que ficaram pendentes (ex.: o processo morreu no meio)
+    são devolvidos por pending() para serem reexecutados na inicialização.
+    O payload pode ser atualizado a cada etapa para que a reexecução pule o
+    que já foi feito.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, user_id TEXT NOT NULL, "
+                "payload TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def enqueue(self, kind, user_id, payload):
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (kind, user_id, payload, attempts, created_at, updated_at) VALUES (?, ?, ?, 1, ?, ?)",
+                (kind, str(user_id), json.dumps(payload, ensure_ascii=False), now, now)
+            )
+        job = {"id": cursor.lastrowid, "kind": kind, "user_id": str(user_id), "payload": payload, "attempts": 1}
+        logger.debug(f"Job {job['id']} ({kind}) registrado no journal.")
+        return job
+
+    def update(self, job_id, payload):
+        """Grava o progresso de um job (ex.: localização já enviada ao AnythingLLM)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET payload = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(payload, ensure_ascii=False), time.time(), job_id)
+            )
+
+    def ack(self, job_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        logger.debug(f"Job {job_id} concluído.")
+
+    def peek(self):
+        """Retorna os payloads dos jobs não concluídos sem contar tentativas."""
+        with self._lock:
+            rows = self._conn.execute("SELECT payload FROM jobs ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def list(self, kind=None, user_id=None):
+        """Retorna os jobs não concluídos (com created_at), opcionalmente filtrados, sem contar tentativas."""
+        query, params = "SELECT id, kind, user_id, payload, created_at FROM jobs WHERE 1 = 1", []
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(str(user_id))
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id", params).fetchall()
+        return [
+            {"id": job_id, "kind": job_kind, "user_id": owner, "payload": json.loads(payload), "created_at": created_at}
+            for job_id, job_kind, owner, payload, created_at in rows
+        ]
+
+    def pending(self, user_filter=None, skip_ids=()):
+        """Retorna os jobs não concluídos em ordem de criação, contando uma nova tentativa para cada um.
+
+        user_filter permite que cada processo do modo webhook reexecute só os jobs dos seus usuários;
+        skip_ids exclui os jobs que ainda estão em execução neste processo.
+        """
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, kind, user_id, payload, attempts FROM jobs ORDER BY id"
+            ).fetchall()
+            jobs = []
+            for job_id, kind, user_id, payload, attempts in rows:
+                if job_id in skip_ids or (user_filter and not user_filter(user_id)):
+                    continue
+                if attempts >= MAX_ATTEMPTS:
+                    logger.error(f"Job {job_id} ({kind}) descartado após {attempts} tentativas: {payload}")
+                    self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                    continue
+                self._conn.execute("UPDATE jobs SET attempts = attempts + 1 WHERE id = ?", (job_id,))
+                jobs.append({
+                    "id": job_id, "kind": kind, "user_id": user_id,
+                    "payload": json.loads(payload), "attempts": attempts + 1
+                })
+        return jobs
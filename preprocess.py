@@ -0,0 +1,184 @@
+"""Pré-processamento local dos arquivos antes do envio ao AnythingLLM.
+
+Imagens são reduzidas e recomprimidas em JPEG; PDFs e DOCX viram um .txt com o
+texto extraído. O trabalho de CPU roda em um pool de processos, fora do loop
+de eventos. Cada etapa depende de uma biblioteca opcional (Pillow, pypdf,
+python-docx); sem ela, ou se a conversão falhar, o arquivo original é enviado.
+O mesmo pool extrai o texto usado pelo índice de busca local (/buscar).
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    import docx
+except ImportError:
+    docx = None
+
+logger = logging.getLogger(__name__)
+
+# Tipos a pré-processar, separados por vírgula: image, pdf, docx (vazio desativa)
+PREPROCESS_KINDS = {kind.strip() for kind in os.getenv("PREPROCESS_KINDS", "").split(",") if kind.strip()}
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1600"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+# PDFs com menos texto que isso por página são tratados como digitalizados e vão para o OCR do AnythingLLM
+PDF_MIN_CHARS_PER_PAGE = 20
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+TEXT_EXTENSIONS = {".txt", ".md", ".csv", ".json", ".html", ".xml"}
+
+PREPROCESS_POOL = None
+
+
+def shrink_image(path, output_path, max_side, quality):
+    """Reduz a imagem para no máximo max_side pixels e salva em JPEG. Retorna None se não houver ganho."""
+    with Image.open(path) as image:
+        image.thumbnail((max_side, max_side))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(output_path, "JPEG", quality=quality, optimize=True)
+    if os.path.getsize(output_path) >= os.path.getsize(path):
+        os.remove(output_path)
+        return None
+    return output_path
+
+
+def read_pdf_text(path):
+    """Texto do PDF, ou None se ele for digitalizado (sem camada de texto)."""
+    reader = PdfReader(path)
+    pages = [page.extract_text() or "" for page in reader.pages]
+    if not pages or sum(len(text.strip()) for text in pages) < PDF_MIN_CHARS_PER_PAGE * len(pages):
+        return None
+    return "\n\n".join(text.strip() for text in pages if text.strip())
+
+
+def read_docx_text(path):
+    document = docx.Document(path)
+    lines = [paragraph.text for paragraph in document.paragraphs if paragraph.text.strip()]
+    for table in document.tables:
+        for row in table.rows:
+            lines.append(" | ".join(cell.text.strip() for cell in row.cells))
+    return "\n".join(lines) or None
+
+
+def write_text(text, output_path):
+    if not text:
+        return None
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return output_path
+
+
+def extract_text(path):
+    """Texto do arquivo para o índice de busca, ou None se o tipo não for suportado. Roda no pool de processos."""
+    # Reaproveita o .txt gerado pelo pré-processamento, se houver
+    if os.path.exists(f"{path}.txt"):
+        path = f"{path}.txt"
+    extension = os.path.splitext(path)[1].lower()
+    if extension in TEXT_EXTENSIONS:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    if extension == ".pdf" and PdfReader is not None:
+        return read_pdf_text(path)
+    if extension == ".docx" and docx is not None:
+        return read_docx_text(path)
+    return None
+
+
+def preprocess_file(path, kinds, max_side=IMAGE_MAX_SIDE, quality=IMAGE_QUALITY):
+    """Converte o arquivo conforme a extensão. Retorna (caminho, extensão para o envio) ou None.
+
+    Roda dentro do pool de processos.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in IMAGE_EXTENSIONS and "image" in kinds and Image is not None:
+        output_path = shrink_image(path, f"{path}.reduzida.jpg", max_side, quality)
+        return (output_path, ".jpg") if output_path else None
+    if extension == ".pdf" and "pdf" in kinds and PdfReader is not None:
+        output_path = write_text(read_pdf_text(path), f"{path}.txt")
+        return (output_path, ".txt") if output_path else None
+    if extension == ".docx" and "docx" in kinds and docx is not None:
+        output_path = write_text(read_docx_text(path), f"{path}.txt")
+        return (output_path, ".txt") if output_path else None
+    return None
+
+
+def get_pool():
+    global PREPROCESS_POOL
+    if PREPROCESS_POOL is None:
+        PREPROCESS_POOL = ProcessPoolExecutor(
+            max_workers=PREPROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return PREPROCESS_POOL
+
+
+def shutdown_pool():
+    global PREPROCESS_POOL
+    if PREPROCESS_POOL is not None:
+        PREPROCESS_POOL.shutdown(wait=False)
+        PREPROCESS_POOL = None
+
+
+async def preprocess_upload(path, file_name):
+    """Retorna (caminho, nome) a enviar ao AnythingLLM: o arquivo convertido ou o original."""
+    if not PREPROCESS_KINDS:
+        return path, file_name
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(get_pool(), preprocess_file, path, PREPROCESS_KINDS)
+    except BrokenProcessPool as e:
+        # Um worker morreu (ex.: falta de memória); o próximo envio cria um pool novo
+        logger.error(f"Pool de pré-processamento interrompido em {file_name}, enviando o original: {str(e)}")
+        shutdown_pool()
+        return path, file_name
+    except Exception as e:
+        logger.error(f"Erro ao pré-processar {file_name}, enviando o original: {str(e)}")
+        return path, file_name
+    if not result:
+        return path, file_name
+
+    output_path, extension = result
+    upload_name = f"{os.path.splitext(file_name)[0]}{extension}" if extension == ".jpg" else f"{file_name}{extension}"
+    logger.info(
+        f"{file_name} pré-processado: {os.path.getsize(path)} -> {os.path.getsize(output_path)} bytes ({upload_name})"
+    )
+    return output_path, upload_name
+
+
+async def extract_upload_text(path):
+    """Extrai o texto de um arquivo no pool de processos. Retorna None se não houver texto ou em caso de erro."""
+    try:
+        loop = asyncio.get_running_loop()
+        # Arquivos de texto só precisam ser lidos; não vale a ida ao pool de processos
+        plain = os.path.splitext(path)[1].lower() in TEXT_EXTENSIONS
+        return await loop.run_in_executor(None if plain else get_pool(), extract_text, path)
+    except BrokenProcessPool as e:
+        logger.error(f"Pool de pré-processamento interrompido ao extrair texto de {path}: {str(e)}")
+        shutdown_pool()
+    except Exception as e:
+        logger.error(f"Erro ao extrair texto de {path}: {str(e)}")
+    return None
+
+
+async def run_in_pool(func, *args):
+    """Executa func no pool de processos; se o pool tiver sido interrompido, ele é recriado na próxima chamada."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_pool(), func, *args)
+    except BrokenProcessPool:
+        shutdown_pool()
+        raise
@@ -0,0 +1,147 @@
+"""Perfilamento sob demanda e medição do atraso do event loop.
+
+SamplingProfiler amostra, em uma thread própria, as pilhas de todas as threads
+(event loop, executores do run_blocking e worker de segundo plano) com
+sys._current_frames, sem dependências externas. O resultado sai em formato
+"folded" (uma pilha por linha com a contagem de amostras), aceito pelo
+flamegraph.pl, speedscope e similares, e em uma lista das funções mais
+frequentes.
+
+LoopLagMonitor mede quanto o event loop demora a acordar de um sleep curto:
+esse atraso é o tempo em que algum handler bloqueou o loop.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+LAG_INTERVAL = 0.5
+LAG_HISTORY = 7200
+LAG_STALL_SECONDS = float(os.getenv("LOOP_LAG_STALL_SECONDS", "0.1"))
+
+# Frames de espera e de inicialização de threads, que só poluem o resumo
+IDLE_FRAMES = ("wait (threading.py", "_worker (thread.py", "select (selectors.py", "get (queue.py")
+BOOTSTRAP_FRAMES = ("_bootstrap (threading.py", "_bootstrap_inner (threading.py", "run (threading.py", "run (thread.py")
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="perfilador", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.elapsed = time.monotonic() - self.started_at
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}").replace(";", ","))
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def folded(self):
+        """Pilhas no formato folded (raiz;...;folha contagem), da mais frequente para a menos."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit=20):
+        """Retorna ([(função, amostras próprias)], [(função, amostras inclusivas)]), sem a thread na raiz."""
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+        return own.most_common(limit), inclusive.most_common(limit)
+
+    def summary(self, limit=20, exclude_idle=True):
+        """Texto com as funções mais frequentes; por padrão ignora threads paradas em espera."""
+        own, inclusive = self.top_functions(limit * 3)
+        if exclude_idle:
+            own = [(label, count) for label, count in own if not label.startswith(IDLE_FRAMES)]
+            inclusive = [
+                (label, count) for label, count in inclusive if not label.startswith(IDLE_FRAMES + BOOTSTRAP_FRAMES)
+            ]
+        total = sum(self.stacks.values()) or 1
+        lines = [f"{self.samples} amostras em {self.elapsed:.1f}s (intervalo {self.interval * 1000:.0f} ms)", "", "Tempo próprio:"]
+        lines += [f"{count * 100 / total:5.1f}%  {label}" for label, count in own[:limit]]
+        lines += ["", "Tempo inclusivo:"]
+        lines += [f"{count * 100 / total:5.1f}%  {label}" for label, count in inclusive[:limit]]
+        return "\n".join(lines)
+
+
+class LoopLagMonitor:
+    """Mede o atraso do event loop a cada LAG_INTERVAL segundos e guarda o histórico recente."""
+
+    def __init__(self, interval=LAG_INTERVAL, history=LAG_HISTORY, stall_seconds=LAG_STALL_SECONDS):
+        self.interval = interval
+        self.stall_seconds = stall_seconds
+        self.lags = deque(maxlen=history)
+        self.worst = (0.0, None)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lags.append(lag)
+            if lag > self.worst[0]:
+                self.worst = (lag, time.time())
+
+    def stats(self, window=None):
+        """Estatísticas (em segundos) das últimas window medições, ou de todo o histórico."""
+        lags = list(self.lags)[-window:] if window else list(self.lags)
+        if not lags:
+            return None
+        ordered = sorted(lags)
+        pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+        return {
+            "samples": len(lags),
+            "period": len(lags) * self.interval,
+            "avg": sum(lags) / len(lags),
+            "p50": pick(50),
+            "p99": pick(99),
+            "max": ordered[-1],
+            "stalls": sum(1 for lag in lags if lag >= self.stall_seconds),
+        }
@@ -0,0 +1,112 @@
+"""Relatórios executivos pré-gerados.
+
+Os relatórios assinados são gerados fora do horário comercial (REPORTS_GENERATE_AT)
+pelo mesmo caminho de RAG + LLM das mensagens e guardados no SQLite, com os
+gráficos já baixados. A entrega agendada e o /relatorio <nome> usam a última
+versão guardada, sem chamar o LLM.
+
+As assinaturas ficam no registro do usuário, em "report_subscriptions"
+(nome -> {"time": "HH:MM", "chat_id": id}), e a data da última entrega em
+"report_delivered" (nome -> AAAA-MM-DD).
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+REPORTS_GENERATE_AT = os.getenv("REPORTS_GENERATE_AT", "05:00")
+DEFAULT_DELIVERY_TIME = os.getenv("REPORTS_DEFAULT_TIME", "08:00")
+
+WEEKDAYS = ["segunda", "terça", "quarta", "quinta", "sexta", "sábado", "domingo"]
+
+# weekday: None para todos os dias ou 0-6 (segunda a domingo)
+REPORTS = {
+    "diario": {
+        "title": "Resumo diário",
+        "weekday": None,
+        "prompt": (
+            "Prepare um resumo executivo de ontem com base nos meus documentos e despesas: "
+            "total gasto, principais lançamentos, pendências e pontos de atenção, em no máximo 10 tópicos."
+        ),
+    },
+    "semanal": {
+        "title": "Resumo semanal",
+        "weekday": 0,
+        "prompt": (
+            "@agent Prepare um relatório executivo da última semana com base nos meus documentos e despesas: "
+            "total gasto por categoria, comparação com a semana anterior, destaques e riscos. "
+            "Crie um gráfico de barras com o total gasto por dia."
+        ),
+    },
+}
+
+
+def parse_time(text):
+    """Converte 'HH:MM' em 'HH:MM' normalizado ou retorna None se inválido."""
+    try:
+        return datetime.strptime(text.strip(), "%H:%M").strftime("%H:%M")
+    except (AttributeError, ValueError):
+        return None
+
+
+def is_report_day(name, now):
+    weekday = REPORTS[name]["weekday"]
+    return weekday is None or now.weekday() == weekday
+
+
+def schedule_label(name):
+    weekday = REPORTS[name]["weekday"]
+    if weekday is None:
+        return "todo dia"
+    return f"{'todo' if weekday >= 5 else 'toda'} {WEEKDAYS[weekday]}"
+
+
+def due_deliveries(record, now):
+    """Retorna [(nome, chat_id)] das assinaturas que já passaram do horário hoje e ainda não foram entregues."""
+    today = now.strftime("%Y-%m-%d")
+    current = now.strftime("%H:%M")
+    delivered = record.get("report_delivered", {})
+    return [
+        (name, subscription["chat_id"])
+        for name, subscription in record.get("report_subscriptions", {}).items()
+        if name in REPORTS and is_report_day(name, now)
+        and subscription["time"] <= current and delivered.get(name) != today
+    ]
+
+
+class ReportStore:
+    """Última versão gerada de cada relatório por usuário, em SQLite."""
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS reports ("
+                "user_id TEXT NOT NULL, name TEXT NOT NULL, generated_at REAL NOT NULL, body TEXT NOT NULL, "
+                "PRIMARY KEY (user_id, name))"
+            )
+
+    def save(self, user_id, name, reply):
+        generated_at = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reports (user_id, name, generated_at, body) VALUES (?, ?, ?, ?)",
+                (str(user_id), name, generated_at, json.dumps(reply, ensure_ascii=False))
+            )
+        logger.info(f"Relatório '{name}' do usuário {user_id} armazenado.")
+        return generated_at
+
+    def latest(self, user_id, name):
+        """Retorna (resposta, generated_at) ou None se o relatório ainda não foi gerado."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, generated_at FROM reports WHERE user_id = ? AND name = ?", (str(user_id), name)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
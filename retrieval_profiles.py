@@ -0,0 +1,40 @@
+"""Perfis de recuperação (quantidade de trechos, similaridade mínima e preferência de busca).
+
+Perguntas simples usam o perfil rápido; relatórios e análises, o profundo. O
+usuário pode fixar um perfil com /perfil ou deixar em "auto", e o perfil é
+escolhido a cada mensagem por palavras-chave e tamanho.
+"""
+import re
+
+PROFILES = {
+    "rapido": {"topN": 3, "similarityThreshold": 0.60, "searchPreference": "speed_optimized"},
+    "equilibrado": {"topN": 5, "similarityThreshold": 0.50, "searchPreference": "balanced"},
+    "profundo": {"topN": 10, "similarityThreshold": 0.35, "searchPreference": "accuracy_optimized"},
+}
+AUTO_PROFILE = "auto"
+DEFAULT_PROFILE = "equilibrado"
+
+DEEP_PATTERN = re.compile(
+    r"relat[óo]rio|an[áa]lis|compar|estrat[ée]gi|tend[êe]ncia|anual|trimestr|consolid|resum[oa] (?:geral|completo)|gr[áa]fico|@agent",
+    re.IGNORECASE
+)
+LOOKUP_PATTERN = re.compile(r"^\s*(?:qual|quais|quando|onde|quanto|quantos|quantas|quem|existe|tem)\b", re.IGNORECASE)
+SHORT_MESSAGE_CHARS = 80
+LONG_MESSAGE_CHARS = 300
+
+
+def classify_message(message):
+    """Escolhe o perfil pelo conteúdo da mensagem."""
+    if DEEP_PATTERN.search(message) or len(message) > LONG_MESSAGE_CHARS:
+        return "profundo"
+    if len(message) <= SHORT_MESSAGE_CHARS and LOOKUP_PATTERN.search(message):
+        return "rapido"
+    return DEFAULT_PROFILE
+
+
+def resolve_profile(record, message):
+    """Retorna o nome do perfil a usar: o fixado pelo usuário ou o classificado para a mensagem."""
+    chosen = record.get("retrieval_profile", AUTO_PROFILE)
+    if chosen in PROFILES:
+        return chosen
+    return classify_message(message)
@@ -0,0 +1,123 @@
+import logging
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 800
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def split_chunks(text, size=CHUNK_SIZE):
+    """Divide o texto em trechos de até size caracteres, quebrando em parágrafos ou linhas quando possível."""
+    chunks = []
+    current = ""
+    for block in re.split(r"\n\s*\n|\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        while len(block) > size:
+            cut = block.rfind(" ", 0, size)
+            cut = cut if cut > 0 else size
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(block[:cut])
+            block = block[cut:].strip()
+        if current and len(current) + len(block) + 1 > size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{block}" if current else block
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_match_query(query):
+    """Converte o texto do usuário em uma consulta FTS5 segura: todas as palavras, a última como prefixo."""
+    words = WORD_PATTERN.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*']
+    return " ".join(terms)
+
+
+class DocumentIndex:
+    """Índice de texto completo (SQLite FTS5) dos documentos enviados por cada usuário.
+
+    Atualizado a cada envio, remoção ou novo lançamento de despesa; as buscas
+    respondem localmente, sem passar pelo LLM. Como colunas UNINDEXED do FTS5
+    não têm índice, a tabela document_chunk_rows guarda os rowids dos trechos
+    de cada arquivo para que a remoção não percorra o índice inteiro.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS document_chunks USING fts5("
+                "chunk, file_name UNINDEXED, user_id UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS document_chunk_rows (chunk_rowid INTEGER PRIMARY KEY, file_name TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS document_chunk_rows_file ON document_chunk_rows (file_name)"
+            )
+            # Índices criados antes da tabela de rowids: preenche a partir dos trechos existentes
+            if self._conn.execute("SELECT 1 FROM document_chunk_rows LIMIT 1").fetchone() is None:
+                self._conn.execute(
+                    "INSERT INTO document_chunk_rows (chunk_rowid, file_name) SELECT rowid, file_name FROM document_chunks"
+                )
+
+    def _delete_file(self, file_name):
+        rowids = self._conn.execute(
+            "SELECT chunk_rowid FROM document_chunk_rows WHERE file_name = ?", (file_name,)
+        ).fetchall()
+        self._conn.executemany("DELETE FROM document_chunks WHERE rowid = ?", rowids)
+        self._conn.execute("DELETE FROM document_chunk_rows WHERE file_name = ?", (file_name,))
+
+    def index_document(self, user_id, file_name, text):
+        """Substitui o conteúdo indexado de file_name. Retorna o número de trechos."""
+        chunks = split_chunks(text)
+        with self._lock, self._conn:
+            self._delete_file(file_name)
+            for chunk in chunks:
+                cursor = self._conn.execute(
+                    "INSERT INTO document_chunks (chunk, file_name, user_id) VALUES (?, ?, ?)",
+                    (chunk, file_name, str(user_id))
+                )
+                self._conn.execute(
+                    "INSERT INTO document_chunk_rows (chunk_rowid, file_name) VALUES (?, ?)",
+                    (cursor.lastrowid, file_name)
+                )
+        logger.debug(f"{file_name} indexado com {len(chunks)} trechos.")
+        return len(chunks)
+
+    def remove_documents(self, file_names):
+        with self._lock, self._conn:
+            for file_name in file_names:
+                self._delete_file(file_name)
+
+    def search(self, user_id, query, limit=5):
+        """Retorna [(file_name, trecho destacado)] dos documentos do usuário, do mais para o menos relevante.
+
+        Apenas o melhor trecho de cada arquivo é retornado.
+        """
+        match_query = build_match_query(query)
+        if not match_query:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_name, snippet(document_chunks, 0, '*', '*', '…', 16) FROM document_chunks "
+                "WHERE document_chunks MATCH ? AND user_id = ? ORDER BY bm25(document_chunks) LIMIT ?",
+                (match_query, str(user_id), limit * 4)
+            ).fetchall()
+        best = {}
+        for file_name, snippet in rows:
+            best.setdefault(file_name, snippet)
+        return list(best.items())[:limit]
@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+logger = logging.getLogger(__name__)
+
+
+class SharedMap(MutableMapping):
+    """Mapeamento chave -> valor JSON persistido em SQLite e compartilhado entre processos.
+
+    Valores simples (ex.: docpaths do FILE_MAP) são gravados e lidos direto no banco.
+    Valores mutáveis (dicts/listas) ficam em cache no processo
+    após a leitura, para que alterações aninhadas sejam persistidas com flush().
+    Cada usuário é atendido por um único processo, então o cache não disputa escrita.
+    """
+
+    def __init__(self, db_path, table, seed_file=None):
+        self.db_path = db_path
+        self.table = table
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if seed_file:
+            self._seed_from_json(seed_file)
+
+    def _seed_from_json(self, seed_file):
+        """Importa o JSON legado (user_map.json/file_map.json) na primeira execução."""
+        if not os.path.exists(seed_file) or len(self):
+            return
+        with open(seed_file, "r") as f:
+            data = json.load(f)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO {self.table} (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in data.items()]
+            )
+        logger.info(f"{len(data)} registros importados de {seed_file} para {self.db_path}:{self.table}")
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            return self._cache[key]
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = json.loads(row[0])
+        if isinstance(value, (dict, list)):
+            self._cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if isinstance(value, (dict, list)):
+            self._cache[key] = value
+        else:
+            self._cache.pop(key, None)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def __delitem__(self, key):
+        self._cache.pop(key, None)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._cache:
+            return True
+        with self._lock:
+            return self._conn.execute(f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self):
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute(f"SELECT key FROM {self.table}")]
+        return iter(keys)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def flush(self):
+        """Grava no banco os valores mutáveis alterados em memória."""
+        if not self._cache:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in self._cache.items()]
+            )
+
+    def close(self):
+        self.flush()
+        self._conn.close()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Os módulos do bot ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# O bot.py exige estas variáveis na importação; os testes não fazem requisições
+os.environ.setdefault("TELEGRAM_TOKEN", "000000:test")
+os.environ.setdefault("ANYTHINGLLM_API", "http://127.0.0.1:9/api")
+os.environ.setdefault("ANYTHINGLLM_API_KEY", "test")
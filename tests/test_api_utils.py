@@ -0,0 +1,179 @@
+import asyncio
+
+import pytest
+import requests
+
+import api_utils
+from api_utils import CircuitBreaker, CircuitOpenError, DeadlineExceeded, api_request, deadline
+
+
+def make_response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
+class FakeServer:
+    """Substitui requests.request: devolve (ou levanta) os resultados na ordem dada."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def __call__(self, method, url, **kwargs):
+        self.calls.append((method, kwargs["timeout"]))
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return make_response(outcome)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker("chat", failure_threshold=3, recovery_timeout=30)
+    monkeypatch.setitem(api_utils.BREAKERS, "chat", breaker)
+    return breaker
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(api_utils.time, "sleep", delays.append)
+    return delays
+
+
+def serve(monkeypatch, *outcomes):
+    server = FakeServer(*outcomes)
+    monkeypatch.setattr(api_utils.requests, "request", server)
+    return server
+
+
+def half_open(breaker):
+    breaker.opened_at -= breaker.recovery_timeout + 1
+
+
+def test_circuito_abre_apos_falhas_seguidas(monkeypatch, breaker):
+    server = serve(monkeypatch, requests.exceptions.ConnectionError("recusada"))
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            api_request("POST", "/v1/chat", "chat", timeout=5)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        api_request("POST", "/v1/chat", "chat", timeout=5)
+    assert len(server.calls) == 3
+
+
+def test_respostas_4xx_nao_contam_como_falha(monkeypatch, breaker):
+    serve(monkeypatch, 500, 500, 404)
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.HTTPError):
+            api_request("POST", "/v1/chat", "chat", timeout=5)
+    assert breaker.failures == 2
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        api_request("POST", "/v1/chat", "chat", timeout=5)
+    assert (breaker.state, breaker.failures) == (CircuitBreaker.CLOSED, 0)
+
+
+def test_meio_aberto_deixa_passar_uma_unica_requisicao(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    assert not breaker.allow_request()
+
+    half_open(breaker)
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_falha_no_meio_aberto_reabre(monkeypatch, breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    half_open(breaker)
+    serve(monkeypatch, requests.exceptions.ChunkedEncodingError("truncada"))
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        api_request("POST", "/v1/chat", "chat", timeout=5)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_erro_fora_da_rede_libera_a_requisicao_de_teste(monkeypatch, breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    half_open(breaker)
+    serve(monkeypatch, TypeError("argumento inválido"))
+
+    with pytest.raises(TypeError):
+        api_request("POST", "/v1/chat", "chat", timeout=5)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_read_timeout_aceito_nao_altera_o_circuito(monkeypatch, breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    half_open(breaker)
+    serve(monkeypatch, requests.exceptions.ReadTimeout("processando"))
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        api_request("POST", "/v1/embed", "chat", timeout=5, read_timeout_ok=True)
+    assert (breaker.state, breaker.failures) == (CircuitBreaker.HALF_OPEN, 3)
+    assert breaker.allow_request()
+
+
+def test_post_nao_e_repetido(monkeypatch, breaker, sleeps):
+    server = serve(monkeypatch, requests.exceptions.ConnectionError("recusada"))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        api_request("POST", "/v1/chat", "chat", timeout=5)
+    assert len(server.calls) == 1
+    assert sleeps == []
+
+
+def test_get_repetido_com_backoff(monkeypatch, breaker, sleeps):
+    monkeypatch.setattr(api_utils, "RETRY_ATTEMPTS", 3)
+    server = serve(monkeypatch, requests.exceptions.ConnectionError("recusada"), 503, 200)
+    assert api_request("GET", "/v1/workspaces", "chat", timeout=5).status_code == 200
+    assert len(server.calls) == 3
+    assert len(sleeps) == 2
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_prazo_encurta_backoff_e_timeout(monkeypatch, breaker, sleeps):
+    monkeypatch.setattr(api_utils, "RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(api_utils, "RETRY_BASE_DELAY", 100)
+    monkeypatch.setattr(api_utils, "RETRY_MAX_DELAY", 100)
+    monkeypatch.setattr(api_utils.random, "uniform", lambda low, high: high)
+    server = serve(monkeypatch, requests.exceptions.ConnectionError("recusada"))
+
+    with deadline(2):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            api_request("GET", "/v1/workspaces", "chat", timeout=60)
+    assert len(sleeps) == 2
+    assert all(delay <= 2 for delay in sleeps)
+    assert all(timeout <= 2 for _, timeout in server.calls)
+
+
+def test_prazo_esgotado_nao_chama_a_rede(monkeypatch, breaker):
+    server = serve(monkeypatch, 200)
+    with deadline(0):
+        with pytest.raises(DeadlineExceeded):
+            api_request("GET", "/v1/workspaces", "chat", timeout=5)
+    assert server.calls == []
+
+
+def test_no_event_loop_nao_espera_o_backoff(monkeypatch, breaker, sleeps):
+    server = serve(monkeypatch, requests.exceptions.ConnectionError("recusada"))
+
+    async def call():
+        api_request("GET", "/v1/workspaces", "chat", timeout=5)
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        asyncio.run(call())
+    assert len(server.calls) == 1
+    assert sleeps == []
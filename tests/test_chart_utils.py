@@ -0,0 +1,54 @@
+import json
+import urllib.parse
+
+import pytest
+
+from chart_utils import build_chart_url, normalize_chart_config, parse_chart_config, replace_special_chars
+
+CONFIG = {"type": "bar", "data": {"labels": ["Jan", "Fev"], "datasets": [{"label": "Gastos", "data": [1, 2]}]}}
+
+
+def test_parse_json_estrito_e_url_encoded():
+    text = json.dumps(CONFIG)
+    assert parse_chart_config(text) == CONFIG
+    assert parse_chart_config(urllib.parse.quote(text)) == CONFIG
+
+
+def test_parse_json_estilo_javascript():
+    text = "{type: 'bar', data: {labels: ['Jan', 'Fev'], datasets: [{label: 'Gastos', data: [1, 2],}]}}"
+    assert parse_chart_config(text) == CONFIG
+
+
+def test_parse_aspas_simples_com_aspas_duplas_internas():
+    config = parse_chart_config("{'type': 'bar', 'data': {'labels': ['O \"melhor\" mês', 'D\\'água'], 'datasets': []}}")
+    assert config["data"]["labels"] == ['O "melhor" mês', "D'água"]
+
+
+def test_parse_ignora_parametros_extras_da_url():
+    assert parse_chart_config(json.dumps(CONFIG) + "&format=png") == CONFIG
+
+
+def test_parse_invalido_levanta_valueerror():
+    with pytest.raises(ValueError):
+        parse_chart_config("{type: bar, data: [")
+
+
+def test_normalize_valida_e_substitui_caracteres():
+    config = json.loads(json.dumps(CONFIG))
+    config["data"]["labels"] = ["R$ 10 & 5%"]
+    normalized = normalize_chart_config(json.dumps(config))
+    assert normalized["data"]["labels"] == ["Real 10 and 5pct"]
+
+    with pytest.raises(ValueError):
+        normalize_chart_config(json.dumps({"type": "pizza", "data": {"datasets": [{"data": []}]}}))
+
+
+def test_replace_special_chars_prioriza_sequencias_longas():
+    assert replace_special_chars("R$ 5 US$ 3 %20 10% € £ &") == "Real 5 USUSD 3   10pct EUR GBP and"
+
+
+def test_url_final_volta_a_mesma_configuracao():
+    url = build_chart_url(normalize_chart_config(json.dumps(CONFIG)))
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    assert query["format"] == ["png"]
+    assert json.loads(query["c"][0]) == CONFIG
@@ -0,0 +1,50 @@
+import context_budget
+from context_budget import apply_summary, build_message, estimate_tokens, record_turn, session_context
+
+
+def test_contexto_criado_por_sessao():
+    record = {}
+    context = session_context(record, "s1")
+    context["tokens"] = 10
+    assert session_context(record, "s1") is context
+    assert session_context(record, "s2") == {"tokens": 0}
+
+
+def test_record_turn_usa_completion_tokens():
+    context = {"tokens": 0}
+    data = {"textResponse": "x" * 4000, "metrics": {"prompt_tokens": 5000, "completion_tokens": 30}}
+    record_turn(context, "x" * 400, data)
+    # prompt_tokens (sistema + trechos recuperados) fica de fora
+    assert context["tokens"] == estimate_tokens("x" * 400) + 30
+
+
+def test_record_turn_estima_a_resposta_sem_metricas():
+    context = {"tokens": 0}
+    record_turn(context, "x" * 400, {"textResponse": "y" * 800})
+    record_turn(context, "x" * 400, {"textResponse": "y" * 800, "metrics": {}})
+    assert context["tokens"] == 2 * (estimate_tokens("x" * 400) + estimate_tokens("y" * 800))
+
+
+def test_record_turn_sinaliza_compactacao_acima_do_orcamento(monkeypatch):
+    monkeypatch.setattr(context_budget, "CONTEXT_TOKEN_BUDGET", 100)
+    context = {"tokens": 0}
+    assert not record_turn(context, "x" * 200, {"metrics": {"completion_tokens": 40}})
+    assert record_turn(context, "x" * 200, {"metrics": {"completion_tokens": 40}})
+
+
+def test_resumo_e_instrucoes_enviados_uma_vez():
+    context = {"tokens": 0}
+    apply_summary(context, "tópicos")
+    first = build_message(context, "pergunta", instructions="INSTRUÇÕES", reminder="LEMBRETE")
+    assert first == "Resumo da conversa anterior:\ntópicos\n\npergunta\n\nINSTRUÇÕES"
+
+    record_turn(context, first, {"metrics": {"completion_tokens": 1}}, instructions_sent=True)
+    assert build_message(context, "outra", instructions="INSTRUÇÕES", reminder="LEMBRETE") == "outra\n\nLEMBRETE"
+
+
+def test_apply_summary_reinicia_a_contagem():
+    context = {"tokens": 9000, "instructions_sent": True}
+    apply_summary(context, "r" * 5000)
+    assert len(context["summary"]) == context_budget.SUMMARY_MAX_CHARS
+    assert context["tokens"] == estimate_tokens(context["summary"])
+    assert (context["instructions_sent"], context["compactions"]) == (False, 1)
@@ -0,0 +1,98 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import delivery
+from delivery import FileIdCache, compose_text, deliver_reply, split_text
+
+
+def test_compose_text_ignora_partes_vazias():
+    assert compose_text("Resposta ", "", None, "  \n", "\nFontes:\n- a.pdf") == "Resposta\n\nFontes:\n- a.pdf"
+    assert compose_text("", None) == ""
+
+
+def test_split_text_prefere_quebras_de_linha():
+    text = "linha um\nlinha dois\nlinha três"
+    assert split_text(text, limit=20) == ["linha um\nlinha dois", "linha três"]
+    assert "".join(split_text("x" * 25, limit=10)) == "x" * 25
+    assert [len(chunk) for chunk in split_text("x" * 25, limit=10)] == [10, 10, 5]
+    assert split_text("") == []
+
+
+def test_split_text_nao_gera_pedacos_vazios():
+    chunks = split_text("a" * 10 + "\n\n\n" + "b" * 10, limit=10)
+    assert chunks == ["a" * 10, "b" * 10]
+
+
+def test_file_id_cache_descarta_o_menos_usado():
+    cache = FileIdCache(max_size=2)
+    cache.put("a", "id-a")
+    cache.put("b", "id-b")
+    assert cache.get("a") == "id-a"
+    cache.put("c", "id-c")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("id-a", "id-c")
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.deleted = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append(text)
+        return SimpleNamespace(message_id=len(self.sent))
+
+    async def send_photo(self, chat_id, photo, caption=None):
+        self.sent.append(("foto", photo, caption))
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"file-{len(self.sent)}")])
+
+    async def delete_message(self, chat_id, message_id):
+        self.deleted.append(message_id)
+
+
+@pytest.fixture(autouse=True)
+def file_ids(monkeypatch):
+    cache = FileIdCache(max_size=10)
+    monkeypatch.setattr(delivery, "FILE_ID_CACHE", cache)
+    return cache
+
+
+def test_grafico_em_cache_nao_e_renderizado(file_ids):
+    file_ids.put("url-1", "id-1")
+    bot = FakeBot()
+
+    async def render(key):
+        raise AssertionError("não deveria renderizar")
+
+    asyncio.run(deliver_reply(bot, 1, "Resposta", charts=["url-1"], render=render))
+    assert bot.sent == [("foto", "id-1", "Resposta")]
+
+
+def test_placeholder_removido_apos_renderizacao_lenta(tmp_path, file_ids):
+    path = tmp_path / "grafico.png"
+    path.write_bytes(b"png")
+    bot = FakeBot()
+
+    async def render(key):
+        await asyncio.sleep(0.05)
+        return str(path)
+
+    asyncio.run(deliver_reply(bot, 1, "Resposta", charts=["url-1"], render=render, placeholder_delay=0.01))
+    assert bot.sent[0] == "Baixando gráfico..."
+    assert bot.deleted == [1]
+    assert file_ids.get("url-1") == "file-2"
+
+
+def test_placeholder_removido_quando_a_renderizacao_falha():
+    bot = FakeBot()
+
+    async def render(key):
+        await asyncio.sleep(0.05)
+        raise RuntimeError("QuickChart fora do ar")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(deliver_reply(bot, 1, "Resposta", charts=["url-1"], render=render, placeholder_delay=0.01))
+    assert bot.sent == ["Baixando gráfico..."]
+    assert bot.deleted == [1]
@@ -0,0 +1,106 @@
+import pytest
+
+import api_utils
+from api_utils import invalidate_document_cache, list_all_custom_documents, list_workspace_documents
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeListings:
+    """Substitui api_request: conta as listagens feitas e permite simular uma escrita durante a busca."""
+
+    def __init__(self):
+        self.calls = []
+        self.during_request = None
+
+    def __call__(self, method, path, group, timeout, **kwargs):
+        self.calls.append(path)
+        if self.during_request:
+            self.during_request()
+        if path == "/v1/documents":
+            return FakeResponse({"documents": {f"custom-documents/doc-{len(self.calls)}.json": {}}})
+        return FakeResponse({"documents": [{"docpath": f"custom-documents/doc-{len(self.calls)}.json"}]})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(api_utils.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def listings(monkeypatch, clock):
+    monkeypatch.setattr(api_utils, "_document_cache", {})
+    monkeypatch.setattr(api_utils, "DOCUMENT_CACHE_TTL", 30)
+    fake = FakeListings()
+    monkeypatch.setattr(api_utils, "api_request", fake)
+    return fake
+
+
+def test_listagem_reaproveitada_ate_o_ttl(listings, clock):
+    first = list_workspace_documents("ws")
+    assert list_workspace_documents("ws") == first
+    assert len(listings.calls) == 1
+
+    clock[0] += 31
+    assert list_workspace_documents("ws") != first
+    assert len(listings.calls) == 2
+
+
+def test_copia_devolvida_nao_altera_o_cache(listings):
+    list_workspace_documents("ws").clear()
+    assert list_workspace_documents("ws") != []
+
+
+def test_use_cache_false_sempre_consulta(listings):
+    list_workspace_documents("ws")
+    list_workspace_documents("ws", use_cache=False)
+    assert len(listings.calls) == 2
+
+
+def test_invalidacao_por_workspace(listings):
+    list_workspace_documents("a")
+    list_workspace_documents("b")
+    list_all_custom_documents()
+
+    invalidate_document_cache("a")
+    list_workspace_documents("a")
+    list_workspace_documents("b")
+    list_all_custom_documents()
+    assert listings.calls.count("/v1/workspace/a/documents") == 2
+    assert listings.calls.count("/v1/workspace/b/documents") == 1
+    assert listings.calls.count("/v1/documents") == 1
+
+
+def test_invalidacao_global_e_de_todos(listings):
+    list_workspace_documents("a")
+    list_all_custom_documents()
+
+    invalidate_document_cache()
+    list_all_custom_documents()
+    list_workspace_documents("a")
+    assert listings.calls.count("/v1/documents") == 2
+    assert listings.calls.count("/v1/workspace/a/documents") == 1
+
+    invalidate_document_cache(all_workspaces=True)
+    list_all_custom_documents()
+    list_workspace_documents("a")
+    assert listings.calls.count("/v1/documents") == 3
+    assert listings.calls.count("/v1/workspace/a/documents") == 2
+
+
+def test_escrita_durante_a_busca_nao_grava_listagem_antiga(listings):
+    listings.during_request = lambda: invalidate_document_cache("ws")
+    list_workspace_documents("ws")
+
+    listings.during_request = None
+    list_workspace_documents("ws")
+    list_workspace_documents("ws")
+    assert len(listings.calls) == 2
@@ -0,0 +1,143 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import api_utils
+import bot
+from journal import JobJournal
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+class FakeMessage:
+    def __init__(self, user_id):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.replies = []
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+
+
+def embedding_job(locations, label="a.pdf", submitted_at=None):
+    payload = {
+        "chat_id": 1,
+        "workspace_slug": "ws",
+        "locations": locations,
+        "label": label,
+        "submitted_at": time.time() if submitted_at is None else submitted_at
+    }
+    return {"id": 1, "kind": "embedding", "user_id": "7", "payload": payload}
+
+
+def test_missing_embeddings_compara_com_os_documentos_do_workspace(monkeypatch):
+    calls = []
+
+    def list_documents(workspace_slug, strict=False, use_cache=True):
+        calls.append((workspace_slug, strict, use_cache))
+        return [{"docpath": "custom-documents/a.json"}, {"title": "sem docpath"}]
+
+    monkeypatch.setattr(api_utils, "list_workspace_documents", list_documents)
+    missing = api_utils.missing_embeddings("ws", ["custom-documents/a.json", "custom-documents/b.json"])
+    assert missing == ["custom-documents/b.json"]
+    # O acompanhamento não pode usar a listagem em cache
+    assert calls == [("ws", True, False)]
+
+
+def test_missing_embeddings_retorna_none_se_a_consulta_falhar(monkeypatch):
+    def list_documents(workspace_slug, strict=False, use_cache=True):
+        raise requests.exceptions.ConnectionError("fora do ar")
+
+    monkeypatch.setattr(api_utils, "list_workspace_documents", list_documents)
+    assert api_utils.missing_embeddings("ws", ["custom-documents/a.json"]) is None
+
+
+@pytest.mark.parametrize("error, expected", [
+    (None, "done"),
+    (requests.exceptions.ReadTimeout("lento"), "pending"),
+    (requests.exceptions.ConnectionError("fora do ar"), None),
+])
+def test_submit_workspace_embeddings(monkeypatch, error, expected):
+    requests_made = []
+
+    def api_request(method, path, breaker, **kwargs):
+        requests_made.append((path, kwargs["timeout"], kwargs["read_timeout_ok"]))
+        if error:
+            raise error
+        return SimpleNamespace(json=lambda: {"workspace": {"slug": "ws"}})
+
+    monkeypatch.setattr(api_utils, "api_request", api_request)
+    assert asyncio.run(api_utils.submit_workspace_embeddings("ws", ["custom-documents/a.json"])) == expected
+    assert requests_made == [("/v1/workspace/ws/update-embeddings", api_utils.EMBED_SUBMIT_TIMEOUT, True)]
+
+
+def test_embedding_job_consulta_com_backoff_ate_o_documento_aparecer(monkeypatch):
+    results = iter([None, ["custom-documents/a.json"], ["custom-documents/a.json"], []])
+    monkeypatch.setattr(bot, "missing_embeddings", lambda workspace_slug, locations: next(results))
+    delays = []
+
+    async def sleep(seconds):
+        delays.append(seconds)
+
+    monkeypatch.setattr(bot.asyncio, "sleep", sleep)
+    monkeypatch.setattr(bot, "EMBED_POLL_INITIAL", 2)
+    monkeypatch.setattr(bot, "EMBED_POLL_MAX", 5)
+    fake_bot = FakeBot()
+
+    assert asyncio.run(bot.run_embedding_job(fake_bot, embedding_job(["custom-documents/a.json"]))) is True
+    assert delays == [2, 4, 5]
+    assert fake_bot.sent == [(1, "Arquivo pronto para consultas: a.pdf")]
+
+
+def test_embedding_job_desiste_depois_do_timeout(monkeypatch):
+    monkeypatch.setattr(bot, "missing_embeddings", lambda workspace_slug, locations: list(locations))
+    job = embedding_job(["a", "b"], label="sincronização", submitted_at=time.time() - bot.EMBED_POLL_TIMEOUT - 1)
+    fake_bot = FakeBot()
+
+    assert asyncio.run(bot.run_embedding_job(fake_bot, job)) is True
+    assert fake_bot.sent == [(1, "O embedding de sincronização não terminou a tempo. Tente /sync mais tarde.")]
+
+
+def test_embedding_ready_text_para_varios_documentos():
+    job = embedding_job(["a", "b", "c"], label="sincronização")
+    assert bot.embedding_ready_text(job["payload"]) == "3 documentos prontos para consultas (sincronização)."
+
+
+def test_format_elapsed():
+    assert bot.format_elapsed(42) == "42s"
+    assert bot.format_elapsed(600) == "10 min"
+    assert bot.format_elapsed(5400) == "1.5 h"
+
+
+def test_status_lista_os_jobs_pendentes_do_usuario(monkeypatch, tmp_path):
+    journal = JobJournal(str(tmp_path / "estado.db"))
+    monkeypatch.setattr(bot, "JOURNAL", journal)
+    journal.enqueue("embedding", 7, embedding_job(["a", "b"], label="sincronização", submitted_at=time.time() - 90)["payload"])
+    journal.enqueue("file", 7, {"file_name": "relatorio.pdf"})
+    # Arquivo já enviado: quem aparece é o job "embedding" correspondente
+    journal.enqueue("file", 7, {"file_name": "enviado.pdf", "embedding": "pending"})
+    journal.enqueue("file", 8, {"file_name": "de-outro-usuario.pdf"})
+    message = FakeMessage(7)
+
+    asyncio.run(bot.status_command(SimpleNamespace(message=message), None))
+    [reply] = message.replies
+    lines = reply.splitlines()
+    assert lines[0] == "Em andamento:"
+    assert lines[1] == "- sincronização (2 documentos): embedding há 2 min"
+    assert lines[2].startswith("- relatorio.pdf: processando há ")
+    assert len(lines) == 3
+
+
+def test_status_sem_pendencias(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "JOURNAL", JobJournal(str(tmp_path / "estado.db")))
+    message = FakeMessage(7)
+    asyncio.run(bot.status_command(SimpleNamespace(message=message), None))
+    assert message.replies == ["Nenhum arquivo pendente. Todos os documentos estão prontos para consultas."]
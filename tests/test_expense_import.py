@@ -0,0 +1,37 @@
+import pytest
+
+from expense_import import merge_expenses, parse_amount
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("1.234,56", 1234.56),
+    ("-45,90", -45.90),
+    ("R$ 45.90", 45.90),
+    ("1,234.56", 1234.56),
+    ("(12,00)", -12.0),
+    (7, 7.0),
+])
+def test_parse_amount(raw, expected):
+    assert parse_amount(raw) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("raw", ["", "-", "abc", None])
+def test_parse_amount_invalido(raw):
+    assert parse_amount(raw) is None
+
+
+def expense(date, value, description):
+    return {"date": date, "value": value, "description": description}
+
+
+def test_merge_ignora_lancamentos_ja_registrados():
+    existing = [dict(expense("2025-04-01", 10.0, "Uber"), timestamp=1)]
+    imported = [expense("2025-04-01", 10.0, " uber "), expense("2025-04-02", 5.0, "Café")]
+    assert merge_expenses(existing, imported) == [expense("2025-04-02", 5.0, "Café")]
+
+
+def test_merge_conta_ocorrencias_repetidas():
+    twice = [expense("2025-04-03", 25.9, "Uber"), expense("2025-04-03", 25.9, "Uber")]
+    assert merge_expenses([], twice) == twice
+    assert merge_expenses(twice[:1], twice) == twice[1:]
+    assert merge_expenses(twice, twice) == []
@@ -0,0 +1,37 @@
+import random
+
+from expense_render import document_extension, render_ledger
+
+EXPENSES = [
+    {"date": "2025-04-10", "value": 20.0, "description": "almoço", "timestamp": 3},
+    {"date": "2025-04-02", "value": 120.0, "description": "material de escritório", "timestamp": 1},
+    {"date": "2025-05-01", "value": 35.5, "description": "Uber", "timestamp": 2},
+    {"date": "2025-04-02", "value": 8.0, "description": "café", "timestamp": 4},
+]
+
+
+def test_um_documento_por_mes():
+    documents = render_ledger(EXPENSES, "text")
+    assert list(documents) == ["2025-04", "2025-05"]
+    assert "Total do mês: R$ 148.00 em 3 lançamentos" in documents["2025-04"]
+    assert "Total do mês: R$ 35.50 em 1 lançamento" in documents["2025-05"]
+
+
+def test_saida_deterministica_para_ordem_e_timestamp():
+    shuffled = [dict(expense, timestamp=999) for expense in EXPENSES]
+    random.Random(7).shuffle(shuffled)
+    for doc_format in ("text", "csv"):
+        assert render_ledger(shuffled, doc_format) == render_ledger(EXPENSES, doc_format)
+
+
+def test_mes_sem_mudanca_gera_os_mesmos_bytes():
+    before = render_ledger(EXPENSES, "text")
+    after = render_ledger(EXPENSES + [{"date": "2025-05-20", "value": 10.0, "description": "padaria"}], "text")
+    assert after["2025-04"] == before["2025-04"]
+    assert after["2025-05"] != before["2025-05"]
+
+
+def test_extensao_por_formato():
+    assert document_extension("text") == ".txt"
+    assert document_extension("csv") == ".csv"
+    assert document_extension("desconhecido") == ".txt"
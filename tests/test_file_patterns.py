@@ -0,0 +1,44 @@
+import pytest
+
+import bot
+
+FILES = {
+    "Ochozn/relatorio.docx": "custom-documents/a.json",
+    "Ochozn/planilha.xlsx": "custom-documents/b.json",
+    "Ochozn/notas/ata.docx": "custom-documents/c.json",
+    "maria/relatorio.docx": "custom-documents/d.json",
+    "maria/[rascunho].txt": "custom-documents/e.json",
+}
+
+
+@pytest.fixture(autouse=True)
+def state(monkeypatch):
+    monkeypatch.setattr(bot, "FILE_MAP", dict(FILES))
+    monkeypatch.setattr(bot, "USER_WORKSPACE_MAP", {"1": {"username": "Ochozn"}, "2": {"username": "maria"}})
+    monkeypatch.setattr(bot, "ADMIN_USER_IDS", {"9"})
+
+
+def test_nome_exato():
+    assert bot.resolve_file_names("maria/[rascunho].txt") == ["maria/[rascunho].txt"]
+    assert bot.resolve_file_names("Ochozn/inexistente.pdf") == []
+
+
+def test_glob_e_prefixo():
+    assert bot.resolve_file_names("*/relatorio.docx") == ["Ochozn/relatorio.docx", "maria/relatorio.docx"]
+    assert bot.resolve_file_names("Ochozn/*.docx") == ["Ochozn/notas/ata.docx", "Ochozn/relatorio.docx"]
+    assert bot.resolve_file_names("Ochozn/notas/") == ["Ochozn/notas/ata.docx"]
+    # Sem curinga nem barra final, um prefixo não casa com nada
+    assert bot.resolve_file_names("Ochozn") == []
+
+
+def test_escopo_restringe_aos_arquivos_do_usuario():
+    scope = bot.file_scope("1")
+    assert scope == "Ochozn/"
+    assert bot.resolve_file_names("*", scope) == ["Ochozn/notas/ata.docx", "Ochozn/planilha.xlsx", "Ochozn/relatorio.docx"]
+    assert bot.resolve_file_names("maria/relatorio.docx", scope) == []
+    assert bot.resolve_file_names("maria/", scope) == []
+
+
+def test_administrador_sem_escopo():
+    assert bot.file_scope("9") is None
+    assert len(bot.resolve_file_names("*", bot.file_scope("9"))) == len(FILES)
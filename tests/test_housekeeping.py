@@ -0,0 +1,73 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import housekeeping
+from housekeeping import collect_garbage, scan_local_dir
+from state_store import SharedMap
+
+
+def write_file(path, size, age_days):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    mtime = time.time() - age_days * 86400
+    os.utime(path, (mtime, mtime))
+    return os.path.abspath(path)
+
+
+def test_retencao_por_idade_e_tamanho(tmp_path):
+    old = write_file(tmp_path / "antigo.pdf", 10, age_days=40)
+    middle = write_file(tmp_path / "medio.pdf", 10, age_days=5)
+    protected = write_file(tmp_path / "pendente.pdf", 10, age_days=50)
+    write_file(tmp_path / "novo.pdf", 10, age_days=1)
+
+    expired = scan_local_dir(str(tmp_path), max_age_days=30, max_bytes=25, protected=[protected])
+    # O antigo sai pela idade; o médio, do mais antigo ao mais novo, pelo limite de tamanho
+    assert expired == [(old, 10), (middle, 10)]
+
+
+@pytest.fixture
+def orphans(monkeypatch):
+    found = []
+    monkeypatch.setattr(housekeeping, "find_orphan_documents", lambda file_map_docpaths: list(found))
+    return found
+
+
+def run_collection(candidates, dry_run, deleted):
+    async def delete_document(docpath):
+        deleted.append(docpath)
+        return True
+
+    return asyncio.run(collect_garbage(
+        [], [], delete_document, candidates, dry_run=dry_run, orphan_grace=3600, delete_rate=0
+    ))
+
+
+def test_carencia_sobrevive_a_reinicio(tmp_path, orphans):
+    db = str(tmp_path / "estado.db")
+    orphans.append("custom-documents/velho.json")
+    deleted = []
+
+    report = run_collection(SharedMap(db, "orphan_candidates"), dry_run=False, deleted=deleted)
+    assert report["pending_orphans"] == ["custom-documents/velho.json"]
+    assert deleted == []
+
+    # Após o "reinício", a marcação anterior continua valendo
+    candidates = SharedMap(db, "orphan_candidates")
+    candidates["custom-documents/velho.json"] -= 7200
+    report = run_collection(SharedMap(db, "orphan_candidates"), dry_run=False, deleted=deleted)
+    assert report["deleted"] == deleted == ["custom-documents/velho.json"]
+    assert "custom-documents/velho.json" not in SharedMap(db, "orphan_candidates")
+
+
+def test_simulacao_nao_deleta_e_marcacao_some_quando_documento_volta_a_ser_usado(orphans):
+    candidates = {"custom-documents/a.json": time.time() - 7200, "custom-documents/b.json": time.time() - 7200}
+    orphans.append("custom-documents/a.json")
+    deleted = []
+
+    report = run_collection(candidates, dry_run=True, deleted=deleted)
+    assert report["orphans"] == ["custom-documents/a.json"]
+    assert deleted == []
+    assert list(candidates) == ["custom-documents/a.json"]
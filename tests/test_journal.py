@@ -0,0 +1,43 @@
+from journal import MAX_ATTEMPTS, JobJournal
+
+
+def test_job_confirmado_sai_do_journal(tmp_path):
+    journal = JobJournal(str(tmp_path / "estado.db"))
+    job = journal.enqueue("file", 1, {"file_name": "a.pdf"})
+    assert job["attempts"] == 1
+
+    journal.ack(job["id"])
+    assert journal.pending() == []
+
+
+def test_pending_conta_tentativas_e_mantem_progresso(tmp_path):
+    journal = JobJournal(str(tmp_path / "estado.db"))
+    job = journal.enqueue("file", 1, {"file_name": "a.pdf"})
+    journal.update(job["id"], {"file_name": "a.pdf", "location": "custom-documents/a.json"})
+
+    [replayed] = journal.pending()
+    assert replayed["attempts"] == 2
+    assert replayed["payload"]["location"] == "custom-documents/a.json"
+
+
+def test_job_descartado_apos_max_attempts(tmp_path):
+    journal = JobJournal(str(tmp_path / "estado.db"))
+    journal.enqueue("file", 1, {})
+    for attempt in range(2, MAX_ATTEMPTS + 1):
+        [job] = journal.pending()
+        assert job["attempts"] == attempt
+    assert journal.pending() == []
+    assert journal.list() == []
+
+
+def test_pending_filtra_usuarios_e_jobs_em_execucao(tmp_path):
+    journal = JobJournal(str(tmp_path / "estado.db"))
+    running = journal.enqueue("file", 1, {})
+    journal.enqueue("file", 2, {})
+    other = journal.enqueue("expense", 3, {})
+
+    jobs = journal.pending(user_filter=lambda user_id: user_id != "2", skip_ids={running["id"]})
+    assert [job["id"] for job in jobs] == [other["id"]]
+    # O job pulado não teve a tentativa contada
+    assert journal.list(user_id=1)[0]["id"] == running["id"]
+    assert [job["kind"] for job in journal.list(kind="expense")] == ["expense"]
@@ -0,0 +1,39 @@
+import asyncio
+
+import bot
+
+
+def make_job(job_id, user_id):
+    return {"id": job_id, "user_id": str(user_id), "payload": {"username": "Ochozn", "chat_id": 1}}
+
+
+def test_publicacoes_do_mesmo_usuario_sao_serializadas(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "EXPENSES_DIR", str(tmp_path))
+    events = []
+    ledger = {"expenses": []}
+    monkeypatch.setattr(bot, "load_expenses", lambda local_path: list(ledger["expenses"]))
+
+    async def publish(bot_, job, expenses):
+        events.append(("início", job["id"], len(expenses)))
+        await asyncio.sleep(0.01)
+        events.append(("fim", job["id"]))
+        return True
+
+    monkeypatch.setattr(bot, "_publish_expense_ledger", publish)
+
+    async def main():
+        first = asyncio.create_task(bot.publish_expense_ledger(None, make_job(1, 7)))
+        await asyncio.sleep(0)
+        # Lançamento gravado enquanto a primeira publicação está em andamento
+        ledger["expenses"].append({"date": "2025-04-01", "value": 1.0, "description": "café"})
+        second = asyncio.create_task(bot.publish_expense_ledger(None, make_job(2, 7)))
+        other_user = asyncio.create_task(bot.publish_expense_ledger(None, make_job(3, 8)))
+        return await asyncio.gather(first, second, other_user)
+
+    assert asyncio.run(main()) == [True, True, True]
+    user_events = [event for event in events if event[1] != 3]
+    # A segunda publicação só começa depois da primeira e lê o arquivo já atualizado
+    assert user_events == [("início", 1, 0), ("fim", 1), ("início", 2, 1), ("fim", 2)]
+    # Outro usuário não espera
+    assert events.index(("início", 3, 1)) < events.index(("fim", 1))
+    assert len(bot.LEDGER_LOCKS) == 0
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from reports import ReportStore, due_deliveries, is_report_day, parse_time, schedule_label
+
+# 2025-04-07 é uma segunda-feira
+MONDAY_9H = datetime(2025, 4, 7, 9, 0)
+TUESDAY_9H = datetime(2025, 4, 8, 9, 0)
+
+
+def test_parse_time():
+    assert parse_time(" 8:05 ") == "08:05"
+    assert parse_time("25:00") is None
+    assert parse_time(None) is None
+
+
+def test_dias_e_rotulos():
+    assert is_report_day("diario", TUESDAY_9H)
+    assert is_report_day("semanal", MONDAY_9H)
+    assert not is_report_day("semanal", TUESDAY_9H)
+    assert schedule_label("diario") == "todo dia"
+    assert schedule_label("semanal") == "toda segunda"
+
+
+def test_entregas_pendentes():
+    record = {
+        "report_subscriptions": {
+            "diario": {"time": "08:00", "chat_id": 10},
+            "semanal": {"time": "10:00", "chat_id": 10},
+            "removido": {"time": "00:00", "chat_id": 10},
+        }
+    }
+    assert due_deliveries(record, MONDAY_9H) == [("diario", 10)]
+    assert due_deliveries(record, MONDAY_9H.replace(hour=10)) == [("diario", 10), ("semanal", 10)]
+    assert due_deliveries(record, TUESDAY_9H.replace(hour=10)) == [("diario", 10)]
+
+
+def test_entrega_unica_por_dia():
+    record = {
+        "report_subscriptions": {"diario": {"time": "08:00", "chat_id": 10}},
+        "report_delivered": {"diario": "2025-04-07"},
+    }
+    assert due_deliveries(record, MONDAY_9H) == []
+    assert due_deliveries(record, TUESDAY_9H) == [("diario", 10)]
+
+
+def test_store_guarda_a_ultima_versao(tmp_path):
+    db = str(tmp_path / "estado.db")
+    store = ReportStore(db)
+    assert store.latest(1, "diario") is None
+
+    store.save(1, "diario", {"text": "v1"})
+    generated_at = store.save(1, "diario", {"text": "v2", "charts": ["url"]})
+    assert ReportStore(db).latest("1", "diario") == ({"text": "v2", "charts": ["url"]}, generated_at)
+    assert store.latest(2, "diario") is None
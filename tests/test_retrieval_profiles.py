@@ -0,0 +1,63 @@
+import logging
+
+import pytest
+
+import api_utils
+from retrieval_profiles import AUTO_PROFILE, PROFILES, classify_message, resolve_profile
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("Qual o CNPJ da loja centro?", "rapido"),
+    ("quanto gastei com uber ontem", "rapido"),
+    ("Faça um relatório de faturamento de 2025", "profundo"),
+    ("@agent mostre um gráfico de vendas", "profundo"),
+    ("Me explique como funciona o fechamento de caixa da loja", "equilibrado"),
+    ("Qual " + "detalhe " * 50, "profundo"),
+])
+def test_classificacao_por_mensagem(message, expected):
+    assert classify_message(message) == expected
+
+
+def test_perfil_fixado_prevalece():
+    assert resolve_profile({"retrieval_profile": "profundo"}, "Qual o CNPJ?") == "profundo"
+    assert resolve_profile({"retrieval_profile": AUTO_PROFILE}, "Qual o CNPJ?") == "rapido"
+    assert resolve_profile({}, "Qual o CNPJ?") == "rapido"
+
+
+def test_perfis_tem_os_parametros_da_busca():
+    for profile in PROFILES.values():
+        assert profile["topN"] > 0
+        assert 0 < profile["similarityThreshold"] < 1
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def test_configuracao_nao_aplicada_gera_um_aviso(monkeypatch, caplog):
+    monkeypatch.setattr(api_utils, "_UNAPPLIED_SETTINGS", set())
+    settings = PROFILES["rapido"]
+    # Servidor que não conhece searchPreference e devolve o workspace sem o campo
+    applied = {key: value for key, value in settings.items() if key != "searchPreference"}
+    monkeypatch.setattr(api_utils, "api_request", lambda *args, **kwargs: FakeResponse({"workspace": applied}))
+
+    with caplog.at_level(logging.WARNING, logger="api_utils"):
+        assert api_utils.update_workspace_settings("ws", settings)
+        assert api_utils.update_workspace_settings("ws", settings)
+    warnings = [record.getMessage() for record in caplog.records if record.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert "searchPreference='speed_optimized'" in warnings[0]
+
+
+def test_configuracao_aplicada_nao_gera_aviso(monkeypatch, caplog):
+    monkeypatch.setattr(api_utils, "_UNAPPLIED_SETTINGS", set())
+    settings = PROFILES["profundo"]
+    monkeypatch.setattr(api_utils, "api_request", lambda *args, **kwargs: FakeResponse({"workspace": dict(settings)}))
+
+    with caplog.at_level(logging.WARNING, logger="api_utils"):
+        assert api_utils.update_workspace_settings("ws", settings)
+    assert not [record for record in caplog.records if record.levelno == logging.WARNING]
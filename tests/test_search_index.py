@@ -0,0 +1,51 @@
+import sqlite3
+
+from search_index import DocumentIndex, build_match_query
+
+
+def test_palavras_entre_aspas_e_ultima_como_prefixo():
+    assert build_match_query("faturamento março") == '"faturamento" "março"*'
+
+
+def test_operadores_e_aspas_do_usuario_sao_neutralizados():
+    assert build_match_query('a" OR "b* -c') == '"a" "OR" "b" "c"*'
+
+
+def test_consulta_sem_palavras():
+    assert build_match_query("  ?! ") is None
+
+
+def test_reindexar_substitui_o_conteudo(tmp_path):
+    index = DocumentIndex(str(tmp_path / "estado.db"))
+    index.index_document(1, "Ochozn/ata.txt", "Reunião sobre faturamento de março")
+    index.index_document(1, "Ochozn/ata.txt", "Reunião sobre orçamento de abril")
+
+    assert index.search(1, "faturamento") == []
+    assert [name for name, _ in index.search(1, "orcamento")] == ["Ochozn/ata.txt"]
+
+
+def test_busca_restrita_ao_usuario_e_remocao(tmp_path):
+    index = DocumentIndex(str(tmp_path / "estado.db"))
+    index.index_document(1, "Ochozn/a.txt", "faturamento da loja centro")
+    index.index_document(1, "Ochozn/b.txt", "faturamento da loja norte")
+    index.index_document(2, "maria/c.txt", "faturamento da loja sul")
+
+    assert sorted(name for name, _ in index.search(1, "fatura")) == ["Ochozn/a.txt", "Ochozn/b.txt"]
+    index.remove_documents(["Ochozn/a.txt"])
+    assert [name for name, _ in index.search(1, "fatura")] == ["Ochozn/b.txt"]
+    assert [name for name, _ in index.search(2, "fatura")] == ["maria/c.txt"]
+
+
+def test_indice_antigo_ganha_a_tabela_de_rowids(tmp_path):
+    db = str(tmp_path / "estado.db")
+    with sqlite3.connect(db) as conn:
+        conn.execute(
+            "CREATE VIRTUAL TABLE document_chunks USING fts5("
+            "chunk, file_name UNINDEXED, user_id UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+        )
+        conn.execute("INSERT INTO document_chunks VALUES ('faturamento antigo', 'Ochozn/a.txt', '1')")
+
+    index = DocumentIndex(db)
+    assert [name for name, _ in index.search(1, "faturamento")] == ["Ochozn/a.txt"]
+    index.remove_documents(["Ochozn/a.txt"])
+    assert index.search(1, "faturamento") == []
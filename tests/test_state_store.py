@@ -0,0 +1,47 @@
+import json
+
+from state_store import SharedMap
+
+
+def test_valores_simples_sao_lidos_do_banco(tmp_path):
+    db = str(tmp_path / "estado.db")
+    files = SharedMap(db, "files")
+    files["Ochozn/a.pdf"] = "custom-documents/a.json"
+
+    other_process = SharedMap(db, "files")
+    assert other_process["Ochozn/a.pdf"] == "custom-documents/a.json"
+    assert "Ochozn/a.pdf" in other_process
+    assert len(other_process) == 1
+
+    del other_process["Ochozn/a.pdf"]
+    assert "Ochozn/a.pdf" not in files
+
+
+def test_alteracoes_aninhadas_sao_gravadas_no_flush(tmp_path):
+    db = str(tmp_path / "estado.db")
+    users = SharedMap(db, "users")
+    users["1"] = {"workspace": "ws", "threads": {}}
+    users["1"]["threads"]["s1"] = "Chat 1"
+    users.flush()
+
+    assert SharedMap(db, "users")["1"]["threads"] == {"s1": "Chat 1"}
+
+
+def test_remover_chave_inexistente_levanta_keyerror(tmp_path):
+    files = SharedMap(str(tmp_path / "estado.db"), "files")
+    try:
+        del files["nada"]
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("esperava KeyError")
+
+
+def test_seed_importado_so_com_tabela_vazia(tmp_path):
+    db = str(tmp_path / "estado.db")
+    seed = tmp_path / "file_map.json"
+    seed.write_text(json.dumps({"a": "doc-a"}))
+    assert dict(SharedMap(db, "files", seed_file=str(seed))) == {"a": "doc-a"}
+
+    seed.write_text(json.dumps({"b": "doc-b"}))
+    assert dict(SharedMap(db, "files", seed_file=str(seed))) == {"a": "doc-a"}
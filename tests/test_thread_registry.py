@@ -0,0 +1,51 @@
+from thread_registry import MAX_THREADS, add_thread, new_session_id, select_thread, thread_page
+
+
+def make_record():
+    return {"threads": {}, "thread_context": {}}
+
+
+def test_session_ids_unicos():
+    assert len({new_session_id(1) for _ in range(100)}) == 100
+
+
+def test_add_e_select_por_numero():
+    record = make_record()
+    add_thread(record, "Chat 1", "s1")
+    add_thread(record, "Chat 2", "s2")
+    assert record["active_thread"] == "s2"
+
+    assert select_thread(record, 1) == "s1"
+    assert record["active_thread"] == "s1"
+    assert select_thread(record, 3) is None
+
+
+def test_threads_antigas_sao_arquivadas():
+    record = make_record()
+    for index in range(MAX_THREADS):
+        assert add_thread(record, f"Chat {index}", f"s{index}") == []
+    record["thread_context"]["s0"] = {"tokens": 10}
+
+    assert add_thread(record, "Nova", "nova") == ["s0"]
+    assert len(record["threads"]) == MAX_THREADS
+    assert "s0" not in record["thread_context"]
+    assert record["archived_threads"] == [["s0", "Chat 0"]]
+
+
+def test_ordem_recriada_para_registros_antigos():
+    record = {"threads": {"a": "A", "b": "B"}}
+    assert select_thread(record, 2) == "b"
+    assert record["thread_order"] == ["a", "b"]
+
+
+def test_paginacao_limita_a_pagina():
+    record = make_record()
+    for index in range(12):
+        add_thread(record, f"Chat {index}", f"s{index}")
+
+    entries, page, total = thread_page(record, 2, page_size=5)
+    assert (page, total) == (2, 3)
+    assert entries[0] == (6, "s5", "Chat 5")
+
+    _, page, _ = thread_page(record, 99, page_size=5)
+    assert page == 3
@@ -0,0 +1,104 @@
+import json
+import sqlite3
+
+from user_store import UserRecord, UserStore
+
+
+def stored_value(db, user_id):
+    with sqlite3.connect(db) as conn:
+        row = conn.execute("SELECT value FROM users WHERE key = ?", (user_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def test_registro_mantem_interface_de_dict():
+    record = UserRecord.from_dict({"workspace": "ws", "custom": 1})
+    assert record["workspace"] == "ws"
+    assert record.get("active_thread") is None
+    assert "custom" in record and "active_thread" not in record
+    assert record.setdefault("threads", {}) == {}
+    assert record.to_dict() == {"workspace": "ws", "threads": {}, "custom": 1}
+
+
+def test_lru_limitado_grava_ao_descartar(tmp_path):
+    db = str(tmp_path / "estado.db")
+    store = UserStore(db, capacity=2)
+    for user_id in ("1", "2"):
+        store[user_id] = {"workspace": f"ws{user_id}", "threads": {}}
+
+    store["1"]["threads"]["s1"] = "Chat 1"
+    assert stored_value(db, "1")["threads"] == {}
+    store["3"] = {"workspace": "ws3"}
+
+    # "2" foi acessado antes de "1" e sai primeiro; "1" continua em memória
+    assert list(store._records) == ["1", "3"]
+    store["4"] = {"workspace": "ws4"}
+    assert stored_value(db, "1")["threads"] == {"s1": "Chat 1"}
+    assert len(store._records) == 2
+
+
+def test_registro_descartado_ainda_referenciado_e_reaproveitado(tmp_path):
+    store = UserStore(str(tmp_path / "estado.db"), capacity=1)
+    store["1"] = {"workspace": "ws1"}
+    held = store["1"]
+    store["2"] = {"workspace": "ws2"}
+
+    held["active_thread"] = "s9"
+    assert store["1"] is held
+    assert store["1"]["active_thread"] == "s9"
+
+
+def test_flush_grava_so_registros_alterados(tmp_path):
+    db = str(tmp_path / "estado.db")
+    store = UserStore(db)
+    store["1"] = {"workspace": "ws1"}
+    store["2"] = {"workspace": "ws2"}
+    assert store.flush() == 0
+
+    store["2"]["report_subscriptions"] = {"diario": {"time": "08:00", "chat_id": 2}}
+    assert store.flush() == 1
+    assert store.keys_with("report_subscriptions") == ["2"]
+
+    store.close()
+    reopened = UserStore(db)
+    assert reopened["2"]["report_subscriptions"]["diario"]["time"] == "08:00"
+    assert reopened["1"].to_dict() == {"workspace": "ws1"}
+
+
+def test_flush_serializa_so_os_registros_tocados(tmp_path, monkeypatch):
+    store = UserStore(str(tmp_path / "estado.db"))
+    for user_id in range(50):
+        store[str(user_id)] = {"workspace": f"ws{user_id}"}
+    for user_id in range(50):
+        store[str(user_id)]
+    store.flush()
+
+    serialized = []
+    original = UserRecord.to_dict
+    monkeypatch.setattr(UserRecord, "to_dict", lambda self: serialized.append(self.workspace) or original(self))
+    store["7"]["active_thread"] = "s1"
+    assert store.flush() == 1
+    assert serialized == ["ws7"]
+
+
+def test_referencia_guardada_atraves_de_um_flush(tmp_path):
+    db = str(tmp_path / "estado.db")
+    store = UserStore(db)
+    store["1"] = {"workspace": "ws1", "thread_context": {}}
+    record = store["1"]
+    # Outro handler salva enquanto este ainda aguarda a resposta do LLM
+    store.flush()
+
+    record["thread_context"]["s1"] = {"tokens": 120}
+    assert store.flush() == 0
+    store.mark_dirty("1")
+    assert store.flush() == 1
+    assert stored_value(db, "1")["thread_context"] == {"s1": {"tokens": 120}}
+
+
+def test_keys_with_consulta_o_campo_e_nao_o_texto(tmp_path):
+    store = UserStore(str(tmp_path / "estado.db"))
+    store["1"] = {"workspace": "ws1", "report_subscriptions": {"diario": {"time": "08:00", "chat_id": 1}}}
+    store["2"] = {"workspace": "ws2", "report_subscriptions": {}}
+    store["3"] = {"workspace": "ws3", "thread_context": {"nota": {"report_subscriptions": {"diario": 1}}}}
+    store["4"] = {"workspace": "ws4", "custom": {"report_subscriptions": {"x": 1}}, "report_subscriptions": None}
+    assert store.keys_with("report_subscriptions") == ["1"]
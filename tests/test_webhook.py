@@ -0,0 +1,99 @@
+import asyncio
+import json
+import queue
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+from webhook import UserOrderedDispatcher, _WebhookHandler, extract_shard_key, shard_for
+
+
+def test_chave_do_shard_e_o_remetente():
+    message = {"update_id": 10, "message": {"from": {"id": 42}, "chat": {"id": -100}}}
+    callback = {"update_id": 11, "callback_query": {"from": {"id": 7}, "message": {"chat": {"id": 99}}}}
+    assert extract_shard_key(message) == 42
+    assert extract_shard_key(callback) == 7
+
+
+def test_chave_cai_no_chat_e_depois_no_update_id():
+    channel_post = {"update_id": 12, "channel_post": {"chat": {"id": -5}}}
+    assert extract_shard_key(channel_post) == -5
+    assert extract_shard_key({"update_id": 13, "poll": {"id": "p1"}}) == 13
+
+
+def test_mesmo_usuario_sempre_no_mesmo_shard():
+    updates = [{"update_id": i, "message": {"from": {"id": 1001}, "text": str(i)}} for i in range(20)]
+    assert {shard_for(update, 4) for update in updates} == {1001 % 4}
+
+
+def test_receptor_encaminha_para_a_fila_do_shard():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _WebhookHandler)
+    server.url_path = "/telegram"
+    server.secret_token = "segredo"
+    server.queues = [queue.Queue() for _ in range(3)]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def post(path, data, token="segredo"):
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{server.server_address[1]}{path}", data=json.dumps(data).encode(),
+            headers={"X-Telegram-Bot-Api-Secret-Token": token}, method="POST"
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=5).status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    try:
+        update = {"update_id": 1, "message": {"from": {"id": 5}, "text": "oi"}}
+        assert post("/telegram", update) == 200
+        assert post("/telegram", update, token="errado") == 403
+        assert post("/outro", update) == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert json.loads(server.queues[5 % 3].get_nowait()) == update
+    assert all(q.empty() for q in server.queues)
+
+
+def test_dispatcher_preserva_ordem_por_usuario():
+    order = []
+
+    async def handle(key, value, delay):
+        await asyncio.sleep(delay)
+        order.append((key, value))
+
+    async def main():
+        dispatcher = UserOrderedDispatcher(max_concurrency=4)
+        # O primeiro update do usuário 1 é o mais lento, mas o segundo espera por ele
+        dispatcher.dispatch(1, lambda: handle(1, "a", 0.05))
+        dispatcher.dispatch(1, lambda: handle(1, "b", 0))
+        dispatcher.dispatch(2, lambda: handle(2, "c", 0.01))
+        await dispatcher.drain()
+
+    asyncio.run(main())
+    assert order == [(2, "c"), (1, "a"), (1, "b")]
+
+
+def test_dispatcher_limita_concorrencia_e_libera_chaves():
+    running = 0
+    peak = 0
+
+    async def handle():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def main():
+        dispatcher = UserOrderedDispatcher(max_concurrency=2)
+        for key in range(6):
+            dispatcher.dispatch(key, handle)
+        await dispatcher.drain()
+        return dispatcher._tails
+
+    assert asyncio.run(main()) == {}
+    assert peak == 2
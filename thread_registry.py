@@ -0,0 +1,71 @@
+"""Registro das threads de chat de cada usuário.
+
+O registro do usuário (em USER_WORKSPACE_MAP) guarda as threads em "threads"
+(session_id -> nome) e a ordem em "thread_order", para selecionar pelo número
+em O(1). Acima de MAX_THREADS as mais antigas são arquivadas: saem da lista,
+ficam só em "archived_threads" (limitado) e devem ter o histórico resetado no
+AnythingLLM.
+"""
+import math
+import os
+import time
+import uuid
+
+MAX_THREADS = int(os.getenv("MAX_THREADS", "20"))
+ARCHIVED_THREADS_LIMIT = int(os.getenv("ARCHIVED_THREADS_LIMIT", "50"))
+THREADS_PAGE_SIZE = 10
+
+
+def new_session_id(user_id):
+    # O sufixo aleatório evita colisão entre threads criadas no mesmo segundo
+    return f"telegram-{user_id}-thread-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+
+
+def thread_order(record):
+    """Retorna a lista ordenada de session_ids, criando-a para registros antigos."""
+    order = record.get("thread_order")
+    if order is None or len(order) != len(record["threads"]):
+        order = record["thread_order"] = list(record["threads"])
+    return order
+
+
+def add_thread(record, name, session_id):
+    """Adiciona e ativa uma thread. Retorna os session_ids arquivados para reset no servidor."""
+    order = thread_order(record)
+    record["threads"][session_id] = name
+    order.append(session_id)
+    record["active_thread"] = session_id
+
+    archived = []
+    while len(order) > MAX_THREADS:
+        old_session_id = order.pop(0)
+        archived.append([old_session_id, record["threads"].pop(old_session_id)])
+        record.get("thread_context", {}).pop(old_session_id, None)
+    if archived:
+        history = record.setdefault("archived_threads", [])
+        history.extend(archived)
+        del history[:-ARCHIVED_THREADS_LIMIT]
+    return [session_id for session_id, _ in archived]
+
+
+def select_thread(record, number):
+    """Ativa a thread de número number (1 = mais antiga). Retorna o session_id ou None se não existir."""
+    order = thread_order(record)
+    if not 1 <= number <= len(order):
+        return None
+    session_id = order[number - 1]
+    record["active_thread"] = session_id
+    return session_id
+
+
+def thread_page(record, page, page_size=THREADS_PAGE_SIZE):
+    """Retorna ([(número, session_id, nome)], página, total de páginas), com a página limitada ao intervalo válido."""
+    order = thread_order(record)
+    total_pages = max(1, math.ceil(len(order) / page_size))
+    page = min(max(page, 1), total_pages)
+    start = (page - 1) * page_size
+    entries = [
+        (start + offset + 1, session_id, record["threads"][session_id])
+        for offset, session_id in enumerate(order[start:start + page_size])
+    ]
+    return entries, page, total_pages
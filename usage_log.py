@@ -0,0 +1,106 @@
+"""Registro de uso do chat do AnythingLLM para planejamento de capacidade.
+
+Cada chamada ao /chat vira uma linha compacta em SQLite (horário, workspace,
+sessão, tamanhos da mensagem e da resposta, fontes, gráfico, tempo e se deu
+erro). Linhas mais antigas que USAGE_RETENTION_DAYS são apagadas de tempos em
+tempos. Chamadas acima de SLOW_QUERY_SECONDS vão também para o log de
+consultas lentas (logger "anythingllm.slow").
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("anythingllm.slow")
+
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "20"))
+USAGE_RETENTION_DAYS = float(os.getenv("USAGE_RETENTION_DAYS", "90"))
+PREVIEW_CHARS = 80
+PRUNE_EVERY = 1000
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class UsageLog:
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_usage ("
+                "ts REAL NOT NULL, workspace TEXT NOT NULL, session TEXT, message_chars INTEGER NOT NULL, "
+                "response_chars INTEGER NOT NULL, sources INTEGER NOT NULL, chart INTEGER NOT NULL, "
+                "wall_ms INTEGER NOT NULL, ok INTEGER NOT NULL, preview TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chat_usage_ws_ts ON chat_usage (workspace, ts)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chat_usage_ts ON chat_usage (ts)")
+
+    def record(self, workspace, session, message, data, wall_time, ok=True):
+        """Registra uma chamada ao /chat; data é o JSON da resposta (ou {} em caso de erro)."""
+        text = data.get("textResponse") or ""
+        chart = bool(data.get("chart") or data.get("charts")) or "quickchart.io/chart" in text
+        row = (
+            time.time(), workspace, session, len(message), len(text), len(data.get("sources") or []),
+            int(chart), int(wall_time * 1000), int(ok), " ".join(message.split())[:PREVIEW_CHARS]
+        )
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO chat_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self._inserts += 1
+            if self._inserts % PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM chat_usage WHERE ts < ?", (time.time() - USAGE_RETENTION_DAYS * 86400,))
+
+        if wall_time >= SLOW_QUERY_SECONDS:
+            slow_logger.warning(
+                f"Consulta lenta: {wall_time:.1f}s no workspace {workspace} (sessão {session}), "
+                f"{len(message)} caracteres enviados, {len(text)} recebidos, {row[5]} fontes: '{row[9]}'"
+            )
+
+    def summary(self, since, workspace=None):
+        """Totais do período: chamadas, erros, gráficos, tempos (total, médio, p90, máximo) e tamanhos médios."""
+        query = "SELECT wall_ms, ok, chart, message_chars, response_chars, sources FROM chat_usage WHERE ts >= ?"
+        params = [since]
+        if workspace:
+            query += " AND workspace = ?"
+            params.append(workspace)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        count = len(rows)
+        walls = [row[0] for row in rows]
+        return {
+            "calls": count,
+            "errors": sum(1 for row in rows if not row[1]),
+            "charts": sum(row[2] for row in rows),
+            "total_ms": sum(walls),
+            "avg_ms": sum(walls) // count if count else 0,
+            "p90_ms": percentile(walls, 90),
+            "max_ms": max(walls) if walls else 0,
+            "avg_message_chars": sum(row[3] for row in rows) // count if count else 0,
+            "avg_response_chars": sum(row[4] for row in rows) // count if count else 0,
+            "avg_sources": round(sum(row[5] for row in rows) / count, 1) if count else 0,
+        }
+
+    def slowest(self, since, limit=10):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT ts, workspace, wall_ms, message_chars, response_chars, sources, preview "
+                "FROM chat_usage WHERE ts >= ? ORDER BY wall_ms DESC LIMIT ?",
+                (since, limit)
+            ).fetchall()
+
+    def top_workspaces(self, since, limit=10):
+        """Workspaces com maior tempo total de LLM: [(workspace, chamadas, total_ms, máximo_ms)]."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT workspace, COUNT(*), SUM(wall_ms), MAX(wall_ms) FROM chat_usage WHERE ts >= ? "
+                "GROUP BY workspace ORDER BY SUM(wall_ms) DESC LIMIT ?",
+                (since, limit)
+            ).fetchall()
@@ -0,0 +1,248 @@
+"""Registros de usuário carregados sob demanda, com cache LRU limitado e write-back.
+
+Os registros ficam no SQLite (tabela "users", no mesmo formato do SharedMap) e
+só são lidos quando o usuário aparece. Em memória, cada um é um UserRecord
+(dataclass com __slots__) que mantém a interface de dict usada no bot
+(record["workspace"], record.get(...), record.setdefault(...)).
+
+Um registro entra no conjunto de pendentes quando é lido (quem o lê pode
+alterá-lo, inclusive de forma aninhada: record["threads"][sid] = nome) ou
+marcado com mark_dirty(). flush() serializa só os pendentes e grava os que
+mudaram desde a última gravação, então o custo de cada flush é proporcional
+aos usuários tocados desde o anterior, não ao tamanho do cache. Quem guarda o
+registro através de um await deve marcá-lo antes de salvar (save_user_map faz
+isso com o user_id). Um registro que sai do LRU é gravado antes de ser
+descartado; se alguma corrotina ainda tiver uma referência a ele, o mesmo
+objeto é reaproveitado no próximo acesso, então não surgem duas cópias do
+mesmo usuário.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from dataclasses import dataclass, fields
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1000"))
+
+_MISSING = object()
+
+
+@dataclass
+class UserRecord:
+    """Registro de um usuário. Campos ausentes ficam como None; chaves desconhecidas vão para extra."""
+
+    __slots__ = (
+        "user_id", "username", "first_name", "workspace", "active_thread", "threads", "thread_order",
+        "thread_context", "archived_threads", "retrieval_profile", "applied_profile",
+        "report_subscriptions", "report_delivered", "extra", "_stored", "__weakref__"
+    )
+
+    user_id: object
+    username: object
+    first_name: object
+    workspace: object
+    active_thread: object
+    threads: object
+    thread_order: object
+    thread_context: object
+    archived_threads: object
+    retrieval_profile: object
+    applied_profile: object
+    report_subscriptions: object
+    report_delivered: object
+    extra: dict
+
+    @classmethod
+    def from_dict(cls, data):
+        known = {name: data.get(name) for name in FIELD_NAMES}
+        record = cls(**known, extra={key: value for key, value in data.items() if key not in FIELD_NAMES})
+        record._stored = None
+        return record
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in FIELD_ORDER if getattr(self, name) is not None}
+        data.update(self.extra)
+        return data
+
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in FIELD_NAMES else self.extra.get(key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in FIELD_NAMES:
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def setdefault(self, key, default=None):
+        value = self.get(key)
+        if value is None:
+            self[key] = value = default
+        return value
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        if key in FIELD_NAMES:
+            setattr(self, key, None)
+        else:
+            self.extra.pop(key, None)
+        return value
+
+
+FIELD_ORDER = tuple(field.name for field in fields(UserRecord) if field.name != "extra")
+FIELD_NAMES = frozenset(FIELD_ORDER)
+
+
+class UserStore(MutableMapping):
+    """USER_WORKSPACE_MAP com leitura sob demanda do SQLite e no máximo capacity registros em cache."""
+
+    def __init__(self, db_path, table="users", capacity=USER_CACHE_SIZE, seed_file=None):
+        self.db_path = db_path
+        self.table = table
+        self.capacity = capacity
+        self._lock = threading.RLock()
+        self._records = OrderedDict()  # user_id -> UserRecord, do menos para o mais recente
+        self._evicted = weakref.WeakValueDictionary()
+        self._dirty = set()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if seed_file:
+            self._seed_from_json(seed_file)
+
+    def _seed_from_json(self, seed_file):
+        """Importa o user_map.json legado só quando a tabela está vazia."""
+        if not os.path.exists(seed_file) or len(self):
+            return
+        with open(seed_file, "r") as f:
+            data = json.load(f)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO {self.table} (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in data.items()]
+            )
+        logger.info(f"{len(data)} usuários importados de {seed_file} para {self.db_path}:{self.table}")
+
+    def _write(self, items):
+        """Grava [(user_id, registro)] cujo JSON mudou desde a última gravação."""
+        changed = []
+        for key, record in items:
+            data = json.dumps(record.to_dict())
+            if data != getattr(record, "_stored", None):
+                changed.append((key, data, record))
+        if changed:
+            with self._conn:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                    [(key, data) for key, data, _ in changed]
+                )
+            for _, data, record in changed:
+                record._stored = data
+        return len(changed)
+
+    def _cache(self, key, record):
+        self._records[key] = record
+        while len(self._records) > self.capacity:
+            old_key, old_record = self._records.popitem(last=False)
+            self._write([(old_key, old_record)])
+            self._dirty.discard(old_key)
+            self._evicted[old_key] = old_record
+
+    def __getitem__(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                self._records.move_to_end(key)
+                self._dirty.add(key)
+                return record
+            record = self._evicted.pop(key, None)
+            if record is None:
+                row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    raise KeyError(key)
+                # O JSON de referência é o normalizado, para que a ordem das chaves não conte como alteração
+                record = UserRecord.from_dict(json.loads(row[0]))
+                record._stored = json.dumps(record.to_dict())
+            self._dirty.add(key)
+            self._cache(key, record)
+            return record
+
+    def __setitem__(self, key, value):
+        record = value if isinstance(value, UserRecord) else UserRecord.from_dict(value)
+        with self._lock:
+            self._evicted.pop(key, None)
+            self._write([(key, record)])
+            self._cache(key, record)
+
+    def __delitem__(self, key):
+        with self._lock, self._conn:
+            self._records.pop(key, None)
+            self._evicted.pop(key, None)
+            self._dirty.discard(key)
+            cursor = self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._records or key in self._evicted:
+                return True
+            return self._conn.execute(f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self):
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute(f"SELECT key FROM {self.table}")]
+        return iter(keys)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def mark_dirty(self, key):
+        """Inclui o registro no próximo flush (ex.: alterado por uma referência obtida antes de um await)."""
+        with self._lock:
+            if key in self._records:
+                self._dirty.add(key)
+
+    def flush(self, everything=False):
+        """Grava os registros pendentes que mudaram (ou, com everything, todos os em memória)."""
+        with self._lock:
+            if everything:
+                pending = list(self._records.items()) + list(self._evicted.items())
+            else:
+                # Os descartados ainda vivos são poucos: só os que alguma corrotina ainda usa
+                pending = [(key, self._records[key]) for key in self._dirty if key in self._records]
+                pending.extend(self._evicted.items())
+            self._dirty.clear()
+            return self._write(pending)
+
+    def keys_with(self, field):
+        """IDs dos usuários em que o campo é um dict não vazio, consultando o banco sem carregar os registros."""
+        self.flush()
+        path = f'$."{field}"'
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key FROM {self.table} WHERE json_type(value, ?) = 'object' AND json_extract(value, ?) <> '{{}}'",
+                (path, path)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.flush(everything=True)
+        self._conn.close()
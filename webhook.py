@@ -0,0 +1,182 @@
+"""Modo webhook com vários processos de trabalho.
+
+Um receptor HTTP local (atrás de um proxy HTTPS) recebe os updates do
+Telegram e os distribui entre N processos pelo ID do usuário, de modo que
+todos os updates de um mesmo usuário caiam sempre no mesmo processo e sejam
+tratados em ordem. O webhook é registrado com max_connections=1 para que o
+Telegram entregue os updates um de cada vez, na ordem de update_id. O estado (USER_WORKSPACE_MAP e FILE_MAP) fica em um
+banco SQLite compartilhado em vez de variáveis globais.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API = "https://api.telegram.org"
+
+
+def extract_shard_key(update_data):
+    """Retorna o ID do usuário (ou do chat) de um update bruto do Telegram."""
+    for key, value in update_data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return int(sender["id"])
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+    return int(update_data.get("update_id", 0))
+
+
+def shard_for(update_data, workers):
+    return extract_shard_key(update_data) % workers
+
+
+class UserOrderedDispatcher:
+    """Processa updates de usuários diferentes em paralelo, mas os de um mesmo usuário em ordem."""
+
+    def __init__(self, max_concurrency):
+        self._tails = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def dispatch(self, key, coro_factory):
+        previous = self._tails.get(key)
+
+        async def run():
+            if previous is not None:
+                await asyncio.wait([previous])
+            async with self._semaphore:
+                await coro_factory()
+
+        task = asyncio.create_task(run())
+        self._tails[key] = task
+        task.add_done_callback(lambda t: self._tails.pop(key, None) if self._tails.get(key) is t else None)
+        return task
+
+    async def drain(self):
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+async def _run_worker(bot_module, index, workers, queue, concurrency):
+    from telegram import Update
+
+    app = bot_module.build_application()
+    dispatcher = UserOrderedDispatcher(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def process(update):
+        try:
+            await app.process_update(update)
+        except Exception as e:
+            logger.error(f"Erro ao processar update {update.update_id} no worker {index}: {str(e)}")
+
+    async with app:
+        await app.start()
+        await bot_module.on_startup(app, shard=(index, workers))
+        logger.info(f"Worker {index} pronto.")
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is None:
+                break
+            try:
+                data = json.loads(raw)
+                update = Update.de_json(data, app.bot)
+            except Exception as e:
+                logger.error(f"Update inválido descartado no worker {index}: {str(e)}")
+                continue
+            dispatcher.dispatch(extract_shard_key(data), lambda update=update: process(update))
+        await dispatcher.drain()
+        await app.stop()
+    logger.info(f"Worker {index} encerrado.")
+
+
+def _worker_main(index, workers, queue, db_path, concurrency):
+    # O encerramento é coordenado pelo processo principal via sentinela na fila
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import bot
+
+    bot.use_shared_state(db_path)
+    try:
+        asyncio.run(_run_worker(bot, index, workers, queue, concurrency))
+    finally:
+        # Grava os registros de usuário ainda pendentes no cache LRU
+        bot.close_shared_state()
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        server = self.server
+        if self.path.split("?", 1)[0] != server.url_path:
+            self._reply(404)
+            return
+        if server.secret_token and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != server.secret_token:
+            self._reply(403)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            self._reply(400)
+            return
+        server.queues[shard_for(data, len(server.queues))].put(body.decode("utf-8"))
+        self._reply(200)
+
+
+def set_telegram_webhook(token, webhook_url, secret_token=None):
+    # Uma conexão por vez: o Telegram só envia o próximo update depois da resposta
+    # ao anterior, então os updates de um usuário chegam às filas na ordem original
+    payload = {"url": webhook_url, "max_connections": 1}
+    if secret_token:
+        payload["secret_token"] = secret_token
+    response = requests.post(f"{TELEGRAM_API}/bot{token}/setWebhook", json=payload, timeout=30)
+    response.raise_for_status()
+    logger.info(f"Webhook registrado no Telegram: {webhook_url}")
+
+
+def run_webhook_cluster(token, webhook_url, listen, port, workers, db_path, secret_token=None, concurrency=8):
+    """Sobe o receptor HTTP e os processos de trabalho; bloqueia até o encerramento."""
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(workers)]
+    processes = [
+        ctx.Process(target=_worker_main, args=(i, workers, queues[i], db_path, concurrency), name=f"bot-worker-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    server = ThreadingHTTPServer((listen, port), _WebhookHandler)
+    server.daemon_threads = True
+    server.url_path = urllib.parse.urlparse(webhook_url).path or "/"
+    server.secret_token = secret_token
+    server.queues = queues
+
+    try:
+        set_telegram_webhook(token, webhook_url, secret_token)
+        logger.info(f"Receptor de webhook em http://{listen}:{port}{server.url_path} com {workers} workers.")
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Encerrando o receptor de webhook...")
+    finally:
+        server.server_close()
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=30)